@@ -1,34 +1,73 @@
 from flask import Flask, render_template
+from werkzeug.contrib.fixers import ProxyFix
 from flask.ext.bootstrap import Bootstrap
 from flask.ext.moment import Moment
-from flask.ext.sqlalchemy import SQLAlchemy
+from .database import TunedSQLAlchemy
 from config import config
 from flask.ext.login import LoginManager
-from flask.ext.mail import Mail
 from flask.ext.pagedown import PageDown
+from .renderer import MarkdownRenderer
+from .email import LazyMail, MailQueue
+from .buffers import LastSeenBuffer, GroupCommit
+from .cache import LRUCache
+from .response_cache import ResponseCache
+from .profiler import QueryProfiler
+from .templating import TemplateCache
+from .ratelimit import TokenBucketLimiter
 
 
 bootstrap = Bootstrap()
 moment = Moment()
-db = SQLAlchemy()
-mail = Mail()
+db = TunedSQLAlchemy()
+last_seen_buffer = LastSeenBuffer(db)
+group_commit = GroupCommit(db)
+mail = LazyMail()
+mail_queue = MailQueue()
 pagedown = PageDown()
+renderer = MarkdownRenderer()
+response_cache = ResponseCache()
+profiler = QueryProfiler()
+template_cache = TemplateCache()
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
 login_manager.login_view = 'auth.login'
+# 缓存登录用户及其角色的列值,user_loader命中时不查询数据库
+identity_cache = LRUCache()
+# API的HTTP Basic认证最近验证成功的密码,见passwords.is_cached
+credential_cache = LRUCache()
+login_limiter = TokenBucketLimiter()
 
 
-def create_app(config_name='default'):
+def create_app(config_name='default', blueprints=True):
+    """
+    :param blueprints: 不处理请求的命令行工具可以传入False,不导入和注册视图蓝本
+    """
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
+    if app.config.get('FLASK_PROXY_COUNT'):
+        # 只信任最近的FLASK_PROXY_COUNT层代理添加的X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, num_proxies=app.config['FLASK_PROXY_COUNT'])
     
     bootstrap.init_app(app)
     moment.init_app(app)
     db.init_app(app)
+    last_seen_buffer.init_app(app)
+    group_commit.init_app(app)
     login_manager.init_app(app)
+    identity_cache.maxsize = app.config['FLASK_IDENTITY_CACHE_SIZE']
+    credential_cache.maxsize = app.config['FLASK_CREDENTIAL_CACHE_SIZE']
+    login_limiter.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
     pagedown.init_app(app)
+    renderer.init_app(app)
+    response_cache.init_app(app)
+    profiler.init_app(app)
+    template_cache.init_app(app)
+
+    if not blueprints:
+        return app
 
     # 注册main蓝本
     from .main import main as main_blueprint
@@ -42,5 +81,8 @@ def create_app(config_name='default'):
     from .api_1_0 import api as api_1_0_blueprint
     app.register_blueprint(api_1_0_blueprint, url_prefix='/api/1.0')
 
+    if app.config['FLASK_TEMPLATE_PRELOAD']:
+        template_cache.compile(app)
+
     return app
 
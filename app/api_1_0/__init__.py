@@ -4,5 +4,4 @@ from flask import Blueprint
 api = Blueprint('api', __name__)
 
 
-from . import errors
-
+from . import authentication, posts, users, comments, search, errors
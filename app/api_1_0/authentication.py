@@ -1,8 +1,9 @@
 from flask.ext.httpauth import HTTPBasicAuth
+from .. import db, login_limiter, passwords
 from ..models import AnonymousUser, User
-from .errors import unauthorized, forbidden
+from .errors import unauthorized, forbidden, too_many_requests
 from . import api
-from flask import jsonify
+from flask import g, jsonify
 
 auth = HTTPBasicAuth()
 
@@ -10,6 +11,7 @@ auth = HTTPBasicAuth()
 @auth.verify_password
 def verify_password(email_or_token, password):
     """验证邮箱密码回调函数"""
+    g.rate_limited = False
     if email_or_token == '':
         g.current_user = AnonymousUser()
         return True
@@ -18,16 +20,32 @@ def verify_password(email_or_token, password):
         g.token_used = True
         return g.current_user is not None
     user = User.query.filter_by(email=email_or_token).first()
+    if user and passwords.is_cached(user, password):
+        g.token_used = False
+        g.current_user = user
+        return True
+    # 只有需要计算密码哈希时才消耗令牌
+    if not login_limiter.allow_login(email_or_token):
+        g.rate_limited = True
+        return False
     if not user:
         return False
     g.token_used = False
     g.current_user = user
-    return user.verify_password(password)
+    if not user.verify_password(password):
+        return False
+    login_limiter.login_succeeded(email_or_token)
+    if db.session.is_modified(user):
+        db.session.commit()
+    passwords.remember(user, password)
+    return True
 
 
 @auth.error_handler
 def auth_error():
     """验证错误函数"""
+    if g.get('rate_limited'):
+        return too_many_requests('Too many authentication attempts')
     return unauthorized('Invalid Credentials')
 
 
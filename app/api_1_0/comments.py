@@ -0,0 +1,50 @@
+from flask import jsonify, request, g, url_for, current_app
+from . import api
+from .decoraters import permission_required
+from .helpers import requested_fields, requested_ids, batch_response, collection_response
+from .. import db
+from ..models import Post, Comment, Permission
+
+
+def visible_comments():
+    """被管理员屏蔽的评论不通过api返回"""
+    return Comment.query.filter(db.or_(Comment.disable == None, Comment.disable == False))
+
+
+@api.route('/comments/')
+def get_all_comments():
+    """全部评论,支持?ids=, ?fields= 和 ?stream=1"""
+    ids = requested_ids()
+    if ids is not None:
+        return batch_response(Comment, 'comments', ids, visible_comments())
+    return collection_response(visible_comments(), (Comment.timestamp, Comment.id), 'comments',
+                               'api.get_all_comments', current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'])
+
+
+@api.route('/comments/<int:id>')
+def get_comment(id):
+    comment = visible_comments().filter(Comment.id == id).first_or_404()
+    return jsonify(comment.to_json(requested_fields()))
+
+
+@api.route('/posts/<int:id>/comments/')
+def get_comments(id):
+    """文章的评论"""
+    post = Post.query.get_or_404(id)
+    return collection_response(visible_comments().filter(Comment.post_id == post.id),
+                               (Comment.timestamp, Comment.id), 'comments', 'api.get_comments',
+                               current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'], id=id)
+
+
+@api.route('/posts/<int:id>/comments/', methods=['POST'])
+@permission_required(Permission.COMMENT)
+def new_comment(id):
+    post = Post.query.get_or_404(id)
+    comment = Comment.from_json(request.json or {})
+    comment.author = g.current_user
+    comment.post = post
+    db.session.add(comment)
+    db.session.commit()
+    db.stick_to_primary()
+    return jsonify(comment.to_json()), 201, \
+        {'Location': url_for('api.get_comment', id=comment.id, _external=True)}
@@ -1,4 +1,6 @@
 from flask import jsonify
+from . import api
+from ..exceptions import ValidationError
 
 
 def forbidden(message):
@@ -15,3 +17,24 @@ def unauthorized(message):
                         'message': message})
     response.status_code = 401
     return response
+
+
+def too_many_requests(message):
+    """429请求过于频繁"""
+    response = jsonify({'error': 'too many requests',
+                        'message': message})
+    response.status_code = 429
+    return response
+
+
+def bad_request(message):
+    """400请求错误"""
+    response = jsonify({'error': 'bad request',
+                        'message': message})
+    response.status_code = 400
+    return response
+
+
+@api.errorhandler(ValidationError)
+def validation_error(e):
+    return bad_request(e.args[0])
@@ -0,0 +1,88 @@
+from flask import current_app, request, url_for, jsonify, json, Response, stream_with_context
+from ..exceptions import ValidationError
+from ..pagination import KeysetPagination
+
+
+def requested_fields():
+    """?fields=title,timestamp 指定返回的字段,未指定时返回全部字段"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return set(field.strip() for field in fields.split(',') if field.strip())
+
+
+def requested_ids():
+    """?ids=1,2,3 批量获取,未指定时返回None"""
+    ids = request.args.get('ids')
+    if ids is None:
+        return None
+    try:
+        ids = [int(i) for i in ids.split(',') if i.strip()]
+    except ValueError:
+        raise ValidationError('ids must be a comma separated list of integers')
+    if len(ids) > current_app.config['FLASK_API_MAX_PER_PAGE']:
+        raise ValidationError('too many ids')
+    return ids
+
+
+def per_page(default):
+    """?per_page= 限制在1到FLASK_API_MAX_PER_PAGE之间"""
+    return max(1, min(request.args.get('per_page', default, type=int),
+                      current_app.config['FLASK_API_MAX_PER_PAGE']))
+
+
+def batch_response(model, key, ids, query=None):
+    """按ids一次IN查询取出资源,按请求中的顺序返回,不存在的id被忽略"""
+    query = query if query is not None else model.query
+    found = dict((item.id, item) for item in query.filter(model.id.in_(ids)))
+    fields = requested_fields()
+    return jsonify({key: [found[i].to_json(fields) for i in ids if i in found]})
+
+
+def collection_response(query, columns, key, endpoint, default_per_page, **kwargs):
+    """
+    按(timestamp, id)游标分页返回资源集合,不执行COUNT
+    ?stream=1 时以NDJSON流式返回全部资源
+    """
+    if request.args.get('stream'):
+        return stream_response(query, columns)
+    pagination = KeysetPagination(query, columns, per_page(default_per_page),
+                                  after=request.args.get('after') or None,
+                                  before=request.args.get('before') or None)
+    return pagination_response(pagination, key, endpoint, **kwargs)
+
+
+def pagination_response(pagination, key, endpoint, **kwargs):
+    """把一页游标分页结果和上一页/下一页的链接转化为json响应"""
+    fields = requested_fields()
+    args = dict(kwargs)
+    for name in ('fields', 'per_page'):
+        if request.args.get(name):
+            args[name] = request.args[name]
+    prev = next = None
+    if pagination.has_prev:
+        prev = url_for(endpoint, before=pagination.prev_cursor, _external=True, **args)
+    if pagination.has_next:
+        next = url_for(endpoint, after=pagination.next_cursor, _external=True, **args)
+    return jsonify({
+        key: [item.to_json(fields) for item in pagination.items],
+        'prev': prev,
+        'next': next,
+    })
+
+
+def stream_response(query, columns):
+    """以NDJSON逐行输出,按游标分块查询,内存占用与总数无关"""
+    fields = requested_fields()
+    chunk_size = current_app.config['FLASK_API_STREAM_CHUNK_SIZE']
+
+    def generate():
+        after = None
+        while True:
+            pagination = KeysetPagination(query, columns, chunk_size, after=after)
+            for item in pagination.items:
+                yield json.dumps(item.to_json(fields)) + '\n'
+            if not pagination.has_next:
+                break
+            after = pagination.next_cursor
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -1,3 +1,60 @@
+from flask import jsonify, request, g, url_for, current_app
 from . import api
+from .decoraters import permission_required
+from .errors import forbidden
+from .helpers import requested_fields, requested_ids, batch_response, collection_response
+from .. import db
+from ..models import Post, Permission
+from ..conditional import make_etag, not_modified, with_validators
 
 
+@api.route('/posts/')
+def get_posts():
+    """
+    文章列表,按发表时间倒序
+    ?ids=1,2,3 批量获取, ?fields=title,timestamp 只返回部分字段, ?stream=1 以NDJSON返回全部文章
+    """
+    ids = requested_ids()
+    if ids is not None:
+        return batch_response(Post, 'posts', ids)
+    return collection_response(Post.query, (Post.timestamp, Post.id), 'posts', 'api.get_posts',
+                               current_app.config['FLASK_POSTS_PER_PAGE_COUNT'])
+
+
+@api.route('/posts/<int:id>')
+def get_post(id):
+    post = Post.query.get_or_404(id)
+    fields = requested_fields()
+    etag = make_etag(post.id, post.title, post.body_hash, post.timestamp, post.author_id,
+                     post.comments_count, sorted(fields or []))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return with_validators(jsonify(post.to_json(fields)), etag)
+
+
+@api.route('/posts/', methods=['POST'])
+@permission_required(Permission.WRITE_ARTICLES)
+def new_post():
+    post = Post.from_json(request.json or {})
+    post.author = g.current_user
+    db.session.add(post)
+    db.session.commit()
+    db.stick_to_primary()
+    return jsonify(post.to_json()), 201, \
+        {'Location': url_for('api.get_post', id=post.id, _external=True)}
+
+
+@api.route('/posts/<int:id>', methods=['PUT'])
+@permission_required(Permission.WRITE_ARTICLES)
+def edit_post(id):
+    post = Post.query.get_or_404(id)
+    if g.current_user != post.author and not g.current_user.can(Permission.ADMINISTER):
+        return forbidden('Insufficient permissions')
+    json_post = request.json or {}
+    post.title = json_post.get('title', post.title)
+    post.body = json_post.get('body', post.body)
+    db.session.add(post)
+    db.session.commit()
+    db.stick_to_primary()
+    return jsonify(post.to_json())
@@ -0,0 +1,30 @@
+from flask import jsonify, request, url_for, current_app
+from . import api
+from .helpers import requested_fields, per_page
+from ..search import SearchResults
+
+
+@api.route('/search')
+def search():
+    """
+    搜索文章和评论, ?q=关键词&page=页码, 结果按BM25得分排序
+    ?fields= 对返回的文章和评论同样生效
+    """
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results = SearchResults(q, page, per_page(current_app.config['FLASK_POSTS_PER_PAGE_COUNT']))
+    fields = requested_fields()
+    args = dict((name, request.args[name]) for name in ('fields', 'per_page') if request.args.get(name))
+    prev = next = None
+    if results.has_prev:
+        prev = url_for('api.search', q=q, page=page - 1, _external=True, **args)
+    if results.has_next:
+        next = url_for('api.search', q=q, page=page + 1, _external=True, **args)
+    return jsonify({
+        'results': [{'kind': result['kind'],
+                     'score': result['score'],
+                     result['kind']: result['item'].to_json(fields)}
+                    for result in results.items],
+        'prev': prev,
+        'next': next,
+    })
@@ -0,0 +1,49 @@
+from flask import jsonify, request, g, current_app
+from . import api
+from .errors import forbidden
+from .helpers import requested_fields, requested_ids, batch_response, collection_response, \
+    pagination_response, per_page
+from ..models import User, Post
+from ..conditional import make_etag, not_modified, with_validators
+
+
+@api.route('/users/')
+def get_users():
+    """用户列表,只支持?ids=1,2,3批量获取"""
+    ids = requested_ids()
+    if ids is None:
+        ids = []
+    return batch_response(User, 'users', ids)
+
+
+@api.route('/users/<int:id>')
+def get_user(id):
+    user = User.query.get_or_404(id)
+    fields = requested_fields()
+    etag = make_etag(user.id, user.username, user.name, user.location, user.about_me,
+                     user.last_seen, user.posts_count, user.followers_count,
+                     user.followed_count, sorted(fields or []))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return with_validators(jsonify(user.to_json(fields)), etag)
+
+
+@api.route('/users/<int:id>/posts/')
+def get_user_posts(id):
+    user = User.query.get_or_404(id)
+    return collection_response(Post.query.filter_by(author_id=user.id), (Post.timestamp, Post.id),
+                               'posts', 'api.get_user_posts',
+                               current_app.config['FLASK_POSTS_PER_PAGE_COUNT'], id=id)
+
+
+@api.route('/users/<int:id>/timeline/')
+def get_user_timeline(id):
+    """关注的人发表的文章,只有本人可以查看"""
+    user = User.query.get_or_404(id)
+    if g.current_user.is_anonymous or g.current_user.id != user.id:
+        return forbidden('Insufficient permissions')
+    pagination = user.timeline(per_page(current_app.config['FLASK_POSTS_PER_PAGE_COUNT']),
+                               after=request.args.get('after') or None,
+                               before=request.args.get('before') or None)
+    return pagination_response(pagination, 'posts', 'api.get_user_timeline', id=id)
@@ -3,7 +3,7 @@ from flask.ext.login import login_user, logout_user, login_required, current_use
 from .forms import LoginForm, RegistrationForm, ChangePassword
 from . import auth
 from ..models import User
-from .. import db
+from .. import db, login_limiter
 from ..email import send_email
 from ..main.errors import internal_server_error
 
@@ -24,8 +24,15 @@ def login():
     """登录视图"""
     form = LoginForm()
     if form.validate_on_submit():
+        if not login_limiter.allow_login(form.email.data):
+            flash('Too many login attempts, please try again later.')
+            return render_template('auth/login.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.verify_password(form.password.data):
+            login_limiter.login_succeeded(form.email.data)
+            # 哈希参数变化时verify_password已经更新了password_hash
+            if db.session.is_modified(user):
+                db.session.commit()
             login_user(user, form.remember_me.data)
             return redirect(request.args.get('next') or url_for('main.index'))
         flash('Invalid username or password.')
@@ -102,6 +109,7 @@ def change_password():
     if form.validate_on_submit():
         if current_user.verify_password(form.old_password.data):
             current_user.password = form.new_password.data
+            current_user.revoke_auth_tokens()
             db.session.add(current_user)
             db.session.commit()
             flash('your password has been upgrade!')
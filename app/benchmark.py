@@ -0,0 +1,185 @@
+"""
+性能测试
+按不同规模生成数据,用测试客户端请求热点页面,统计吞吐量,延迟分位数和每个请求的SQL查询数,
+结果保存为json,与基准结果比较,延迟变慢超过容差或查询数增加时判定为性能回退
+"""
+import json
+import math
+import platform
+import time
+from datetime import datetime
+from . import create_app, db, last_seen_buffer
+
+
+SIZES = {
+    'tiny': dict(users=20, posts=100, comments=200, follows_per_user=5),
+    'small': dict(users=200, posts=2000, comments=5000, follows_per_user=10),
+    'medium': dict(users=2000, posts=20000, comments=50000, follows_per_user=20),
+    'large': dict(users=20000, posts=200000, comments=500000, follows_per_user=20),
+}
+
+
+class QueryCounter(object):
+    """统计引擎执行的SQL语句数"""
+
+    def __init__(self, engine):
+        self.count = 0
+        db.event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        self.engine = engine
+
+    def before_cursor_execute(self, *args):
+        self.count += 1
+
+    def remove(self):
+        db.event.remove(self.engine, 'before_cursor_execute', self.before_cursor_execute)
+
+
+def percentile(values, p):
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(int(math.ceil(p / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies, queries, elapsed):
+    return {
+        'iterations': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+        'queries': float(sum(queries)) / len(queries) if queries else 0.0,
+    }
+
+
+def measure(fn, counter, iterations, warmup):
+    """执行warmup次预热后计时执行iterations次"""
+    for i in range(warmup):
+        fn(i)
+    latencies, queries = [], []
+    started = time.time()
+    for i in range(iterations):
+        counter.count = 0
+        begin = time.time()
+        fn(warmup + i)
+        latencies.append(time.time() - begin)
+        queries.append(counter.count)
+    return summarize(latencies, queries, time.time() - started)
+
+
+def request(method, url, status, **kwargs):
+    """返回在指定客户端上发送请求的函数,响应状态不符时报错"""
+    def make(client):
+        def run(i):
+            response = client.open(url, method=method, **kwargs)
+            if response.status_code != status:
+                raise AssertionError('%s %s returned %d' % (method, url, response.status_code))
+        return run
+    return make
+
+
+def scenarios(app):
+    """需要测试的热点路径"""
+    from .models import User, Post
+    hot_post = Post.query.order_by(Post.comments_count.desc()).first()
+    per_page = app.config['FLASK_COMMENT_PER_PAGE_COUNT']
+    last_page = max((hot_post.comments_count - 1) // per_page + 1, 1)
+    author = User.query.order_by(User.posts_count.desc()).first()
+    popular = User.query.order_by(User.followers_count.desc()).first()
+    login = {'email': author.email, 'password': 'password'}
+
+    def render(client):
+        def run(i):
+            # 每次使用不同的正文,测量的是渲染而不是缓存命中
+            Post.change_body_to_html(Post(), '**benchmark** body %d http://example.com' % i, None, None)
+        return run
+
+    return [
+        ('index', request('GET', '/', 200)),
+        ('post_deep_page', request('GET', '/post/%d?page=%d' % (hot_post.id, last_page), 200)),
+        ('user', request('GET', '/user/%s' % author.username, 200)),
+        ('followers', request('GET', '/followers/%s' % popular.username, 200)),
+        ('login', request('POST', '/auth/login', 302, data=login)),
+        ('change_body_to_html', render),
+    ]
+
+
+def run_size(size, iterations=50, warmup=5, seed=1, config_name='benchmark_config'):
+    """
+    重建数据库并生成size规模的数据,逐个测试热点路径
+    :return: {场景名: 统计结果}
+    """
+    from .generate_fakedata import seed_data
+    app = create_app(config_name)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_data(seed=seed, workers=0, **SIZES[size])
+        results = {}
+        counter = QueryCounter(db.engine)
+        try:
+            for name, make in scenarios(app):
+                db.session.remove()
+                # 每个场景使用新的客户端,登录场景的cookie不会影响匿名页面
+                results[name] = measure(make(app.test_client()), counter, iterations, warmup)
+        finally:
+            counter.remove()
+            # 删除数据表前写回缓冲的访问时间,避免退出时写入已经删除的表
+            last_seen_buffer.flush()
+            db.session.remove()
+            db.drop_all()
+    return results
+
+
+def run(sizes, iterations=50, warmup=5, seed=1):
+    return {
+        'meta': {
+            'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'iterations': iterations,
+            'seed': seed,
+        },
+        'sizes': dict((size, run_size(size, iterations, warmup, seed)) for size in sizes),
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    与基准结果比较
+    p50和p90延迟超过基准的(1+tolerance)倍,或者平均查询数增加,都视为回退
+    :return: 回退的描述列表,为空表示没有回退
+    """
+    regressions = []
+    for size, scenarios in sorted(results['sizes'].items()):
+        for name, current in sorted(scenarios.items()):
+            base = baseline.get('sizes', {}).get(size, {}).get(name)
+            if base is None:
+                continue
+            for key in ('p50_ms', 'p90_ms'):
+                if current[key] > base[key] * (1 + tolerance):
+                    regressions.append('%s/%s %s: %.2f > %.2f' % (size, name, key, current[key], base[key]))
+            if current['queries'] > base['queries']:
+                regressions.append('%s/%s queries: %.1f > %.1f' % (size, name, current['queries'], base['queries']))
+    return regressions
+
+
+def report(results):
+    lines = ['%-8s %-22s %10s %9s %9s %9s %8s' % ('size', 'scenario', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'queries')]
+    for size, scenarios in sorted(results['sizes'].items()):
+        for name, r in sorted(scenarios.items()):
+            lines.append('%-8s %-22s %10.1f %9.2f %9.2f %9.2f %8.1f' % (
+                size, name, r['throughput'], r['p50_ms'], r['p90_ms'], r['p99_ms'], r['queries']))
+    return '\n'.join(lines)
+
+
+def save(results, path):
+    with open(path, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as fp:
+        return json.load(fp)
@@ -0,0 +1,183 @@
+import atexit
+import threading
+import time
+from sqlalchemy import bindparam
+
+
+class LastSeenBuffer(object):
+    """
+    User.last_seen的写缓冲
+    ping只记录在内存中,距离上次写回超过FLASK_LAST_SEEN_FLUSH_INTERVAL秒时,
+    用一条批量UPDATE把缓冲区中所有用户的时间写回,进程退出时也会写回一次
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self.app = None
+        self.interval = 60
+        self._pending = {}
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASK_LAST_SEEN_FLUSH_INTERVAL', 60)
+        self.app = app
+        self.interval = app.config['FLASK_LAST_SEEN_FLUSH_INTERVAL']
+        app.extensions['last_seen_buffer'] = self
+        if not self._registered:
+            atexit.register(self.flush)
+            self._registered = True
+
+    def touch(self, user_id, last_seen):
+        """记录用户最近访问时间,到达写回间隔时触发写回"""
+        with self._lock:
+            self._pending[user_id] = last_seen
+            due = time.time() - self._last_flush >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """把缓冲区写回数据库,返回写回的用户数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending or self.app is None:
+            return 0
+        users = self.db.metadata.tables['users']
+        statement = users.update().where(users.c.id == bindparam('_id')) \
+            .values(last_seen=bindparam('last_seen'))
+        # 使用独立连接写回,不提交请求中的session
+        with self.db.get_engine(self.app).begin() as connection:
+            connection.execute(statement, [{'_id': user_id, 'last_seen': last_seen}
+                                           for user_id, last_seen in pending.items()])
+        return len(pending)
+
+
+class PendingWrite(object):
+    """排队等待组提交的一次写入,提交完成(或失败)后done被设置"""
+
+    def __init__(self, write):
+        self.write = write
+        self.result = None
+        self.error = None
+        self.finished = False
+        self.done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished = True
+        self.done.set()
+
+
+class GroupCommit(object):
+    """
+    组提交
+    FLASK_GROUP_COMMIT开启后,并发请求的小写入排队,由第一个到达的请求作为leader
+    等待FLASK_GROUP_COMMIT_WINDOW秒(或攒够FLASK_GROUP_COMMIT_MAX_BATCH个)后在一个事务中执行并提交,
+    每个请求在自己的写入提交之后才返回,随后的重定向读主库,仍能看到自己刚写入的数据;
+    批量提交失败时逐个重新执行,一个请求的错误不影响同一批的其他请求
+    未开启时submit在请求的session中执行写入并立即提交
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self.enabled = False
+        self.window = 0.005
+        self.max_batch = 50
+        self._queue = []
+        self._leading = False
+        self._lock = threading.Lock()
+        self._full = threading.Condition(self._lock)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASK_GROUP_COMMIT', False)
+        app.config.setdefault('FLASK_GROUP_COMMIT_WINDOW', 0.005)
+        app.config.setdefault('FLASK_GROUP_COMMIT_MAX_BATCH', 50)
+        self.enabled = app.config['FLASK_GROUP_COMMIT']
+        self.window = app.config['FLASK_GROUP_COMMIT_WINDOW']
+        self.max_batch = app.config['FLASK_GROUP_COMMIT_MAX_BATCH']
+        pool_size = app.config.get('SQLALCHEMY_POOL_SIZE')
+        if pool_size:
+            # 排队的请求已经归还连接,但leader执行批量写入时其他请求仍在使用连接池,一批的大小不超过池的容量
+            capacity = pool_size + (app.config.get('SQLALCHEMY_MAX_OVERFLOW') or 0)
+            self.max_batch = max(1, min(self.max_batch, capacity - 1))
+        app.extensions['group_commit'] = self
+
+    def submit(self, write):
+        """
+        执行一次写入,返回时已经提交
+        :param write: write(session),只能通过传入的session读写,返回值作为submit的结果;
+                      开启组提交时session不是请求的session,需要按id引用已有的对象
+        """
+        if not self.enabled:
+            result = write(self.db.session)
+            self.db.session.commit()
+            return result
+        # 先结束请求session的事务,把连接还给连接池: 等待中的请求不占用连接,leader才能取到连接执行批量写入
+        self.db.session.commit()
+        pending = PendingWrite(write)
+        with self._lock:
+            self._queue.append(pending)
+            if len(self._queue) >= self.max_batch:
+                self._full.notify()
+            lead = not self._leading
+            self._leading = True
+        if lead:
+            self._lead()
+        # 等待leader提交; 上一批的leader把排在队首的请求唤醒,由它负责下一批
+        while not pending.finished:
+            pending.done.wait()
+            if not pending.finished:
+                pending.done.clear()
+                self._lead()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _lead(self):
+        with self._lock:
+            self._full.wait_for(lambda: len(self._queue) >= self.max_batch, timeout=self.window)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+        try:
+            self.commit(batch)
+        finally:
+            for pending in batch:
+                if not pending.finished:
+                    pending.finish(error=RuntimeError('group commit aborted'))
+            with self._lock:
+                if self._queue:
+                    self._queue[0].done.set()
+                else:
+                    self._leading = False
+
+    def commit(self, batch):
+        """在一个事务中执行一批写入,失败时逐个重试"""
+        if self.execute(batch):
+            return
+        for pending in batch:
+            self.execute([pending])
+
+    def execute(self, batch):
+        # 提交后对象不过期,写入返回的对象在session关闭后仍可以读取已加载的属性
+        session = self.db.create_session({'expire_on_commit': False})()
+        try:
+            results = [pending.write(session) for pending in batch]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) > 1:
+                return False
+            batch[0].finish(error=e)
+            return True
+        finally:
+            session.close()
+        for pending, result in zip(batch, results):
+            pending.finish(result)
+        return True
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from collections import OrderedDict
+from threading import RLock
+
+
+class LRUCache(object):
+    """
+    线程安全的有界LRU缓存,超过容量时淘汰最久未使用的条目
+    set时可以指定过期秒数,过期的条目在读取时视为不存在
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and (item[1] is None or item[1] > time.time())
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileSystemCache(object):
+    """
+    文件缓存,每个键保存为目录下的一个pickle文件,多个进程可以共享
+    接口与LRUCache相同
+    过期的文件在读取时视为不存在; set时每隔prune_interval秒清理一次目录,
+    删除过期的文件,文件数仍超过maxsize时删除最早写入的文件
+    """
+
+    def __init__(self, directory, maxsize=None, prune_interval=60):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.prune_interval = prune_interval
+        self._last_prune = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _load(f, header_only=False):
+        # 过期时间和值分别序列化,清理时只需要读取过期时间
+        expires = pickle.load(f)
+        if expires is not None and not isinstance(expires, (int, float)):
+            raise pickle.UnpicklingError('unknown cache file format')
+        if header_only:
+            return expires, None
+        return expires, pickle.load(f)
+
+    def get(self, key, default=None):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = self._load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return default
+        if expires is not None and expires <= time.time():
+            return default
+        return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        # 先写临时文件再改名,其他进程不会读到写了一半的文件
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(expires, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        if time.time() - self._last_prune >= self.prune_interval:
+            self.prune()
+
+    def prune(self):
+        """
+        删除过期和无法读取的文件,文件数超过maxsize时再按修改时间删除最早的文件
+        :return: 删除的文件数
+        """
+        self._last_prune = now = time.time()
+        removed = 0
+        remaining = []
+        for name in os.listdir(self.directory):
+            # 写了一半的临时文件由写入的进程改名,不清理
+            if name.startswith('tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path, 'rb') as f:
+                    expires = self._load(f, header_only=True)[0]
+            except (IOError, OSError):
+                continue
+            except (EOFError, pickle.UnpicklingError):
+                expires = now
+            if expires is not None and expires <= now:
+                removed += self._remove(path)
+            else:
+                remaining.append((mtime, path))
+        if self.maxsize is not None and len(remaining) > self.maxsize:
+            remaining.sort()
+            for mtime, path in remaining[:len(remaining) - self.maxsize]:
+                removed += self._remove(path)
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            return 0
+        return 1
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            self._remove(os.path.join(self.directory, name))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
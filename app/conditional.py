@@ -0,0 +1,50 @@
+import hashlib
+import time
+from flask import current_app, request, session
+from flask.ext.login import current_user
+from werkzeug.http import is_resource_modified
+
+
+def make_etag(*parts):
+    """由页面依赖的数据生成ETag"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def viewer_state():
+    """
+    页面内容随登录用户变化: 导航栏显示用户名,编辑和审核按钮取决于角色的权限;
+    表单中的csrf token有有效期,登录用户的验证器每过半个有效期更新一次,避免客户端一直使用过期的token
+    """
+    if current_user.is_anonymous:
+        return None
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    return (current_user.get_id(), current_user.username, current_user.role_permissions,
+            int(time.time()) // max(limit // 2, 1))
+
+
+def pagination_state(pagination):
+    """分页导航依赖的数据"""
+    return (getattr(pagination, 'page', None), getattr(pagination, 'total', None),
+            pagination.has_prev, pagination.has_next)
+
+
+def not_modified(etag):
+    """
+    客户端缓存的验证器仍然有效时返回304响应,否则返回None
+    有待显示的flash消息时总是返回完整页面
+    只使用ETag: 修改文章,审核评论,修改资料和关注数变化都不会更新时间戳,
+    按时间戳生成的Last-Modified会让只带If-Modified-Since的客户端拿到过期的304
+    """
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+    if is_resource_modified(request.environ, etag=etag):
+        return None
+    return with_validators(current_app.response_class(status=304), etag)
+
+
+def with_validators(response, etag):
+    """给响应加上ETag,并要求客户端每次使用前重新验证"""
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
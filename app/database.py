@@ -0,0 +1,226 @@
+"""
+按配置调整数据库引擎
+连接池: SQLALCHEMY_POOL_SIZE等flask-sqlalchemy自带的配置之外,支持SQLALCHEMY_POOL_PRE_PING;
+SQLite: 新建连接时执行SQLALCHEMY_SQLITE_PRAGMAS中的PRAGMA,默认使用WAL日志,
+读操作不会被写操作阻塞,写操作之间等待busy_timeout毫秒而不是立即报 database is locked;
+设置了连接池大小时SQLite也使用连接池,连接可以在线程间复用,PRAGMA和页缓存不会随请求结束而丢失
+读写分离: SQLALCHEMY_REPLICAS中配置只读副本,SQLALCHEMY_REPLICA_BLUEPRINTS中蓝本的GET请求
+以及db.reading()范围内的查询发往副本; flush和DML语句发往主库,请求中写入之后的读取也留在主库;
+stick_to_primary()在提交后调用,之后SQLALCHEMY_REPLICA_LAG秒内同一用户的请求都读主库:
+浏览器靠cookie中的session记录截止时间; API客户端没有cookie,响应头X-DB-Primary-Until返回截止时间,
+客户端在之后的请求中带上这个头才能读到自己刚写入的数据,不带时可能读到副本中的旧数据;
+没有配置副本时什么也不做
+提交后的回调: flush中的事件监听器用session.after_commit登记缓存失效等操作,事务提交后执行,回滚时丢弃
+"""
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request, session
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm, create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_UNTIL = '_db_primary_until'
+PRIMARY_UNTIL_HEADER = 'X-DB-Primary-Until'
+AFTER_COMMIT = '_after_commit'
+
+
+class RoutingSession(SignallingSession):
+    """写入和写入之后的读取使用主库,只读请求的查询使用副本"""
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = SignallingSession.get_bind(self, mapper, clause)
+        if bind is not self.bind:
+            # 单独设置了bind_key的模型不参与读写分离
+            return bind
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.db.use_primary()
+            return bind
+        return self.db.replica_engine() or bind
+
+    def after_commit(self, callback, *args):
+        """
+        当前事务提交之后调用callback(*args),回滚时丢弃
+        缓存在flush中失效时,并发的请求可能在提交前读到旧数据并重新写入缓存
+        """
+        self.info.setdefault(AFTER_COMMIT, []).append((callback, args))
+
+
+def run_after_commit(session):
+    for callback, args in session.info.pop(AFTER_COMMIT, ()):
+        callback(*args)
+
+
+def discard_after_commit(session):
+    session.info.pop(AFTER_COMMIT, None)
+
+
+event.listen(RoutingSession, 'after_commit', run_after_commit)
+event.listen(RoutingSession, 'after_rollback', discard_after_commit)
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        self._tuned = weakref.WeakKeyDictionary()
+        self._tune_lock = threading.Lock()
+        SQLAlchemy.__init__(self, *args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        app.config.setdefault('SQLALCHEMY_SQLITE_PRAGMAS', {})
+        app.config.setdefault('SQLALCHEMY_REPLICAS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_BLUEPRINTS', ())
+        app.config.setdefault('SQLALCHEMY_REPLICA_LAG', 5)
+        SQLAlchemy.init_app(self, app)
+        get_state(app).replicas = {}
+        app.after_request(self.add_primary_header)
+        app.teardown_request(self.clear_routing)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            # 取出连接时先检查是否可用,数据库重启或连接被服务器断开后不会报错
+            options['pool_pre_ping'] = True
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if info.drivername == 'sqlite' and options.get('pool_size') and 'poolclass' not in options:
+            # pysqlite默认对文件数据库使用NullPool,需要指定连接池;
+            # 连接池中的连接会被不同的线程取出,每次只被一个线程使用
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+
+    def get_engine(self, app=None, bind=None):
+        engine = SQLAlchemy.get_engine(self, app, bind)
+        if engine not in self._tuned:
+            with self._tune_lock:
+                if engine not in self._tuned:
+                    self._tuned[engine] = self.tune(engine, self.get_app(app).config)
+        return engine
+
+    def replica(self, app, uri):
+        """按副本的url创建引擎,与主库使用相同的连接池配置和PRAGMA"""
+        replicas = get_state(app).replicas
+        engine = replicas.get(uri)
+        if engine is None:
+            with self._tune_lock:
+                engine = replicas.get(uri)
+                if engine is None:
+                    info = make_url(uri)
+                    options = {'convert_unicode': True}
+                    self.apply_pool_defaults(app, options)
+                    self.apply_driver_hacks(app, info, options)
+                    engine = create_engine(info, **options)
+                    self._tuned[engine] = self.tune(engine, app.config)
+                    replicas[uri] = engine
+        return engine
+
+    def replica_engine(self):
+        """
+        当前请求可以读副本时返回副本引擎,否则返回None
+        每个请求只选择一个副本,请求中写入过或调用了use_primary之后都返回None
+        """
+        if not has_request_context():
+            return None
+        engine = g.get('_db_replica')
+        if engine is None:
+            engine = False
+            uris = current_app.config['SQLALCHEMY_REPLICAS']
+            if uris and PRIMARY_UNTIL in session and session[PRIMARY_UNTIL] < time.time():
+                session.pop(PRIMARY_UNTIL)
+            # 请求头中的截止时间只会让请求改读主库,客户端伪造也没有影响
+            header_until = request.headers.get(PRIMARY_UNTIL_HEADER, 0, type=float)
+            if uris and not g.get('_db_primary') and PRIMARY_UNTIL not in session \
+                    and header_until < time.time():
+                engine = self.replica(current_app._get_current_object(), random.choice(uris))
+            g._db_replica = engine
+        if not engine:
+            return None
+        if g.get('_db_reading') or (request.method in READ_METHODS and
+                                    request.blueprint in current_app.config['SQLALCHEMY_REPLICA_BLUEPRINTS']):
+            return engine
+        return None
+
+    @contextmanager
+    def reading(self):
+        """范围内的查询可以读副本,即使当前请求不是只读请求"""
+        previous = g.get('_db_reading') if has_request_context() else None
+        if has_request_context():
+            g._db_reading = True
+        try:
+            yield
+        finally:
+            if has_request_context():
+                g._db_reading = previous
+
+    def use_primary(self):
+        """当前请求剩下的查询都使用主库"""
+        if has_request_context():
+            g._db_primary = True
+            g._db_replica = False
+
+    def clear_routing(self, exc):
+        # 测试中多个请求可能共用一个应用上下文,路由状态不能留给下一个请求
+        for name in ('_db_replica', '_db_primary', '_db_reading', '_db_primary_until'):
+            if hasattr(g, name):
+                delattr(g, name)
+
+    def stick_to_primary(self):
+        """提交后调用,副本同步之前当前用户的请求都读主库,避免看不到刚写入的数据"""
+        if not current_app.config['SQLALCHEMY_REPLICAS']:
+            return
+        self.use_primary()
+        until = time.time() + current_app.config['SQLALCHEMY_REPLICA_LAG']
+        session[PRIMARY_UNTIL] = until
+        g._db_primary_until = until
+
+    def add_primary_header(self, response):
+        if g.get('_db_primary_until'):
+            response.headers[PRIMARY_UNTIL_HEADER] = '%.3f' % g._db_primary_until
+        return response
+
+    def tune(self, engine, config):
+        """在引擎第一次连接之前注册连接池事件"""
+        stats = {'connects': 0, 'checkouts': 0, 'invalidated': 0}
+        pragmas = config['SQLALCHEMY_SQLITE_PRAGMAS'] if engine.dialect.name == 'sqlite' else {}
+
+        def on_connect(dbapi_connection, connection_record):
+            stats['connects'] += 1
+            if pragmas:
+                cursor = dbapi_connection.cursor()
+                for name, value in sorted(pragmas.items()):
+                    cursor.execute('PRAGMA %s = %s' % (name, value))
+                cursor.close()
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            stats['checkouts'] += 1
+
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            stats['invalidated'] += 1
+
+        event.listen(engine, 'connect', on_connect)
+        event.listen(engine, 'checkout', on_checkout)
+        event.listen(engine, 'invalidate', on_invalidate)
+        return stats
+
+    def pool_metrics(self, app=None, bind=None):
+        """连接池当前状态和累计的连接,取出和失效次数"""
+        engine = self.get_engine(app, bind)
+        pool = engine.pool
+        metrics = {'pool': type(pool).__name__}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                metrics[name] = getattr(pool, name)()
+        metrics.update(self._tuned.get(engine, {}))
+        return metrics
@@ -1,6 +1,7 @@
 from functools import wraps
 from flask import abort
 from flask.ext.login import current_user
+from . import db
 from .models import Permission
 
 
@@ -17,3 +18,12 @@ def permission_required(permissions):
 
 def admin_required(f):
     return permission_required(Permission.ADMINISTER)(f)
+
+
+def primary_required(f):
+    """会写入数据库的GET视图,整个请求都使用主库,避免按副本上过期的数据做判断"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        db.use_primary()
+        return f(*args, **kwargs)
+    return decorated_function
@@ -1,13 +1,230 @@
-from flask.ext.mail import Message
+import atexit
+import logging
+import threading
+import time
+from queue import Queue, Empty
 from flask import current_app
 from flask import render_template
-from . import mail
+
+
+logger = logging.getLogger(__name__)
 
 
 def send_email(recipients, subject, template, **kwargs):
+    from flask.ext.mail import Message
     msg = Message('[Flasky]' + '  ' + subject,
                   sender=current_app.config['MAIL_USERNAME'],
                   recipients=[recipients])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    mail.send(msg)
+    current_app.extensions['mail_queue'].enqueue(msg)
+
+
+class LazyMail(object):
+    """
+    代替flask-mail的Mail扩展,第一次创建邮件或连接邮件服务器时才导入flask-mail并初始化,
+    不发邮件的命令和进程不需要加载它
+    """
+
+    def init_app(self, app):
+        app.extensions['mail'] = LazyMailState(app)
+
+
+class LazyMailState(object):
+
+    def __init__(self, app):
+        self.app = app
+
+    def __getattr__(self, name):
+        from flask.ext.mail import Mail
+        # Mail.init_app把真正的状态对象写入app.extensions['mail'],之后不再经过这里
+        return getattr(Mail().init_app(self.app), name)
+
+
+class MemoryConnection(object):
+    """内存中的邮件连接,测试时代替SMTP服务器,邮件保存在outbox中"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def send(self, message):
+        self.outbox.append(message)
+
+
+class MailQueue(object):
+    """
+    后台邮件发送队列
+    请求线程只负责把邮件放入队列,由工作线程批量取出,复用已建立的SMTP连接发送,
+    发送失败时关闭连接并按指数退避重试
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.outbox = []
+        self._queue = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_ENABLED', True)
+        app.config.setdefault('MAIL_QUEUE_BACKEND', 'smtp')
+        app.config.setdefault('MAIL_QUEUE_WORKERS', 2)
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_QUEUE_MAX_RETRIES', 3)
+        app.config.setdefault('MAIL_QUEUE_RETRY_BACKOFF', 2.0)
+        app.config.setdefault('MAIL_QUEUE_IDLE_TIMEOUT', 30)
+        self.app = app
+        app.extensions['mail_queue'] = self
+
+    def connect(self):
+        """建立到邮件服务器的连接,memory后端时写入outbox"""
+        if self.app.config['MAIL_QUEUE_BACKEND'] == 'memory':
+            return MemoryConnection(self.outbox)
+        return self.app.extensions['mail'].connect()
+
+    def enqueue(self, msg):
+        """放入发送队列,未开启队列时同步发送"""
+        if not self.app.config['MAIL_QUEUE_ENABLED']:
+            with self.connect() as connection:
+                connection.send(msg)
+            return
+        self._start()
+        with self._lock:
+            self._pending += 1
+        self._queue.put((msg, time.time(), 0))
+
+    def _start(self):
+        with self._lock:
+            if self._workers:
+                return
+            self._queue = Queue()
+            for i in range(self.app.config['MAIL_QUEUE_WORKERS']):
+                worker = threading.Thread(target=self._work, name='mail-queue-%d' % i)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        atexit.register(self.shutdown)
+
+    def _take_batch(self, connection):
+        """阻塞取出一封邮件,再尽量多取一些组成一批"""
+        timeout = self.app.config['MAIL_QUEUE_IDLE_TIMEOUT'] if connection else None
+        try:
+            item = self._queue.get(timeout=timeout)
+        except Empty:
+            return []
+        batch = [item]
+        while item is not None and len(batch) < self.app.config['MAIL_QUEUE_BATCH_SIZE']:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                batch = self._take_batch(connection)
+                if not batch:
+                    # 空闲超时,关闭连接,避免被服务器断开
+                    connection = self._close(connection)
+                    continue
+                stop = None in batch
+                batch = [item for item in batch if item is not None]
+                for msg, enqueued, attempts in batch:
+                    try:
+                        if connection is None:
+                            connection = self.connect()
+                            connection.__enter__()
+                        connection.send(msg)
+                    except Exception:
+                        logger.exception('send mail to %s failed', msg.recipients)
+                        connection = self._close(connection, failed=True)
+                        self._retry(msg, enqueued, attempts)
+                    else:
+                        self._done(time.time() - enqueued)
+                if stop:
+                    self._close(connection)
+                    return
+
+    def _close(self, connection, failed=False):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                if not failed:
+                    logger.exception('close mail connection failed')
+        return None
+
+    def _retry(self, msg, enqueued, attempts):
+        if attempts >= self.app.config['MAIL_QUEUE_MAX_RETRIES']:
+            with self._lock:
+                self.failed += 1
+                self._finish()
+            return
+        with self._lock:
+            self.retried += 1
+        delay = self.app.config['MAIL_QUEUE_RETRY_BACKOFF'] * (2 ** attempts)
+        timer = threading.Timer(delay, self._queue.put, [(msg, enqueued, attempts + 1)])
+        timer.daemon = True
+        timer.start()
+
+    def _done(self, latency):
+        with self._lock:
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._finish()
+
+    def _finish(self):
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.notify_all()
+
+    def join(self, timeout=None):
+        """等待队列中的邮件全部发送或放弃,返回是否已经清空"""
+        with self._lock:
+            if self._pending:
+                self._idle.wait(timeout)
+            return self._pending == 0
+
+    def shutdown(self, timeout=10):
+        """等待已入队的邮件发送完毕后停止工作线程"""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        if not workers:
+            return
+        self.join(timeout)
+        for worker in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+
+    def metrics(self):
+        """队列深度,发送数量和从入队到发出的延迟"""
+        with self._lock:
+            return {
+                'depth': self._queue.qsize() if self._queue is not None else 0,
+                'pending': self._pending,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'avg_latency': self.total_latency / self.sent if self.sent else 0.0,
+                'max_latency': self.max_latency,
+            }
@@ -0,0 +1,8 @@
+class ValidationError(ValueError):
+    """api请求中的数据不合法"""
+    pass
+
+
+class QueryBudgetExceeded(Exception):
+    """请求执行的SQL语句数超过了预算"""
+    pass
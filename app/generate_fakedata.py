@@ -1,35 +1,165 @@
-from .models import User, Post
-from sqlalchemy.exc import IntegrityError
-from . import db
-from random import seed, randint
+"""
+生成压测用的假数据
+预先分配主键,按块用transfer.load_records批量插入,不经过ORM逐行提交;
+关注关系按幂律分布生成: 少数用户关注很多人,少数用户被很多人关注;
+文章作者同样集中在少数活跃用户上。指定seed时生成的数据可以重现
+"""
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
 import forgery_py
+from forgery_py.dictionaries_loader import get_dictionary
+from . import db, transfer, passwords
+from .models import User, Role, Post, Comment
 
 
-def generate_user_fake(count=100):
-    seed()
-    for i in range(count):
-        user = User()
-        user.email = forgery_py.internet.email_address()
-        user.username = forgery_py.internet.user_name(True)
-        user.confirmed = True
-        user.name = forgery_py.name.full_name()
-        user.location = forgery_py.address.city()
-        user.about_me = forgery_py.lorem_ipsum.sentence()
-        user.last_seen = forgery_py.date.date(True)
-        db.session.add(user)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-
-
-def generate_post_fake(count=100):
-    seed()
-    user_count = User.query.count()
-    for i in range(count):
-        post = Post()
-        post.title = forgery_py.lorem_ipsum.title()
-        post.body = forgery_py.lorem_ipsum.paragraphs()
-        post.author = User.query.offset(randint(0, user_count-1)).first()
-        db.session.add(post)
-        db.session.commit()
+def words(name):
+    return [word.strip() for word in get_dictionary(name)]
+
+
+def first_names():
+    # forgery_py.name.first_name每次调用都会把女性名字追加到缓存的列表中,
+    # 列表越来越长,生成的数据也无法重现,这里只读取一次字典
+    return words('male_first_names') + words('female_first_names')
+
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def zipf_weights(count, exponent):
+    """排名第i的对象的权重为1/i^exponent,返回累积权重"""
+    return list(accumulate(1.0 / (i + 1) ** exponent for i in range(count)))
+
+
+def spread(first, count, start, span, id):
+    """按主键顺序把时间均匀分布在[start, start+span)内,主键越大时间越晚"""
+    return start + span * ((id - first) / float(max(count, 1)))
+
+
+def fake_users(first_id, count, start, span, password='password'):
+    role_id = Role.query.filter_by(default=True).first().id
+    # 所有假用户使用同一个密码,只计算一次哈希
+    password_hash = passwords.hash_password(password)
+    names, last_names, cities = first_names(), words('last_names'), words('cities')
+    for id in range(first_id, first_id + count):
+        registered = spread(first_id, count, start, span, id)
+        first_name = random.choice(names)
+        yield {
+            'type': 'user',
+            'id': id,
+            # 加上主键保证唯一
+            'email': '%s%d@example.com' % (first_name.lower(), id),
+            'username': '%s%d' % (first_name.lower(), id),
+            'password_hash': password_hash,
+            'confirmed': True,
+            'role_id': role_id,
+            'name': '%s %s' % (first_name, random.choice(last_names)),
+            'location': random.choice(cities),
+            'about_me': forgery_py.lorem_ipsum.sentence(),
+            'registration_time': registered,
+            'last_seen': registered + random.random() * (start + span - registered),
+        }
+
+
+def fake_follows(user_ids, follows_per_user, exponent, start, span):
+    """
+    每个用户关注的人数服从均值为follows_per_user的帕累托分布,
+    被关注的对象按zipf分布优先选择排名靠前的用户
+    """
+    cum_weights = zipf_weights(len(user_ids), exponent)
+    alpha = 2.0
+    scale = follows_per_user * (alpha - 1) / alpha
+    for follower_id in user_ids:
+        count = min(int(random.paretovariate(alpha) * scale), len(user_ids) - 1)
+        followed = set(random.choices(user_ids, cum_weights=cum_weights, k=count))
+        followed.discard(follower_id)
+        for followed_id in sorted(followed):
+            yield {
+                'type': 'follow',
+                'follower_id': follower_id,
+                'followed_id': followed_id,
+                'timestamp': start + random.random() * span,
+            }
+
+
+def fake_posts(first_id, count, author_ids, exponent, start, span):
+    cum_weights = zipf_weights(len(author_ids), exponent)
+    for id in range(first_id, first_id + count):
+        yield {
+            'type': 'post',
+            'id': id,
+            'title': forgery_py.lorem_ipsum.title(),
+            # forgery_py的paragraphs在python3下不可用,由句子拼接段落
+            'body': '\n\n'.join(forgery_py.lorem_ipsum.sentences(3) for i in range(random.randint(1, 5))),
+            'timestamp': spread(first_id, count, start, span, id),
+            'author_id': random.choices(author_ids, cum_weights=cum_weights)[0],
+        }
+
+
+def fake_comments(first_id, count, post_first_id, post_count, author_ids, start, span):
+    """评论集中在少数热门文章上,时间在文章发表之后"""
+    post_weights = zipf_weights(post_count, 1.0)
+    post_ids = range(post_first_id, post_first_id + post_count)
+    for id in range(first_id, first_id + count):
+        post_id = random.choices(post_ids, cum_weights=post_weights)[0]
+        posted = spread(post_first_id, post_count, start, span, post_id)
+        yield {
+            'type': 'comment',
+            'id': id,
+            'body': forgery_py.lorem_ipsum.sentence(),
+            'timestamp': posted + random.random() * (start + span - posted),
+            'disable': False,
+            'author_id': random.choice(author_ids),
+            'post_id': post_id,
+        }
+
+
+def seed_data(users=1000, posts=10000, follows_per_user=20, comments=20000, seed=None,
+              days=365, follow_exponent=1.0, post_exponent=1.2, chunk_size=1000, workers=None):
+    """
+    生成一整套假数据,已有的数据保留,新数据的主键接在后面
+    :param follows_per_user: 平均每个用户关注的人数
+    :param follow_exponent: 被关注人数的zipf指数,越大越集中在少数用户上
+    :param post_exponent: 文章作者的zipf指数
+    :param workers: 渲染markdown的进程数,见transfer.load_records
+    :return: 每种记录插入的行数
+    """
+    random.seed(seed)
+    Role.insert_roles()
+    span = timedelta(days=days)
+    start = datetime.utcnow() - span
+    first_user, first_post, first_comment = next_id(User), next_id(Post), next_id(Comment)
+    db.session.commit()
+    user_ids = range(first_user, first_user + users)
+    # 活跃作者和热门用户使用不同的排名,避免被关注最多的人同时发文最多,使关注动态成倍膨胀
+    authors = list(user_ids)
+    random.shuffle(authors)
+
+    def records():
+        for record in fake_users(first_user, users, start, span):
+            yield record
+        for record in fake_follows(user_ids, follows_per_user, follow_exponent, start, span):
+            yield record
+        for record in fake_posts(first_post, posts, authors, post_exponent, start, span):
+            yield record
+        for record in fake_comments(first_comment, comments, first_post, posts, user_ids, start, span):
+            yield record
+    return transfer.load_records(records(), chunk_size=chunk_size, workers=workers)
+
+
+def generate_user_fake(count=100, seed=None):
+    random.seed(seed)
+    Role.insert_roles()
+    span = timedelta(days=365)
+    return transfer.load_records(fake_users(next_id(User), count, datetime.utcnow() - span, span),
+                                 workers=0)['user']
+
+
+def generate_post_fake(count=100, seed=None):
+    """作者从已有的用户中选取,只查询一次用户id"""
+    random.seed(seed)
+    author_ids = [row[0] for row in db.session.query(User.id).order_by(User.id)]
+    span = timedelta(days=365)
+    return transfer.load_records(fake_posts(next_id(Post), count, author_ids, 1.2,
+                                            datetime.utcnow() - span, span))['post']
@@ -8,6 +8,7 @@ def not_found_page(e):
     if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
         response = jsonify({'error': 'not found page!'})
         response.status_code = 404
+        return response
     return render_template('404.html'), 404
 
 
@@ -16,6 +17,7 @@ def internal_server_error(e):
     if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
         response = jsonify({'error': 'internal server error'})
         response.status_code = 500
+        return response
     return render_template('500.html'), 500
 
 
@@ -1,30 +1,34 @@
 from datetime import datetime
 from flask import render_template, redirect, url_for, abort, flash, request, current_app, make_response
 from flask.ext.login import current_user, login_required
+from sqlalchemy.orm.attributes import set_committed_value
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm, EditPostForm, CommentForm
-from .. import db
-from ..decorators import admin_required, permission_required
+from .. import db, response_cache, group_commit
+from ..decorators import admin_required, permission_required, primary_required
 from ..models import User, Post, Permission, Follows, Comment
+from ..pagination import paginate
+from ..search import SearchResults
+from ..conditional import make_etag, not_modified, with_validators, viewer_state, pagination_state
 
 
 @main.route('/', methods=['GET', 'POST'])
+@response_cache.cached(lambda: ['posts', 'users'])
 def index():
     """首页"""
     form = PostForm()
     if current_user.can(Permission.WRITE_ARTICLES) and form.validate_on_submit():
-        post = Post()
-        post.title = form.title.data
-        post.body = form.body.data
-        post.author = current_user._get_current_object()
-        db.session.add(post)
-        db.session.commit()
+        values = {'title': form.title.data, 'body': form.body.data, 'author_id': current_user.id}
+        group_commit.submit(lambda session: session.add(Post(**values)))
+        db.stick_to_primary()
         flash('文章已保存')
         return redirect(url_for('.index'))
     # 添加分页功能
     # posts = Post.query.order_by(Post.timestamp.desc()).all()
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(page, per_page=current_app.config['FLASK_POSTS_PER_PAGE_COUNT'], error_out=True)
+    # 作者用一条IN查询预加载,评论数读取计数字段,避免模板中的N+1查询
+    pagination = paginate(Post.query.options(db.selectinload('author')),
+                          (Post.timestamp, Post.id),
+                          per_page=current_app.config['FLASK_POSTS_PER_PAGE_COUNT'])
     posts = pagination.items
     return render_template(
         'index.html',
@@ -36,18 +40,54 @@ def index():
 
 
 @main.route('/user/<username>')
+@response_cache.cached(lambda username: ['user:%s' % username])
 def user(username):
     """用户信息"""
     user = User.query.filter_by(username=username).first()
     if user is None:
         abort(404)
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).filter_by(author_id=user.id).paginate(page, per_page=current_app.config['FLASK_POSTS_PER_PAGE_COUNT'], error_out=True)
+    pagination = paginate(Post.query.filter_by(author_id=user.id),
+                          (Post.timestamp, Post.id),
+                          per_page=current_app.config['FLASK_POSTS_PER_PAGE_COUNT'])
     posts = pagination.items
-    return render_template('user.html', user=user, posts=posts, pagination=pagination)
+    # 由资料,计数和本页文章生成验证器,客户端缓存有效时不渲染模板
+    following = current_user.is_authenticated and current_user.is_following(user)
+    etag = make_etag(viewer_state(), following, user.username, user.name, user.location,
+                     user.about_me, user.email, user.last_seen, user.registration_time, user.followers_count,
+                     user.followed_count, user.posts_count, pagination_state(pagination),
+                     [(p.id, p.title, p.timestamp, p.comments_count) for p in posts])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    # 列表中的作者都是user本身,直接写入关系避免每篇文章再加载一次
+    for post in posts:
+        set_committed_value(post, 'author', user)
+    response = make_response(render_template('user.html', user=user, posts=posts, pagination=pagination,
+                                             following=following))
+    return with_validators(response, etag)
+
+
+@main.route('/timeline')
+@login_required
+def timeline():
+    """关注的人发表的文章"""
+    pagination = current_user.timeline(per_page=current_app.config['FLASK_POSTS_PER_PAGE_COUNT'],
+                                       after=request.args.get('after') or None,
+                                       before=request.args.get('before') or None)
+    return render_template('timeline.html', posts=pagination.items, pagination=pagination)
+
+
+@main.route('/search')
+def search():
+    """搜索文章和评论,按相关度排序"""
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results = SearchResults(q, page, current_app.config['FLASK_POSTS_PER_PAGE_COUNT'])
+    return render_template('search.html', q=q, results=results)
 
 
 @main.route('/follow/<username>')
+@primary_required
 @login_required
 def follow(username):
     """
@@ -60,11 +100,13 @@ def follow(username):
         flash('无效的username')
         return redirect(url_for('main.index'))
     current_user.follow(u)
+    db.stick_to_primary()
     flash('已关注%s' % username)
     return redirect(url_for('main.user', username=username))
 
 
 @main.route('/unfollow/<username>')
+@primary_required
 @login_required
 def unfollow(username):
     """
@@ -74,10 +116,18 @@ def unfollow(username):
     """
     u = User.query.filter_by(username=username).first()
     current_user.unfollow(u)
+    db.stick_to_primary()
     flash('已经取消关注%s' % username)
     return redirect(url_for('main.user', username=username))
 
 
+def follow_states(users, items):
+    """列表中的用户与关注时间,当前用户对本页所有用户的关注状态由一次IN查询得到"""
+    following = current_user.following_ids(users) if current_user.is_authenticated else set()
+    return [{'user': user, 'timestamp': item.timestamp, 'following': user.id in following}
+            for user, item in zip(users, items)]
+
+
 @main.route('/followers/<username>')
 def followers(username):
     """关注人列表路由"""
@@ -85,12 +135,9 @@ def followers(username):
     if not u:
         flash('请求的用户名无效')
         return redirect(url_for('main.user', username=username))
-    page = request.args.get('page', 1, type=int)
-    pagination = u.followers.paginate(page,
-                                      per_page=current_app.config['FLASK_FOLLOW_PER_PAGE_COUNT'],
-                                      error_out=True)
-    follows = [{'user': item.follower, 'timestamp': item.timestamp}
-               for item in pagination.items]
+    pagination = paginate(u.followers, (Follows.timestamp, Follows.follower_id),
+                          per_page=current_app.config['FLASK_FOLLOW_PER_PAGE_COUNT'])
+    follows = follow_states([item.follower for item in pagination.items], pagination.items)
     return render_template('followers.html', pagination=pagination, user=u,
                            follows=follows, title='Followers of', endpoint='main.followers')
 
@@ -102,12 +149,9 @@ def followed(username):
     if not u:
         flash('输入的用户名无效!!!')
         abort(404)
-    page = request.args.get('page', 1, type=int)
-    pagination = u.followed.paginate(page,
-                                     per_page=current_app.config['FLASK_FOLLOW_PER_PAGE_COUNT'],
-                                     error_out=True)
-    follows = [{'user': item.followed, 'timestamp': item.timestamp}
-               for item in pagination.items]
+    pagination = paginate(u.followed, (Follows.timestamp, Follows.followed_id),
+                          per_page=current_app.config['FLASK_FOLLOW_PER_PAGE_COUNT'])
+    follows = follow_states([item.followed for item in pagination.items], pagination.items)
     return render_template('followed.html', pagination=pagination, user=u,
                            title='Followed of', follows=follows,
                            endpoint='main.followed')
@@ -124,6 +168,7 @@ def edit_profile():
         current_user.about_me = form.about_me.data
         db.session.add(current_user)
         db.session.commit()
+        db.stick_to_primary()
         flash('用户资料已修改!')
         return redirect(url_for('main.user', username=current_user.username))
     form.name.data = current_user.name
@@ -147,8 +192,11 @@ def edit_profile_admin(id):
         user.name = form.name.data
         user.location = form.location.data
         user.about_me = form.about_me.data
+        # token中带有确认状态和角色权限,修改后吊销已签发的token
+        user.revoke_auth_tokens()
         db.session.add(user)
         db.session.commit()
+        db.stick_to_primary()
         flash('用户信息已经更新!')
         return redirect(url_for('main.user', username=user.username))
     form.email.data = user.email
@@ -162,6 +210,7 @@ def edit_profile_admin(id):
 
 
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
+@response_cache.cached(lambda id: ['post:%d' % id, 'users'])
 def post(id):
     """显示文章视图"""
     comment_form = CommentForm()
@@ -169,22 +218,28 @@ def post(id):
     if comment_form.validate_on_submit():
         if current_user.is_anonymous:
             abort(403)
-        comment = Comment()
-        comment.body = comment_form.body.data
-        comment.author = current_user._get_current_object()
-        comment.post = post
-        db.session.add(comment)
-        db.session.commit()
+        values = {'body': comment_form.body.data, 'author_id': current_user.id, 'post_id': post.id}
+        group_commit.submit(lambda session: session.add(Comment(**values)))
+        db.stick_to_primary()
         flash('评论已提交!')
         return redirect(url_for('main.post', id=id, page=-1))  # page=-1 是为了显示最后一页的评论
     page = request.args.get('page', 1, type=int)
     if page == -1:
-        page = post.comments.count() / current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.desc()).paginate(page,
-                                                                           per_page=current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'],
-                                                                           error_out=True)
+        per_page = current_app.config['FLASK_COMMENT_PER_PAGE_COUNT']
+        page = max((post.comments_count - 1) // per_page + 1, 1)
+    pagination = paginate(post.comments, (Comment.timestamp, Comment.id),
+                          per_page=current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'], page=page)
     comments = pagination.items
-    return render_template('post.html', posts=[post], user=post.author, pagination=pagination, comments=comments, form=comment_form, id=post.id)
+    # 由文章,评论数和本页评论生成验证器,客户端缓存有效时不渲染模板
+    # 作者和评论者的用户名也显示在页面上,修改用户名后验证器随之变化
+    etag = make_etag(viewer_state(), post.title, post.body_hash, post.timestamp, post.author.username,
+                     post.comments_count, pagination_state(pagination),
+                     [(c.id, c.body_hash, c.disable, c.author.username) for c in comments])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    response = make_response(render_template('post.html', posts=[post], user=post.author, pagination=pagination, comments=comments, form=comment_form, id=post.id))
+    return with_validators(response, etag)
 
 
 @main.route('/edit-post/<int:id>', methods=['GET', 'POST'])
@@ -196,10 +251,15 @@ def edit_post(id):
     form = EditPostForm()
     if form.validate_on_submit():
         if current_user.role_id == post.author.role.id or current_user.can(permissions=Permission.ADMINISTER):
-            post.title = form.title.data
-            post.body = form.body.data
-            db.session.add(post)
-            db.session.commit()
+            title, body = form.title.data, form.body.data
+
+            def write(session):
+                # 开启组提交时在另一个session中执行,按id重新加载
+                target = session.query(Post).get(id)
+                target.title = title
+                target.body = body
+            group_commit.submit(write)
+            db.stick_to_primary()
             flash('文章已经更新!')
             return redirect(url_for('main.post', id=post.id))
     form.title.data = post.title
@@ -226,13 +286,14 @@ def show_followers(username):
 @permission_required(permissions=Permission.MODERATE_COMMENTS)
 def moderate():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'], error_out=True)
+    pagination = paginate(Comment.query, (Comment.timestamp, Comment.id),
+                          per_page=current_app.config['FLASK_COMMENT_PER_PAGE_COUNT'])
     comments = pagination.items
     return render_template('moderate.html', pagination=pagination, comments=comments, page=page)
 
 
 @main.route('/moderate/enable/<int:id>')
+@primary_required
 @login_required
 @permission_required(permissions=Permission.MODERATE_COMMENTS)
 def moderate_enable(id):
@@ -240,12 +301,14 @@ def moderate_enable(id):
     comment.disable = False
     db.session.add(comment)
     db.session.commit()
+    db.stick_to_primary()
     flash('评论状态已改变!!!')
     page = request.args.get('page', 1, type=int)
     return redirect(url_for('main.moderate', page=page))
 
 
 @main.route('/moderate/disable/<int:id>')
+@primary_required
 @login_required
 @permission_required(permissions=Permission.MODERATE_COMMENTS)
 def moderate_disable(id):
@@ -253,6 +316,7 @@ def moderate_disable(id):
     comment.disable = True
     db.session.add(comment)
     db.session.commit()
+    db.stick_to_primary()
     flash('评论状态已改变')
     page = request.args.get('page', 1, type=int)
     return redirect(url_for('main.moderate', page=page))
@@ -1,16 +1,43 @@
-from flask import current_app, jsonify, url_for
-from . import db, login_manager, pagedown
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app, url_for
+from .exceptions import ValidationError
+from . import db, login_manager, pagedown, renderer, last_seen_buffer, identity_cache, response_cache, timeline, search, passwords, tokens
+from werkzeug.security import check_password_hash
 from flask.ext.login import UserMixin, AnonymousUserMixin
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from .pagination import KeysetPagination
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from datetime import datetime
-from markdown import markdown
-import bleach
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    加载登录用户,角色同时用join加载
+    FLASK_IDENTITY_CACHE_TTL大于0时缓存用户和角色的列值,命中时直接合并进session,不查询数据库
+    """
+    user_id = int(user_id)
+    timeout = current_app.config['FLASK_IDENTITY_CACHE_TTL']
+    if timeout:
+        snapshot = identity_cache.get(user_id)
+        if snapshot is not None:
+            return User.from_snapshot(snapshot)
+    # 身份信息很少变化,即使在写请求中也可以从副本读取
+    with db.reading():
+        user = User.query.options(db.joinedload('role')).get(user_id)
+    if user is not None and timeout:
+        identity_cache.set(user_id, user.snapshot(), timeout=timeout)
+    return user
+
+
+def select_fields(getters, fields=None):
+    """只计算需要的字段,fields为None时返回全部字段"""
+    return dict((name, getter()) for name, getter in getters.items()
+                if fields is None or name in fields)
+
+
+def column_values(obj):
+    return dict((column.key, getattr(obj, column.key)) for column in obj.__table__.columns)
 
 
 class Follows(db.Model):
@@ -21,6 +48,38 @@ class Follows(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class TimelineEntry(db.Model):
+    """用户关注动态中的一条记录,由文章发表和关注事件写入"""
+    __tablename__ = 'timelines'
+    __table_args__ = (db.Index('ix_timelines_user_id_timestamp', 'user_id', 'timestamp'),)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    author_id = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime)
+
+
+class SearchDocument(db.Model):
+    """搜索索引中的一篇文档(文章或评论)及其长度"""
+    __tablename__ = 'search_documents'
+
+    kind = db.Column(db.String(8), primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    post_id = db.Column(db.Integer)
+    length = db.Column(db.Integer)
+
+
+class SearchPosting(db.Model):
+    """倒排索引: 词项在文档中出现的次数"""
+    __tablename__ = 'search_postings'
+    __table_args__ = (db.Index('ix_search_postings_kind_doc_id', 'kind', 'doc_id'),)
+
+    term = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(8), primary_key=True)
+    doc_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tf = db.Column(db.Integer)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
@@ -36,6 +95,12 @@ class User(UserMixin, db.Model):
     about_me = db.Column(db.Text())
     registration_time = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
+    # 计数字段,由Follows/Post的插入删除事件维护,避免每次COUNT(*)
+    followers_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    posts_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # API token的版本,小于此版本的token已被吊销
+    token_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     # 对文章添加关系
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     # 关注关系添加联结
@@ -70,16 +135,30 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        """密码加密"""
-        self.password_hash = generate_password_hash(password)
+        """按配置的哈希策略加密"""
+        self.password_hash = passwords.hash_password(password)
 
     def verify_password(self, password):
-        """验证密码"""
-        return check_password_hash(self.password_hash, password)
+        """验证密码,保存的哈希参数与配置不同时按新参数重新计算,由调用者提交"""
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.password = password
+        return True
+
+    # 缓存的角色权限,修改角色,对象过期或刷新时清除
+    _role_permissions = None
+
+    @property
+    def role_permissions(self):
+        """角色的权限位"""
+        if self._role_permissions is None:
+            self._role_permissions = self.role.permissions if self.role is not None else 0
+        return self._role_permissions
 
     def can(self, permissions):
         """验证权限"""
-        return self.role is not None and (self.role.permissions & permissions) == permissions
+        return (self.role_permissions & permissions) == permissions
 
     def is_administrator(self):
         """验证是否是管理员"""
@@ -105,10 +184,11 @@ class User(UserMixin, db.Model):
         return True
 
     def ping(self):
-        """last_seen字段更新时间"""
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        """last_seen字段更新时间,先写入缓冲区,按间隔批量写回数据库"""
+        now = datetime.utcnow()
+        # 只修改内存中的值,不把对象标记为需要UPDATE
+        set_committed_value(self, 'last_seen', now)
+        last_seen_buffer.touch(self.id, now)
 
     def is_following(self, user):
         """
@@ -148,37 +228,325 @@ class User(UserMixin, db.Model):
             db.session.delete(f)
             db.session.commit()
 
+    def following_ids(self, users):
+        """
+        一次IN查询得到users中已经关注的用户,用于一整页用户的关注按钮
+        :param users: 用户或用户id
+        :return: 已关注的用户id集合
+        """
+        ids = user_ids(users)
+        if not ids:
+            return set()
+        return set(row[0] for row in db.session.query(Follows.followed_id)
+                   .filter(Follows.follower_id == self.id, Follows.followed_id.in_(ids)))
+
+    def follower_ids(self, users):
+        """users中关注了自己的用户id集合"""
+        ids = user_ids(users)
+        if not ids:
+            return set()
+        return set(row[0] for row in db.session.query(Follows.follower_id)
+                   .filter(Follows.followed_id == self.id, Follows.follower_id.in_(ids)))
+
+    def mutual_ids(self, users):
+        """users中与自己互相关注的用户id集合,两条关注关系自连接,一次查询"""
+        ids = user_ids(users)
+        if not ids:
+            return set()
+        back = db.aliased(Follows)
+        return set(row[0] for row in db.session.query(Follows.followed_id)
+                   .join(back, db.and_(back.follower_id == Follows.followed_id,
+                                       back.followed_id == Follows.follower_id))
+                   .filter(Follows.follower_id == self.id, Follows.followed_id.in_(ids)))
+
+    def follow_many(self, users):
+        """
+        在一个事务中关注多个用户,已经关注的跳过
+        批量INSERT不触发Follows的映射事件,计数,timeline和缓存在这里按集合更新
+        :param users: 用户或用户id
+        :return: 新关注的人数
+        """
+        db.use_primary()
+        ids = user_ids(users)
+        ids -= self.following_ids(ids)
+        if not ids:
+            return 0
+        now = datetime.utcnow()
+        connection = db.session.connection()
+        connection.execute(Follows.__table__.insert(),
+                           [{'follower_id': self.id, 'followed_id': id, 'timestamp': now} for id in ids])
+        change_follow_counters(connection, self.id, ids, 1)
+        timeline.on_follow_many(connection, self.id, ids)
+        db.session.commit()
+        return len(ids)
+
+    def unfollow_many(self, users):
+        """
+        在一个事务中取消关注多个用户,没有关注的跳过
+        :return: 取消关注的人数
+        """
+        db.use_primary()
+        ids = self.following_ids(users)
+        if not ids:
+            return 0
+        follows = Follows.__table__
+        connection = db.session.connection()
+        connection.execute(follows.delete().where(db.and_(follows.c.follower_id == self.id,
+                                                          follows.c.followed_id.in_(ids))))
+        change_follow_counters(connection, self.id, ids, -1)
+        timeline.on_unfollow_many(connection, self.id, ids)
+        db.session.commit()
+        return len(ids)
+
     @staticmethod
     def add_self_follows():
-        for user in User.query.all():
-            if not user.is_following(user):
-                user.follow(user)
-                db.session.add(user)
-                db.session.commit()
+        """
+        所有还没有关注自己的用户关注自己,关注关系由一条INSERT ... SELECT写入
+        计数和timeline用同样的条件在写入关注关系之前按集合更新,都在一个事务中
+        :return: 新增的关注关系数
+        """
+        db.use_primary()
+        users = User.__table__
+        follows = Follows.__table__
+        missing = ~db.exists().where(db.and_(follows.c.follower_id == users.c.id,
+                                             follows.c.followed_id == users.c.id))
+        connection = db.session.connection()
+        connection.execute(users.update().where(missing).values(
+            followers_count=users.c.followers_count + 1,
+            followed_count=users.c.followed_count + 1))
+        timeline.on_self_follows(connection, missing)
+        result = connection.execute(follows.insert().from_select(
+            ['follower_id', 'followed_id', 'timestamp'],
+            db.select([users.c.id.label('follower_id'), users.c.id.label('followed_id'),
+                       db.literal(datetime.utcnow(), type_=db.DateTime)]).where(missing)))
+        db.session.commit()
+        if result.rowcount:
+            identity_cache.clear()
+            response_cache.clear()
+        return max(result.rowcount, 0)
+
+    @staticmethod
+    def recount():
+        """用关联子查询一次性重新计算所有用户和文章的计数字段"""
+        users = User.__table__
+        posts = Post.__table__
+        follows = Follows.__table__
+        comments = Comment.__table__
+        db.session.execute(users.update().values(
+            followers_count=db.select([db.func.count()]).where(
+                follows.c.followed_id == users.c.id).as_scalar(),
+            followed_count=db.select([db.func.count()]).where(
+                follows.c.follower_id == users.c.id).as_scalar(),
+            posts_count=db.select([db.func.count()]).where(
+                posts.c.author_id == users.c.id).as_scalar(),
+        ))
+        db.session.execute(posts.update().values(
+            comments_count=db.select([db.func.count()]).where(
+                comments.c.post_id == posts.c.id).as_scalar(),
+        ))
+        db.session.commit()
+
+    def timeline(self, per_page, after=None, before=None):
+        """
+        关注动态,timeline表中写扩散的文章与关注的大V作者的文章按(timestamp, id)归并
+        :return: KeysetPagination
+        """
+        entries = Post.query.options(db.selectinload('author')) \
+            .join(TimelineEntry, TimelineEntry.post_id == Post.id) \
+            .filter(TimelineEntry.user_id == self.id)
+        sources = []
+        limit = current_app.config['FLASK_TIMELINE_FANOUT_LIMIT']
+        authors = [row[0] for row in db.session.query(User.id)
+                   .join(Follows, Follows.followed_id == User.id)
+                   .filter(Follows.follower_id == self.id, User.followers_count >= limit)]
+        if authors:
+            sources.append((Post.query.options(db.selectinload('author')).filter(Post.author_id.in_(authors)),
+                            (Post.timestamp, Post.id)))
+        return KeysetPagination(entries, (TimelineEntry.timestamp, TimelineEntry.post_id), per_page,
+                                after=after, before=before, keys=('timestamp', 'id'), sources=sources)
 
     def generate_auth_token(self, expiration):
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-        return s.dumps({'id': self.id})
+        """token中带有验证请求需要的声明,见tokens模块"""
+        return tokens.dumps({'id': self.id, 'confirmed': bool(self.confirmed), 'role_id': self.role_id,
+                             'permissions': self.role.permissions if self.role is not None else 0,
+                             'ver': self.token_version or 0}, expiration)
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        """
+        验证token并由声明还原用户,不查询数据库
+        声明之外的属性处于过期状态,访问时才从数据库加载
+        """
+        claims = tokens.loads(token)
+        if claims is None or 'ver' not in claims:
             return None
-        return User.query.filter_by(id=data['id']).first()
+        if claims['ver'] < tokens.revocations.version(claims['id']):
+            return None
+        user = User(id=claims['id'], confirmed=claims['confirmed'], role_id=claims['role_id'])
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+        user._role_permissions = claims['permissions']
+        return user
+
+    def revoke_auth_tokens(self):
+        """
+        吊销已经签发的token,修改密码或角色后调用,由调用者提交
+        提交成功后才写入本进程的吊销列表,提交失败时数据库中的版本没有变化,新签发的token仍然有效
+        """
+        self.token_version = (self.token_version or 0) + 1
+        session = db.object_session(self) or db.session()
+        session.after_commit(tokens.revocations.revoke, self.id, self.token_version)
+
+    def to_json(self, fields=None):
+        """
+        用户资源转化为json格式的字典
+        :param fields: 需要的字段集合,None表示全部字段
+        """
+        return select_fields({
+            'id': lambda: self.id,
+            'url': lambda: url_for('api.get_user', id=self.id, _external=True),
+            'username': lambda: self.username,
+            'name': lambda: self.name,
+            'location': lambda: self.location,
+            'about_me': lambda: self.about_me,
+            'member_since': lambda: self.registration_time,
+            'last_seen': lambda: self.last_seen,
+            'posts_url': lambda: url_for('api.get_user_posts', id=self.id, _external=True),
+            'timeline_url': lambda: url_for('api.get_user_timeline', id=self.id, _external=True),
+            'post_count': lambda: self.posts_count,
+            'followers_count': lambda: self.followers_count,
+            'followed_count': lambda: self.followed_count,
+        }, fields)
+
+    def snapshot(self):
+        """用户和角色的列值,用于身份缓存"""
+        return {'user': column_values(self),
+                'role': column_values(self.role) if self.role is not None else None}
 
-    def to_json(self):
-        """用户资源转化为json格式"""
-        jsonify({
-            'url': url_for('api.get_post', id=self.id, _external=True),
-        })
+    @staticmethod
+    def from_snapshot(snapshot):
+        """由缓存的列值还原用户,以不查询数据库的方式合并进当前session"""
+        user = User(**snapshot['user'])
+        make_transient_to_detached(user)
+        role = None
+        if snapshot['role'] is not None:
+            role = Role(**snapshot['role'])
+            make_transient_to_detached(role)
+        set_committed_value(user, 'role', role)
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def forget_permissions(target, *args):
+        """角色变化,提交或refresh之后下次can()重新读取角色权限"""
+        # 已经被回收的对象过期时target为None
+        if target is not None:
+            target._role_permissions = None
+
+    @staticmethod
+    def invalidate_identity(mapper, connection, target):
+        forget_identities(db.object_session(target), target.id)
+
+    @staticmethod
+    def invalidate_pages(mapper, connection, target):
+        """资料修改后清除个人主页缓存,用户名变化时显示作者名的页面也要清除"""
+        history = db.inspect(target).attrs.username.history
+        tags = ['user:%s' % name for name in (history.deleted or []) + [target.username]]
+        if history.deleted:
+            tags.append('users')
+        response_cache.invalidate_on_commit(db.object_session(target), *tags)
 
     def __repr__(self):
         return '<User %s>' % self.username
 
 
+db.event.listen(User.role_id, 'set', User.forget_permissions)
+db.event.listen(User, 'expire', User.forget_permissions)
+db.event.listen(User, 'refresh', User.forget_permissions)
+# 资料,角色,密码等修改后清除身份缓存
+db.event.listen(User, 'after_update', User.invalidate_identity)
+db.event.listen(User, 'after_delete', User.invalidate_identity)
+db.event.listen(User, 'after_update', User.invalidate_pages)
+
+
+def user_page_tags(connection, *ids):
+    """查询用户名,得到这些用户个人主页的缓存标签"""
+    users = User.__table__
+    rows = connection.execute(db.select([users.c.username]).where(users.c.id.in_(ids)))
+    return ['user:%s' % row[0] for row in rows]
+
+
+def change_counter(connection, table, id, step, *columns):
+    """在当前flush的事务中对计数字段做原子加减,不会丢失并发更新"""
+    if id is None:
+        return
+    connection.execute(table.update().where(table.c.id == id).values(
+        dict((column, table.c[column] + step) for column in columns)))
+
+
+def reassigned(target, key):
+    """
+    本次flush中key列的旧值和新值,没有修改时返回None
+    在after_update中调用,flush完成之前属性历史还没有重置
+    """
+    history = db.inspect(target).attrs[key].history
+    if not history.deleted or not history.added or history.deleted[0] == history.added[0]:
+        return None
+    return history.deleted[0], history.added[0]
+
+
+def forget_identities(session, *ids):
+    """
+    session提交之后清除这些用户的身份缓存
+    提交之前清除时,并发的请求会读到旧的数据并重新写入缓存
+    """
+    for id in set(ids):
+        if id is not None:
+            session.after_commit(identity_cache.delete, id)
+
+
+def user_ids(users):
+    """用户对象或用户id组成的集合"""
+    return set(getattr(user, 'id', user) for user in users)
+
+
+def change_follow_counters(connection, follower_id, followed_ids, step):
+    """批量关注/取消关注时按集合更新双方的计数,并清理身份缓存和个人主页缓存"""
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id.in_(followed_ids)).values(
+        followers_count=users.c.followers_count + step))
+    connection.execute(users.update().where(users.c.id == follower_id).values(
+        followed_count=users.c.followed_count + step * len(followed_ids)))
+    forget_identities(db.session(), follower_id, *followed_ids)
+    if response_cache.enabled:
+        response_cache.invalidate_on_commit(db.session(), *user_page_tags(connection, follower_id, *followed_ids))
+
+
+def on_follows_changed(step):
+    def listener(mapper, connection, target):
+        change_counter(connection, User.__table__, target.followed_id, step, 'followers_count')
+        change_counter(connection, User.__table__, target.follower_id, step, 'followed_count')
+        forget_identities(db.object_session(target), target.followed_id, target.follower_id)
+    return listener
+
+
+db.event.listen(Follows, 'after_insert', on_follows_changed(1))
+db.event.listen(Follows, 'after_delete', on_follows_changed(-1))
+
+
+def on_follows_invalidate(mapper, connection, target):
+    """关注数显示在双方的个人主页上"""
+    if response_cache.enabled:
+        response_cache.invalidate_on_commit(db.object_session(target),
+                                            *user_page_tags(connection, target.follower_id, target.followed_id))
+
+
+db.event.listen(Follows, 'after_insert', on_follows_invalidate)
+db.event.listen(Follows, 'after_delete', on_follows_invalidate)
+# 关注时补入对方最近的文章,取消关注时从timeline中移除
+db.event.listen(Follows, 'after_insert', timeline.on_follow)
+db.event.listen(Follows, 'after_delete', timeline.on_unfollow)
+
+
 class AnonymousUser(AnonymousUserMixin):
     """定义未登录用户权限验证的类"""
     def can(self, permissions):
@@ -205,6 +573,10 @@ class Role(db.Model):
     def __repr__(self):
         return '<Role %s>' % self.name
 
+    @staticmethod
+    def invalidate_identities(mapper, connection, target):
+        db.object_session(target).after_commit(identity_cache.clear)
+
     @staticmethod
     def insert_roles():
         roles = {
@@ -227,6 +599,19 @@ class Role(db.Model):
         db.session.commit()
 
 
+# 角色权限变化时缓存中的所有用户都可能受影响
+db.event.listen(Role, 'after_update', Role.invalidate_identities)
+db.event.listen(Role, 'after_delete', Role.invalidate_identities)
+
+
+def listen_role_changes():
+    """User.role由Role.users的backref生成,映射配置完成后才存在"""
+    db.event.listen(User.role, 'set', User.forget_permissions)
+
+
+db.event.listen(db.mapper, 'after_configured', listen_role_changes, once=True)
+
+
 class Permission:
     FOLLOW = 0X01
     COMMENT = 0X02
@@ -242,35 +627,101 @@ class Post(db.Model):
     title = db.Column(db.String(64), index=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
+    body_hash = db.Column(db.String(40))  # body和标签白名单的哈希,未变化时不重新渲染
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # 修改时先读出旧值,换作者时on_post_reassigned才能找到原作者
+    author_id = db.column_property(db.Column(db.Integer, db.ForeignKey('users.id'), index=True),
+                                   active_history=True)
+    comments_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
+    ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                    'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                    'h1', 'h2', 'h3', 'p']
+
     @staticmethod
     def change_body_to_html(target, value, oldvalue, initiator):
-        allow_tag = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                     'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                     'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format='html'), tags=allow_tag, strip=True))
-
-    def to_json(self):
-        json_post = jsonify({
-            'url': url_for('api.get_post', id=self.id, _external=True),
-            'title': self.title,
-            'body': self.body,
-            'timestamp': self.timestamp,
-            'author': url_for('api.get_user', id=self.author_id, _external=True),
-            'comments': url_for('api.get_comments', id=self.id, _external=True),
-            'comment_count': self.comments.count()
-        })
-        return json_post
+        body_hash, body_html = renderer.render_if_changed(value, Post.ALLOWED_TAGS, target.body_hash)
+        if body_hash is None or body_html is not None:
+            target.body_hash = body_hash
+            target.body_html = body_html
+
+    def to_json(self, fields=None):
+        """
+        文章资源转化为json格式的字典,只使用本行的列,不会触发额外查询
+        :param fields: 需要的字段集合,None表示全部字段
+        """
+        return select_fields({
+            'id': lambda: self.id,
+            'url': lambda: url_for('api.get_post', id=self.id, _external=True),
+            'title': lambda: self.title,
+            'body': lambda: self.body,
+            'body_html': lambda: self.body_html,
+            'timestamp': lambda: self.timestamp,
+            'author': lambda: url_for('api.get_user', id=self.author_id, _external=True),
+            'comments': lambda: url_for('api.get_comments', id=self.id, _external=True),
+            'comment_count': lambda: self.comments_count
+        }, fields)
+
+    @staticmethod
+    def from_json(json_post):
+        """由请求中的json创建文章"""
+        title = json_post.get('title')
+        body = json_post.get('body')
+        if not title or not body:
+            raise ValidationError('post does not have a title or body')
+        return Post(title=title, body=body)
 
 
 # 利用sqlalchemy的event监听POST的body字段,如果设置新值则触发函数
 db.event.listen(Post.body, 'set', Post.change_body_to_html)
 
 
+def on_posts_changed(step):
+    def listener(mapper, connection, target):
+        change_counter(connection, User.__table__, target.author_id, step, 'posts_count')
+        forget_identities(db.object_session(target), target.author_id)
+    return listener
+
+
+def on_post_reassigned(mapper, connection, target):
+    """文章换了作者,文章数从原作者移到新作者"""
+    moved = reassigned(target, 'author_id')
+    if moved is None:
+        return
+    old, new = moved
+    change_counter(connection, User.__table__, old, -1, 'posts_count')
+    change_counter(connection, User.__table__, new, 1, 'posts_count')
+    forget_identities(db.object_session(target), old, new)
+    if response_cache.enabled:
+        response_cache.invalidate_on_commit(db.object_session(target), *user_page_tags(connection, old))
+
+
+db.event.listen(Post, 'after_insert', on_posts_changed(1))
+db.event.listen(Post, 'after_update', on_post_reassigned)
+db.event.listen(Post, 'after_delete', on_posts_changed(-1))
+
+
+def on_posts_invalidate(mapper, connection, target):
+    """文章出现在首页,文章页和作者主页上"""
+    if response_cache.enabled:
+        response_cache.invalidate_on_commit(db.object_session(target), 'posts', 'post:%s' % target.id,
+                                            *user_page_tags(connection, target.author_id))
+
+
+db.event.listen(Post, 'after_insert', on_posts_invalidate)
+db.event.listen(Post, 'after_update', on_posts_invalidate)
+db.event.listen(Post, 'after_delete', on_posts_invalidate)
+# 新文章写扩散到关注者的timeline
+db.event.listen(Post, 'after_insert', timeline.on_post_insert)
+db.event.listen(Post, 'before_delete', timeline.on_post_delete)
+# 标题和正文变化时更新搜索索引
+db.event.listen(Post, 'after_insert', search.on_post_insert)
+db.event.listen(Post, 'after_update', search.on_post_update)
+db.event.listen(Post, 'before_delete', search.on_post_delete)
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
 
@@ -280,12 +731,91 @@ class Comment(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     disable = db.Column(db.Boolean, default=False)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    # 修改时先读出旧值,见on_comment_reassigned
+    post_id = db.column_property(db.Column(db.Integer, db.ForeignKey('posts.id')), active_history=True)
+    body_hash = db.Column(db.String(40))
 
-    @staticmethod
-    def change_body_to_html(target, value, oldvalue, initiator):
-        allow_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format='html'), tags=allow_tags, strip=True))
+    ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
 
+    def to_json(self, fields=None):
+        """
+        评论资源转化为json格式的字典
+        :param fields: 需要的字段集合,None表示全部字段
+        """
+        return select_fields({
+            'id': lambda: self.id,
+            'url': lambda: url_for('api.get_comment', id=self.id, _external=True),
+            'post': lambda: url_for('api.get_post', id=self.post_id, _external=True),
+            'body': lambda: self.body,
+            'body_html': lambda: self.body_html,
+            'timestamp': lambda: self.timestamp,
+            'author': lambda: url_for('api.get_user', id=self.author_id, _external=True),
+        }, fields)
+
+    @staticmethod
+    def from_json(json_comment):
+        """由请求中的json创建评论"""
+        body = json_comment.get('body')
+        if not body:
+            raise ValidationError('comment does not have a body')
+        return Comment(body=body)
 
-db.event.listen(Comment.body, 'set', Comment.change_body_to_html)
\ No newline at end of file
+    @staticmethod
+    def change_body_to_html(target, value, oldvalue, initiator):
+        body_hash, body_html = renderer.render_if_changed(value, Comment.ALLOWED_TAGS, target.body_hash)
+        if body_hash is None or body_html is not None:
+            target.body_hash = body_hash
+            target.body_html = body_html
+
+
+db.event.listen(Comment.body, 'set', Comment.change_body_to_html)
+
+
+def on_comments_changed(step):
+    def listener(mapper, connection, target):
+        change_counter(connection, Post.__table__, target.post_id, step, 'comments_count')
+    return listener
+
+
+def on_comment_reassigned(mapper, connection, target):
+    """评论移到另一篇文章,评论数从原文章移到新文章"""
+    moved = reassigned(target, 'post_id')
+    if moved is None:
+        return
+    old, new = moved
+    change_counter(connection, Post.__table__, old, -1, 'comments_count')
+    change_counter(connection, Post.__table__, new, 1, 'comments_count')
+    if response_cache.enabled:
+        posts = Post.__table__
+        author_ids = [row[0] for row in connection.execute(
+            db.select([posts.c.author_id]).where(posts.c.id.in_([i for i in moved if i is not None])))]
+        response_cache.invalidate_on_commit(db.object_session(target), 'posts',
+                                            *['post:%s' % i for i in moved] + user_page_tags(connection, *author_ids))
+
+
+db.event.listen(Comment, 'after_insert', on_comments_changed(1))
+db.event.listen(Comment, 'after_update', on_comment_reassigned)
+db.event.listen(Comment, 'after_delete', on_comments_changed(-1))
+
+
+def on_comments_invalidate(count_changed):
+    """评论显示在文章页上,评论数还显示在首页和作者主页的文章列表中,审核只影响文章页"""
+    def listener(mapper, connection, target):
+        if not response_cache.enabled:
+            return
+        tags = ['post:%s' % target.post_id]
+        if count_changed and target.post_id is not None:
+            posts = Post.__table__
+            author_id = connection.scalar(db.select([posts.c.author_id]).where(posts.c.id == target.post_id))
+            tags.append('posts')
+            tags.extend(user_page_tags(connection, author_id))
+        response_cache.invalidate_on_commit(db.object_session(target), *tags)
+    return listener
+
+
+db.event.listen(Comment, 'after_insert', on_comments_invalidate(True))
+db.event.listen(Comment, 'after_update', on_comments_invalidate(False))
+db.event.listen(Comment, 'after_delete', on_comments_invalidate(True))
+db.event.listen(Comment, 'after_insert', search.on_comment_insert)
+db.event.listen(Comment, 'after_update', search.on_comment_update)
+db.event.listen(Comment, 'before_delete', search.on_comment_delete)
@@ -0,0 +1,133 @@
+from datetime import datetime
+from flask import abort, current_app, request
+from . import db
+
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(values):
+    """把排序键的值编码成url中的游标字符串"""
+    parts = []
+    for value in values:
+        if isinstance(value, datetime):
+            parts.append(value.strftime(CURSOR_TIME_FORMAT))
+        else:
+            parts.append(str(value))
+    return '_'.join(parts)
+
+
+def decode_cursor(cursor, columns):
+    """把游标字符串按排序列的类型还原,格式错误返回None"""
+    parts = cursor.split('_')
+    if len(parts) != len(columns):
+        return None
+    values = []
+    try:
+        for part, column in zip(parts, columns):
+            if isinstance(column.type, db.DateTime):
+                values.append(datetime.strptime(part, CURSOR_TIME_FORMAT))
+            else:
+                values.append(int(part))
+    except ValueError:
+        return None
+    return values
+
+
+def keyset_condition(columns, values, older):
+    """
+    生成 (c1, c2) < (v1, v2) 形式的条件,展开成or/and以兼容不支持行值比较的数据库
+    :param older: True 取排在游标之后(更旧)的记录, False 取之前(更新)的记录
+    """
+    first, second = columns
+    if older:
+        return db.or_(first < values[0], db.and_(first == values[0], second < values[1]))
+    return db.or_(first > values[0], db.and_(first == values[0], second > values[1]))
+
+
+class KeysetPagination(object):
+    """
+    游标分页结果,按(timestamp, id)倒序,用索引定位而不是OFFSET,也不查询总数
+    接口与flask-sqlalchemy的Pagination保持相近,模板通过cursor属性区分
+    sources可以给出另外几组(query, columns),各自取一页后按排序键归并去重
+    """
+    cursor = True
+
+    def __init__(self, query, columns, per_page, after=None, before=None, keys=None, sources=()):
+        self.per_page = per_page
+        self.columns = columns
+        # 记录上取排序键值的属性名,默认与排序列同名
+        self.keys = keys or [column.key for column in columns]
+        values = None
+        if after is not None or before is not None:
+            values = decode_cursor(after if after is not None else before, columns)
+            if values is None:
+                abort(404)
+
+        # 每个来源多取一条判断是否还有下一页
+        fetched = []
+        for source, source_columns in [(query, columns)] + list(sources):
+            if values is not None:
+                source = source.filter(keyset_condition(source_columns, values, older=before is None))
+            if before is not None:
+                source = source.order_by(*[c.asc() for c in source_columns])
+            else:
+                source = source.order_by(*[c.desc() for c in source_columns])
+            fetched.extend(source.limit(per_page + 1).all())
+        items = []
+        seen = set()
+        for item in sorted(fetched, key=self.key_of, reverse=before is None):
+            key = self.key_of(item)
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+
+        if before is not None:
+            more = len(items) > per_page
+            items = list(reversed(items[:per_page]))
+            self.has_prev = more
+            self.has_next = True
+        else:
+            self.has_next = len(items) > per_page
+            items = items[:per_page]
+            self.has_prev = after is not None
+        self.items = items
+
+    def key_of(self, item):
+        return tuple(getattr(item, key) for key in self.keys)
+
+    def cursor_of(self, item):
+        return encode_cursor(self.key_of(item))
+
+    @property
+    def next_cursor(self):
+        """下一页(更旧)的游标"""
+        if not self.items:
+            return None
+        return self.cursor_of(self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        """上一页(更新)的游标"""
+        if not self.items:
+            return None
+        return self.cursor_of(self.items[0])
+
+
+def paginate(query, columns, per_page, page=None):
+    """
+    根据配置或请求参数选择分页方式
+    FLASK_CURSOR_PAGINATION开启或者url中带有after/before参数时使用游标分页,否则使用页码分页,列表查询可以读副本
+    :param columns: 排序列,(timestamp, id)
+    :param page: 页码分页时使用的页码,默认取url中的page参数
+    """
+    with db.reading():
+        if current_app.config['FLASK_CURSOR_PAGINATION'] \
+                or 'after' in request.args or 'before' in request.args:
+            # 空游标表示第一页
+            return KeysetPagination(query, columns, per_page,
+                                    after=request.args.get('after') or None,
+                                    before=request.args.get('before') or None)
+        if page is None:
+            page = request.args.get('page', 1, type=int)
+        return query.order_by(*[c.desc() for c in columns]).paginate(page, per_page=per_page, error_out=True)
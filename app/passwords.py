@@ -0,0 +1,79 @@
+"""
+密码哈希策略
+FLASK_PASSWORD_METHOD 和 FLASK_PASSWORD_SALT_LENGTH 决定新密码的哈希参数,
+登录时发现已保存的哈希参数与配置不同,验证成功后按新参数重新计算;
+API的HTTP Basic认证每个请求都带密码: 验证成功后用remember记住(邮箱, 密码),
+FLASK_CREDENTIAL_CACHE_TTL秒内is_cached命中时不再重复计算哈希;
+缓存中只保存密码的HMAC,修改密码后已保存的哈希变化,缓存随之失效
+"""
+import hashlib
+import hmac
+import os
+import time
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from . import credential_cache
+
+
+DEFAULT_METHOD = 'pbkdf2:sha256'
+DEFAULT_SALT_LENGTH = 8
+# 进程内随机的HMAC密钥,缓存的键不能用来离线猜测密码
+_cache_key = os.urandom(32)
+
+
+def policy():
+    """(哈希方法, 盐长度),没有应用上下文时使用werkzeug的默认值"""
+    if not has_app_context():
+        return DEFAULT_METHOD, DEFAULT_SALT_LENGTH
+    config = current_app.config
+    return config['FLASK_PASSWORD_METHOD'], config['FLASK_PASSWORD_SALT_LENGTH']
+
+
+def normalize(method):
+    """pbkdf2没有指定迭代次数时补上werkzeug的默认次数,与保存的哈希中的写法一致"""
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        return '%s:%d' % (method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+def hash_password(password):
+    method, salt_length = policy()
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def needs_rehash(pwhash):
+    """保存的哈希的方法,迭代次数或盐长度与当前配置不同"""
+    if not pwhash or pwhash.count('$') != 2:
+        return True
+    method, salt, _ = pwhash.split('$')
+    configured, salt_length = policy()
+    return method != normalize(configured) or len(salt) != salt_length
+
+
+def cache_key(email, password):
+    digest = hmac.new(_cache_key, password.encode('utf-8'), hashlib.sha256).hexdigest()
+    return 'credential:%s:%s' % (email.lower(), digest)
+
+
+def is_cached(user, password):
+    """最近验证成功过,并且之后没有修改密码"""
+    if not current_app.config['FLASK_CREDENTIAL_CACHE_TTL'] or not user.password_hash:
+        return False
+    return hmac.compare_digest(credential_cache.get(cache_key(user.email, password), ''), user.password_hash)
+
+
+def remember(user, password):
+    """验证成功后调用"""
+    timeout = current_app.config['FLASK_CREDENTIAL_CACHE_TTL']
+    if timeout:
+        credential_cache.set(cache_key(user.email, password), user.password_hash, timeout=timeout)
+
+
+def measure(method=None, salt_length=DEFAULT_SALT_LENGTH, samples=5):
+    """计算一次哈希的平均耗时(秒),用于选择迭代次数"""
+    method = method or policy()[0]
+    begin = time.time()
+    for i in range(samples):
+        check_password_hash(generate_password_hash('benchmark password', method, salt_length), 'x')
+    return (time.time() - begin) / (samples * 2)
@@ -0,0 +1,203 @@
+"""
+请求级SQL分析
+通过SQLAlchemy引擎事件统计每个请求执行的语句数和数据库耗时,通过Jinja模板类统计模板渲染耗时
+以及渲染过程中触发的查询(通常是模板中的延迟加载),并记录最慢语句在app代码或模板中的调用位置
+FLASK_PROFILER 开启后生效; 调试模式或FLASK_PROFILER_HEADERS开启时把结果写入响应头;
+各endpoint的汇总结果可以通过report()或 /_profiler 查看, /_profiler 同时返回连接池状态
+"""
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+from flask import current_app, g, has_request_context, jsonify, request, abort
+from flask.ext.login import current_user
+from jinja2 import Template
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+from .exceptions import QueryBudgetExceeded
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfile(object):
+    """一个请求的统计数据"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_queries = 0
+        self.rendering = 0
+        self.statements = []
+
+    def add_query(self, duration, statement, origin):
+        self.queries += 1
+        self.db_time += duration
+        if self.rendering:
+            self.template_queries += 1
+        self.statements.append((duration, statement, origin))
+
+
+def current_profile():
+    if not has_request_context():
+        return None
+    return getattr(g, '_query_profile', None)
+
+
+class ProfiledTemplate(Template):
+    """记录顶层模板的渲染耗时,include和继承的模板计入顶层模板"""
+
+    def render(self, *args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return Template.render(self, *args, **kwargs)
+        profile.rendering += 1
+        begin = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            profile.rendering -= 1
+            if not profile.rendering:
+                profile.template_time += time.time() - begin
+
+
+class QueryProfiler(object):
+    """按endpoint汇总请求的查询数和耗时,超出查询预算时记录警告或抛出QueryBudgetExceeded"""
+
+    def __init__(self, app=None):
+        self.root = os.path.dirname(os.path.abspath(__file__))
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASK_PROFILER', False)
+        app.config.setdefault('FLASK_PROFILER_HEADERS', False)
+        app.config.setdefault('FLASK_PROFILER_SLOW_QUERY', 0.1)
+        app.config.setdefault('FLASK_PROFILER_SLOWEST', 5)
+        app.config.setdefault('FLASK_PROFILER_QUERY_BUDGET', None)
+        app.config.setdefault('FLASK_PROFILER_BUDGETS', {})
+        app.config.setdefault('FLASK_PROFILER_BUDGET_ACTION', 'log')
+        app.extensions['profiler'] = self
+        if not app.config['FLASK_PROFILER']:
+            return
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+            self._listening = True
+        app.jinja_env.template_class = ProfiledTemplate
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.teardown)
+        app.add_url_rule('/_profiler', 'profiler_report', self.report_view)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if current_profile() is not None:
+            conn.info.setdefault('profiler_start', []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile()
+        starts = conn.info.get('profiler_start')
+        if profile is None or not starts:
+            return
+        duration = time.time() - starts.pop()
+        origin = self.origin()
+        profile.add_query(duration, statement, origin)
+        if duration >= current_app.config['FLASK_PROFILER_SLOW_QUERY']:
+            logger.warning('slow query %.1fms at %s: %s', duration * 1000, origin, statement)
+
+    def origin(self):
+        """
+        调用栈中最内层的app代码或模板的位置
+        每条语句都要调用,从当前帧向外找到第一个app中的帧就停止,不像traceback.extract_stack那样读取整个调用栈的源码
+        """
+        frame = sys._getframe(1)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(self.root) and filename != __file__:
+                return '%s:%d' % (os.path.relpath(filename, self.root), frame.f_lineno)
+            frame = frame.f_back
+        return None
+
+    def start(self):
+        g._query_profile = RequestProfile()
+
+    def budget(self, endpoint):
+        budgets = current_app.config['FLASK_PROFILER_BUDGETS']
+        return budgets.get(endpoint, current_app.config['FLASK_PROFILER_QUERY_BUDGET'])
+
+    def finish(self, response):
+        profile = current_profile()
+        if profile is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        self.record(endpoint, profile)
+        config = current_app.config
+        if current_app.debug or config['FLASK_PROFILER_HEADERS']:
+            response.headers['X-DB-Queries'] = str(profile.queries)
+            response.headers['X-DB-Time'] = '%.2f' % (profile.db_time * 1000)
+            response.headers['X-Template-Time'] = '%.2f' % (profile.template_time * 1000)
+            response.headers['X-Template-Queries'] = str(profile.template_queries)
+        budget = self.budget(endpoint)
+        if budget is not None and profile.queries > budget:
+            message = '%s issued %d queries, budget is %d' % (endpoint, profile.queries, budget)
+            if config['FLASK_PROFILER_BUDGET_ACTION'] == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def teardown(self, exc):
+        if hasattr(g, '_query_profile'):
+            del g._query_profile
+
+    def record(self, endpoint, profile):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'template_queries': 0,
+                    'db_time': 0.0, 'template_time': 0.0, 'slowest': [],
+                }
+            stats['requests'] += 1
+            stats['queries'] += profile.queries
+            stats['max_queries'] = max(stats['max_queries'], profile.queries)
+            stats['template_queries'] += profile.template_queries
+            stats['db_time'] += profile.db_time
+            stats['template_time'] += profile.template_time
+            keep = current_app.config['FLASK_PROFILER_SLOWEST']
+            stats['slowest'] = heapq.nlargest(keep, stats['slowest'] + profile.statements,
+                                              key=lambda item: item[0])
+
+    def report(self):
+        """各endpoint的汇总结果,时间单位为毫秒"""
+        with self._lock:
+            report = {}
+            for endpoint, stats in self._endpoints.items():
+                count = stats['requests']
+                report[endpoint] = {
+                    'requests': count,
+                    'avg_queries': float(stats['queries']) / count,
+                    'max_queries': stats['max_queries'],
+                    'template_queries': stats['template_queries'],
+                    'avg_db_ms': stats['db_time'] * 1000 / count,
+                    'avg_template_ms': stats['template_time'] * 1000 / count,
+                    'slowest': [{'ms': duration * 1000, 'statement': statement, 'origin': origin}
+                                for duration, statement, origin in stats['slowest']],
+                }
+            return report
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def report_view(self):
+        """调试模式或管理员可以查看汇总结果和连接池状态"""
+        from . import db
+        if not current_app.debug and not current_user.is_administrator():
+            abort(404)
+        return jsonify(endpoints=self.report(), pool=db.pool_metrics())
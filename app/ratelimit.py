@@ -0,0 +1,85 @@
+"""
+令牌桶限流
+每个键一个桶,容量为burst,每秒补充rate个令牌,请求时取一个令牌,桶空时拒绝;
+登录和API的HTTP Basic认证在计算密码哈希之前按邮箱和IP各取一个令牌,
+撞库时单个邮箱每秒最多触发rate次哈希计算,缓存命中的API请求不消耗令牌;
+同一个出口IP后面可能有很多用户,IP的桶单独配置,通常比邮箱的桶大;
+登录成功后归还令牌,只有失败的尝试计入限流
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+
+
+class TokenBucketLimiter(object):
+
+    def __init__(self, app=None, maxsize=100000):
+        # 只保留最近使用的maxsize个桶,淘汰的桶相当于已经补满
+        self.maxsize = maxsize
+        self.rate = 1.0
+        self.burst = 10
+        self.ip_rate = 10.0
+        self.ip_burst = 100
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASK_LOGIN_RATE', 1.0)
+        app.config.setdefault('FLASK_LOGIN_BURST', 10)
+        app.config.setdefault('FLASK_LOGIN_IP_RATE', 10.0)
+        app.config.setdefault('FLASK_LOGIN_IP_BURST', 100)
+        self.rate = app.config['FLASK_LOGIN_RATE']
+        self.burst = app.config['FLASK_LOGIN_BURST']
+        self.ip_rate = app.config['FLASK_LOGIN_IP_RATE']
+        self.ip_burst = app.config['FLASK_LOGIN_IP_BURST']
+
+    def _refill(self, key, now, rate, burst):
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        return min(burst, tokens + (now - updated) * rate)
+
+    def consume(self, key, now=None, rate=None, burst=None):
+        """取一个令牌,成功返回True; burst为0时不限流"""
+        rate = self.rate if rate is None else rate
+        burst = self.burst if burst is None else burst
+        if not self.burst or not burst:
+            return True
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens = self._refill(key, now, rate, burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def refund(self, key, now=None, rate=None, burst=None):
+        """归还一个令牌"""
+        rate = self.rate if rate is None else rate
+        burst = self.burst if burst is None else burst
+        now = time.time() if now is None else now
+        with self._lock:
+            if key in self._buckets:
+                self._buckets[key] = (min(burst, self._refill(key, now, rate, burst) + 1), now)
+
+    def allow_login(self, email):
+        """
+        按邮箱和来源IP各取一个令牌,两个都取到才允许计算密码哈希;
+        来源IP是request.remote_addr,在反向代理后面部署时要配置FLASK_PROXY_COUNT
+        """
+        allowed = self.consume('ip:%s' % request.remote_addr, rate=self.ip_rate, burst=self.ip_burst)
+        # 邮箱的桶在IP被限流时也扣减,换IP撞同一个账号同样受限
+        return self.consume('email:%s' % (email or '').lower()) and allowed
+
+    def login_succeeded(self, email):
+        """密码验证成功,归还allow_login取的令牌"""
+        self.refund('ip:%s' % request.remote_addr, rate=self.ip_rate, burst=self.ip_burst)
+        self.refund('email:%s' % (email or '').lower())
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
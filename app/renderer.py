@@ -0,0 +1,103 @@
+import hashlib
+import threading
+from sqlalchemy import bindparam, select
+from .cache import LRUCache
+
+
+class MarkdownRenderer(object):
+    """
+    markdown渲染服务
+    以正文和允许标签白名单的哈希作为键缓存渲染结果,正文未变化时不重复渲染,
+    白名单变化后哈希随之变化,可以用rerender批量更新已保存的body_html
+    """
+
+    def __init__(self, app=None, maxsize=1024):
+        self.cache = LRUCache(maxsize)
+        # Markdown,bleach的Cleaner和Linker创建开销大且不是线程安全的,每个线程各保留一份
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.maxsize = app.config.get('FLASK_MARKDOWN_CACHE_SIZE', self.cache.maxsize)
+
+    @staticmethod
+    def content_hash(body, tags):
+        """正文和白名单共同决定的哈希值"""
+        h = hashlib.sha1(body.encode('utf-8'))
+        h.update(b'\0')
+        h.update(','.join(sorted(tags)).encode('utf-8'))
+        return h.hexdigest()
+
+    def converters(self, tags):
+        # markdown和bleach导入较慢,第一次渲染时才导入,不渲染正文的命令和进程不需要加载
+        from markdown import Markdown
+        from bleach.linkifier import Linker
+        from bleach.sanitizer import Cleaner
+        local = self._local
+        if not hasattr(local, 'markdown'):
+            local.markdown = Markdown(output_format='html')
+            local.sanitizers = {}
+        key = tuple(tags)
+        if key not in local.sanitizers:
+            local.sanitizers[key] = Cleaner(tags=tags, strip=True), Linker()
+        return (local.markdown,) + local.sanitizers[key]
+
+    def to_html(self, body, tags):
+        md, cleaner, linker = self.converters(tags)
+        return linker.linkify(cleaner.clean(md.reset().convert(body)))
+
+    def render(self, body, tags):
+        """
+        渲染markdown,命中缓存时直接返回
+        :return: (哈希值, html)
+        """
+        key = self.content_hash(body, tags)
+        html = self.cache.get(key)
+        if html is None:
+            html = self.to_html(body, tags)
+            self.cache.set(key, html)
+        return key, html
+
+    def render_if_changed(self, body, tags, old_hash):
+        """
+        哈希与已保存的相同时不渲染
+        :return: (哈希值, html), 未变化时html为None
+        """
+        if body is None:
+            return None, None
+        key = self.content_hash(body, tags)
+        if key == old_hash:
+            return key, None
+        return self.render(body, tags)
+
+    def rerender(self, session, model, tags, chunk_size=500):
+        """
+        按主键分批重新渲染表中哈希已过期的body_html
+        :param model: Post 或 Comment
+        :return: 更新的行数
+        """
+        table = model.__table__
+        update = table.update().where(table.c.id == bindparam('_id')) \
+            .values(body_html=bindparam('body_html'), body_hash=bindparam('body_hash'))
+        updated = 0
+        last_id = 0
+        while True:
+            rows = session.execute(
+                select([table.c.id, table.c.body, table.c.body_hash])
+                .where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            changes = []
+            for id, body, body_hash in rows:
+                if body is None:
+                    continue
+                key = self.content_hash(body, tags)
+                if key != body_hash:
+                    changes.append({'_id': id, 'body_hash': key, 'body_html': self.to_html(body, tags)})
+            if changes:
+                session.execute(update, changes)
+                session.commit()
+                updated += len(changes)
+        return updated
@@ -0,0 +1,110 @@
+import hashlib
+import uuid
+from functools import wraps
+from flask import current_app, has_app_context, request, session
+from flask.ext.login import current_user
+from .cache import LRUCache, FileSystemCache
+
+
+class ResponseCache(object):
+    """
+    匿名访问的整页缓存
+    每个缓存条目依赖若干标签(如 'posts', 'post:3', 'user:john'),键中包含这些标签当前的版本号,
+    数据变化时更新对应标签的版本号,旧条目不再被命中,由LRU或过期时间淘汰
+    FLASK_RESPONSE_CACHE 为 'memory' 或 'filesystem' 时开启, 为None时不缓存
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASK_RESPONSE_CACHE', None)
+        app.config.setdefault('FLASK_RESPONSE_CACHE_SIZE', 1000)
+        app.config.setdefault('FLASK_RESPONSE_CACHE_DIR', None)
+        app.config.setdefault('FLASK_RESPONSE_CACHE_TIMEOUT', 60)
+        kind = app.config['FLASK_RESPONSE_CACHE']
+        if kind == 'memory':
+            backend = LRUCache(app.config['FLASK_RESPONSE_CACHE_SIZE'])
+        elif kind == 'filesystem':
+            backend = FileSystemCache(app.config['FLASK_RESPONSE_CACHE_DIR'],
+                                      maxsize=app.config['FLASK_RESPONSE_CACHE_SIZE'])
+        elif kind is None:
+            backend = None
+        else:
+            raise ValueError('unknown response cache backend: %s' % kind)
+        app.extensions['response_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('response_cache')
+
+    @property
+    def enabled(self):
+        return has_app_context() and self.backend is not None
+
+    def version(self, tag):
+        """标签当前的版本号,不存在时生成一个新的"""
+        token = self.backend.get('tag:' + tag)
+        if token is None:
+            token = uuid.uuid4().hex
+            self.backend.set('tag:' + tag, token)
+        return token
+
+    def invalidate(self, *tags):
+        """使依赖这些标签的缓存全部失效"""
+        if not self.enabled:
+            return
+        for tag in tags:
+            self.backend.set('tag:' + tag, uuid.uuid4().hex)
+
+    def invalidate_on_commit(self, session, *tags):
+        """
+        在session的事务提交之后再使标签失效,由flush中的事件监听器调用
+        提交之前失效时,并发的匿名请求会读到旧数据并按新的标签版本缓存下来
+        """
+        if self.enabled and tags:
+            session.after_commit(self.invalidate, *tags)
+
+    def clear(self):
+        """清空全部缓存,用于批量导入数据之后"""
+        if self.enabled:
+            self.backend.clear()
+
+    def make_key(self, prefix, tags):
+        versions = ','.join(self.version(tag) for tag in tags)
+        return prefix + ':' + hashlib.sha1(versions.encode('utf-8')).hexdigest()
+
+    def cacheable(self):
+        """只缓存匿名用户的GET请求,有待显示的flash消息时不缓存"""
+        return self.backend is not None and request.method == 'GET' \
+            and current_user.is_anonymous and '_flashes' not in session
+
+    def cached(self, tags):
+        """
+        缓存视图的整页响应
+        :param tags: 接收视图参数,返回依赖标签列表的函数
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.cacheable():
+                    return f(*args, **kwargs)
+                prefix = 'page:%s?%s' % (request.endpoint, request.query_string.decode('utf-8'))
+                key = self.make_key(prefix, tags(**kwargs))
+                cached = self.backend.get(key)
+                if cached is not None:
+                    body, status, headers = cached
+                    response = current_app.response_class(body, status=status, headers=headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    # 缓存的页面带有ETag时,客户端验证器仍有效则直接返回304
+                    return response.make_conditional(request)
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    headers = [(k, v) for k, v in response.headers if k.lower() != 'set-cookie']
+                    self.backend.set(key, (response.get_data(), response.status_code, headers),
+                                     timeout=current_app.config['FLASK_RESPONSE_CACHE_TIMEOUT'])
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return decorated_function
+        return decorator
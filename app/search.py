@@ -0,0 +1,238 @@
+"""
+文章和评论的全文搜索
+倒排索引保存在数据库的search_documents(文档长度)和search_postings(词项, 文档, 词频)表中,
+文章和评论保存时由模型事件增量更新, 按BM25在数据库中计算得分并排序
+分词: 拉丁字母和数字按单词切分并转为小写; 中日韩文字没有空格分隔,按相邻两个字切分(bigram),
+单独的一个字作为一个词项; 建索引时每个字也作为词项(unigram),只有一个字的查询可以匹配较长的词中的字,
+查询时两个字以上的词只按bigram匹配
+"""
+import math
+import re
+from collections import Counter
+from . import db
+from .cache import LRUCache
+
+
+# 平假名,片假名,CJK扩展A,CJK统一汉字,韩文音节,CJK兼容汉字
+CJK = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_RE = re.compile(u'[%s]+|[a-z0-9]+' % CJK)
+CJK_RE = re.compile(u'[%s]' % CJK)
+MAX_TERM_LENGTH = 32
+MAX_QUERY_TERMS = 16
+TITLE_WEIGHT = 2
+K1 = 1.2
+B = 0.75
+
+# 文档总数和平均长度,每次搜索都需要,缓存一段时间
+stats_cache = LRUCache(1)
+STATS_TIMEOUT = 60
+
+
+def tokenize(text, unigrams=False):
+    """
+    把文本切分为词项列表
+    :param unigrams: 连续的中日韩文字除bigram外每个字也作为词项,建索引时使用
+    """
+    if not text:
+        return []
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if CJK_RE.match(token):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+                if unigrams:
+                    terms.extend(token)
+        else:
+            terms.append(token[:MAX_TERM_LENGTH])
+    return terms
+
+
+def tables():
+    metadata = db.metadata.tables
+    return metadata['search_documents'], metadata['search_postings']
+
+
+def post_terms(title, body):
+    """标题中的词项权重更高"""
+    counts = Counter(tokenize(body, unigrams=True))
+    for term in tokenize(title, unigrams=True):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+
+def comment_terms(body):
+    return Counter(tokenize(body, unigrams=True))
+
+
+def remove(connection, kind, id):
+    documents, postings = tables()
+    connection.execute(postings.delete().where(db.and_(postings.c.kind == kind, postings.c.doc_id == id)))
+    connection.execute(documents.delete().where(db.and_(documents.c.kind == kind, documents.c.id == id)))
+
+
+def index(connection, kind, id, post_id, counts):
+    """重建一篇文档的索引"""
+    documents, postings = tables()
+    remove(connection, kind, id)
+    if not counts:
+        return
+    connection.execute(documents.insert().values(kind=kind, id=id, post_id=post_id,
+                                                 length=sum(counts.values())))
+    connection.execute(postings.insert(), [{'term': term, 'kind': kind, 'doc_id': id, 'tf': tf}
+                                           for term, tf in counts.items()])
+
+
+def changed(target, *names):
+    state = db.inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def on_post_insert(mapper, connection, target):
+    index(connection, 'post', target.id, target.id, post_terms(target.title, target.body))
+
+
+def on_post_update(mapper, connection, target):
+    if changed(target, 'title', 'body'):
+        index(connection, 'post', target.id, target.id, post_terms(target.title, target.body))
+
+
+def on_post_delete(mapper, connection, target):
+    remove(connection, 'post', target.id)
+
+
+def on_comment_insert(mapper, connection, target):
+    if not target.disable:
+        index(connection, 'comment', target.id, target.post_id, comment_terms(target.body))
+
+
+def on_comment_update(mapper, connection, target):
+    """被屏蔽的评论从索引中删除,恢复后重新加入"""
+    if not changed(target, 'body', 'disable'):
+        return
+    if target.disable:
+        remove(connection, 'comment', target.id)
+    else:
+        index(connection, 'comment', target.id, target.post_id, comment_terms(target.body))
+
+
+def on_comment_delete(mapper, connection, target):
+    remove(connection, 'comment', target.id)
+
+
+def stats(connection):
+    """文档总数和平均长度"""
+    cached = stats_cache.get('stats')
+    if cached is None:
+        documents = tables()[0]
+        count, total = connection.execute(
+            db.select([db.func.count(), db.func.sum(documents.c.length)])).fetchone()
+        cached = (count or 0, float(total or 0) / count if count else 0.0)
+        stats_cache.set('stats', cached, timeout=STATS_TIMEOUT)
+    return cached
+
+
+def search(query, page=1, per_page=20):
+    """
+    按BM25得分返回一页结果
+    :return: ([(kind, doc_id, post_id, score), ...], 是否还有下一页)
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return [], False
+    documents, postings = tables()
+    connection = db.session.connection()
+    count, avg_length = stats(connection)
+    if not count:
+        return [], False
+    frequencies = dict(connection.execute(
+        db.select([postings.c.term, db.func.count()])
+        .where(postings.c.term.in_(terms)).group_by(postings.c.term)).fetchall())
+    terms = [term for term in terms if frequencies.get(term)]
+    if not terms:
+        return [], False
+    idf = dict((term, math.log(1 + (count - frequencies[term] + 0.5) / (frequencies[term] + 0.5)))
+               for term in terms)
+    tf = db.cast(postings.c.tf, db.Float)
+    norm = K1 * (1 - B + B * db.cast(documents.c.length, db.Float) / max(avg_length, 1.0))
+    weight = db.case([(postings.c.term == term, idf[term]) for term in terms], else_=0.0)
+    score = db.func.sum(weight * tf * (K1 + 1) / (tf + norm)).label('score')
+    rows = connection.execute(
+        db.select([postings.c.kind, postings.c.doc_id, documents.c.post_id, score])
+        .select_from(postings.join(documents, db.and_(documents.c.kind == postings.c.kind,
+                                                      documents.c.id == postings.c.doc_id)))
+        .where(postings.c.term.in_(terms))
+        .group_by(postings.c.kind, postings.c.doc_id, documents.c.post_id)
+        .order_by(db.desc('score'), postings.c.doc_id.desc())
+        .limit(per_page + 1).offset((page - 1) * per_page)).fetchall()
+    return [tuple(row) for row in rows[:per_page]], len(rows) > per_page
+
+
+class SearchResults(object):
+    """一页搜索结果,文章和评论各用一条IN查询加载"""
+
+    def __init__(self, query, page, per_page):
+        from .models import Post, Comment
+        self.query = query
+        self.page = page
+        rows, self.has_next = search(query, page, per_page)
+        self.has_prev = page > 1
+        post_ids = set(post_id for kind, doc_id, post_id, score in rows)
+        comment_ids = set(doc_id for kind, doc_id, post_id, score in rows if kind == 'comment')
+        posts = dict((p.id, p) for p in Post.query.options(db.selectinload('author'))
+                     .filter(Post.id.in_(post_ids))) if post_ids else {}
+        comments = dict((c.id, c) for c in Comment.query.options(db.selectinload('author'))
+                        .filter(Comment.id.in_(comment_ids))) if comment_ids else {}
+        self.items = []
+        for kind, doc_id, post_id, score in rows:
+            item = posts.get(doc_id) if kind == 'post' else comments.get(doc_id)
+            if item is not None and post_id in posts:
+                self.items.append({'kind': kind, 'score': score, 'item': item, 'post': posts[post_id]})
+
+
+def rebuild(chunk_size=1000):
+    """
+    按主键分批重建全部索引
+    :return: (文章数, 评论数)
+    """
+    documents, postings = tables()
+    metadata = db.metadata.tables
+    posts, comments = metadata['posts'], metadata['comments']
+    engine = db.get_engine()
+    with engine.begin() as connection:
+        connection.execute(postings.delete())
+        connection.execute(documents.delete())
+    indexed = []
+    for table, columns, where, build in (
+            (posts, [posts.c.id, posts.c.id.label('post_id'), posts.c.title, posts.c.body], None,
+             lambda row: ('post', post_terms(row[2], row[3]))),
+            (comments, [comments.c.id, comments.c.post_id, comments.c.body],
+             db.or_(comments.c.disable == None, comments.c.disable == False),
+             lambda row: ('comment', comment_terms(row[2])))):
+        last_id = 0
+        count = 0
+        while True:
+            with engine.begin() as connection:
+                query = db.select(columns).where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)
+                if where is not None:
+                    query = query.where(where)
+                rows = connection.execute(query).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                docs, terms = [], []
+                for row in rows:
+                    kind, counts = build(row)
+                    if not counts:
+                        continue
+                    docs.append({'kind': kind, 'id': row[0], 'post_id': row[1], 'length': sum(counts.values())})
+                    terms.extend({'term': term, 'kind': kind, 'doc_id': row[0], 'tf': tf}
+                                 for term, tf in counts.items())
+                if docs:
+                    connection.execute(documents.insert(), docs)
+                    connection.execute(postings.insert(), terms)
+                count += len(docs)
+        indexed.append(count)
+    stats_cache.clear()
+    return tuple(indexed)
@@ -0,0 +1,113 @@
+"""
+启动耗时分析
+ImportTimer包装builtins.__import__,记录每个模块第一次导入时的自身耗时和累计耗时(包含它导入的模块)
+measure()在新的解释器中导入目标并创建应用,不受当前进程已经导入的模块影响;
+本模块只使用标准库,子进程在导入app包之前按文件路径加载它,app包自身的导入也会被统计
+"""
+import builtins
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# 子进程按文件路径加载本模块后执行main
+BOOTSTRAP = ("import importlib.util, sys; "
+             "spec = importlib.util.spec_from_file_location('_startup', sys.argv[1]); "
+             "module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module); "
+             "module.main(sys.argv[2:])")
+
+# app: 导入app包并创建完整的应用; manage: 导入manage.py,与执行recount等一次性数据命令时相同
+TARGETS = ('app', 'manage')
+
+
+class ImportTimer(object):
+
+    def __init__(self):
+        self.records = {}
+        self._stack = []
+        self._import = None
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self
+
+    def uninstall(self):
+        builtins.__import__ = self._import
+
+    def resolve(self, name, globals, level):
+        if not level:
+            return name
+        package = (globals or {}).get('__package__') or (globals or {}).get('__name__', '')
+        try:
+            return importlib.util.resolve_name('.' * level + name, package)
+        except (ImportError, ValueError):
+            return name
+
+    def __call__(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = self.resolve(name, globals, level)
+        if module in sys.modules and not fromlist:
+            return self._import(name, globals, locals, fromlist, level)
+        self._stack.append(0.0)
+        begin = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - begin
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            # from x import y 中y是子模块时也会在这里加载,已经导入过的模块只记录第一次
+            if elapsed > 0 and module not in self.records and module in sys.modules:
+                self.records[module] = (elapsed - children, elapsed)
+
+    def report(self, limit=20):
+        """按累计耗时排序,时间单位为毫秒"""
+        rows = sorted(self.records.items(), key=lambda item: item[1][1], reverse=True)
+        return [{'module': module, 'self_ms': own * 1000, 'cumulative_ms': total * 1000}
+                for module, (own, total) in rows[:limit]]
+
+
+def load(target, config_name):
+    if target == 'manage':
+        sys.argv = ['manage.py', 'recount']
+        import manage  # noqa
+    else:
+        from app import create_app
+        create_app(config_name)
+
+
+def main(argv):
+    """子进程入口: target, config_name, limit"""
+    target, config_name, limit = argv[0], argv[1], int(argv[2])
+    timer = ImportTimer()
+    begin = time.time()
+    timer.install()
+    try:
+        load(target, config_name)
+    finally:
+        timer.uninstall()
+    total = time.time() - begin
+    json.dump({'target': target, 'total_ms': total * 1000, 'modules': timer.report(limit)}, sys.stdout)
+
+
+def measure(target='app', config_name='default', limit=20, root=None):
+    """在新的解释器中测量启动耗时,返回main输出的结果"""
+    if target not in TARGETS:
+        raise ValueError('unknown target %r' % target)
+    root = root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, FLASK_CONFIG=config_name, PYTHONPATH=root)
+    output = subprocess.check_output(
+        [sys.executable, '-c', BOOTSTRAP, os.path.abspath(__file__), target, config_name, str(limit)],
+        cwd=root, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def report(result):
+    lines = ['%s: %.1f ms' % (result['target'], result['total_ms']),
+             '%10s %10s  %s' % ('self ms', 'cum ms', 'module')]
+    for row in result['modules']:
+        lines.append('%10.1f %10.1f  %s' % (row['self_ms'], row['cumulative_ms'], row['module']))
+    return '\n'.join(lines)
@@ -0,0 +1,55 @@
+"""
+Jinja模板的字节码缓存和预编译
+FLASK_TEMPLATE_CACHE_DIR 设置后编译结果保存在该目录,新启动的进程直接加载字节码而不是重新解析模板,
+缓存按模板源码的校验和失效; 部署时用 manage.py compile_templates 预先编译全部模板(包括扩展的模板)
+FLASK_TEMPLATE_AUTO_RELOAD 关闭后不再在每次渲染前检查模板文件是否修改
+FLASK_TEMPLATE_PRELOAD 开启后创建应用时加载全部模板,第一个请求不需要再编译
+"""
+import logging
+import os
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateCache(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASK_TEMPLATE_CACHE_DIR', None)
+        app.config.setdefault('FLASK_TEMPLATE_AUTO_RELOAD', True)
+        app.config.setdefault('FLASK_TEMPLATE_PRELOAD', False)
+        app.extensions['template_cache'] = self
+        env = app.jinja_env
+        env.auto_reload = app.config['FLASK_TEMPLATE_AUTO_RELOAD']
+        directory = app.config['FLASK_TEMPLATE_CACHE_DIR']
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    def compile(self, app):
+        """
+        加载全部模板,编译结果写入字节码缓存和环境的模板缓存
+        需要在注册完蓝本之后调用,扩展的模板由蓝本提供
+        :return: (编译的模板数, [(模板名, 错误信息)])
+        """
+        env = app.jinja_env
+        names = env.list_templates()
+        # 环境的模板缓存装不下时先加载的模板会被挤出
+        if env.cache is not None and env.cache.capacity < len(names):
+            logger.warning('jinja cache holds %d templates, %d found', env.cache.capacity, len(names))
+        compiled = 0
+        errors = []
+        for name in names:
+            try:
+                env.get_template(name)
+            except TemplateError as e:
+                errors.append((name, str(e)))
+            else:
+                compiled += 1
+        return compiled, errors
@@ -0,0 +1,137 @@
+"""
+关注动态(timeline)
+普通作者发表文章时写扩散: 把文章id写入每个关注者的timelines表;
+关注者数不少于FLASK_TIMELINE_FANOUT_LIMIT的作者不写扩散,读取时直接查询他们的文章再与timeline归并。
+读取只按(user_id, timestamp)索引取一页,与关注人数无关。
+"""
+from flask import current_app, has_app_context
+from . import db
+
+
+def config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def fanout_limit():
+    return config('FLASK_TIMELINE_FANOUT_LIMIT', 1000)
+
+
+def tables():
+    metadata = db.metadata.tables
+    return metadata['timelines'], metadata['follows'], metadata['posts'], metadata['users']
+
+
+def is_fanout_author(connection, author_id):
+    """关注者较少的作者使用写扩散"""
+    users = tables()[3]
+    followers = connection.scalar(db.select([users.c.followers_count]).where(users.c.id == author_id))
+    return (followers or 0) < fanout_limit()
+
+
+def on_post_insert(mapper, connection, target):
+    """写扩散: 一条INSERT ... SELECT把新文章写入所有关注者的timeline"""
+    if target.author_id is None or not is_fanout_author(connection, target.author_id):
+        return
+    timelines, follows, posts, users = tables()
+    select = db.select([follows.c.follower_id,
+                        db.literal(target.id),
+                        db.literal(target.author_id),
+                        db.literal(target.timestamp, type_=db.DateTime)]) \
+        .where(follows.c.followed_id == target.author_id)
+    connection.execute(timelines.insert().from_select(
+        ['user_id', 'post_id', 'author_id', 'timestamp'], select))
+
+
+def on_post_delete(mapper, connection, target):
+    timelines = tables()[0]
+    connection.execute(timelines.delete().where(timelines.c.post_id == target.id))
+
+
+def backfill_statement():
+    """把作者最近的FLASK_TIMELINE_BACKFILL_COUNT篇文章补进关注者的timeline,参数为follower_id和author_id"""
+    timelines, follows, posts, users = tables()
+    follower_id = db.bindparam('follower_id', type_=db.Integer)
+    recent = db.select([follower_id, posts.c.id, posts.c.author_id, posts.c.timestamp]) \
+        .where(posts.c.author_id == db.bindparam('author_id', type_=db.Integer)) \
+        .where(~db.exists().where(db.and_(timelines.c.user_id == follower_id,
+                                          timelines.c.post_id == posts.c.id))) \
+        .order_by(posts.c.timestamp.desc()) \
+        .limit(config('FLASK_TIMELINE_BACKFILL_COUNT', 100))
+    return timelines.insert().from_select(['user_id', 'post_id', 'author_id', 'timestamp'], recent)
+
+
+def on_follow(mapper, connection, target):
+    """关注后把对方最近的文章补进自己的timeline"""
+    if not is_fanout_author(connection, target.followed_id):
+        return
+    connection.execute(backfill_statement(), follower_id=target.follower_id, author_id=target.followed_id)
+
+
+def on_unfollow(mapper, connection, target):
+    timelines = tables()[0]
+    connection.execute(timelines.delete().where(db.and_(timelines.c.user_id == target.follower_id,
+                                                        timelines.c.author_id == target.followed_id)))
+
+
+def on_follow_many(connection, follower_id, followed_ids):
+    """批量关注: 一次查询找出写扩散的作者,同一条补入语句按作者executemany执行"""
+    users = tables()[3]
+    authors = [row[0] for row in connection.execute(
+        db.select([users.c.id]).where(users.c.id.in_(followed_ids))
+        .where(users.c.followers_count < fanout_limit()))]
+    if authors:
+        connection.execute(backfill_statement(),
+                           [{'follower_id': follower_id, 'author_id': author} for author in authors])
+
+
+def on_unfollow_many(connection, follower_id, followed_ids):
+    timelines = tables()[0]
+    connection.execute(timelines.delete().where(db.and_(timelines.c.user_id == follower_id,
+                                                        timelines.c.author_id.in_(followed_ids))))
+
+
+def on_self_follows(connection, missing):
+    """
+    add_self_follows写入关注关系之前调用,把还没有关注自己的写扩散作者的文章补进自己的timeline
+    :param missing: 筛选还没有关注自己的用户的条件
+    """
+    timelines, follows, posts, users = tables()
+    select = db.select([users.c.id, posts.c.id, posts.c.author_id, posts.c.timestamp]) \
+        .select_from(posts.join(users, users.c.id == posts.c.author_id)) \
+        .where(missing) \
+        .where(users.c.followers_count < fanout_limit()) \
+        .where(~db.exists().where(db.and_(timelines.c.user_id == users.c.id,
+                                          timelines.c.post_id == posts.c.id)))
+    connection.execute(timelines.insert().from_select(
+        ['user_id', 'post_id', 'author_id', 'timestamp'], select))
+
+
+def backfill(chunk_size=1000):
+    """
+    按关注者id分批重建所有用户的timeline,用于已有的关注关系或写扩散阈值调整后
+    :return: 写入的条目数
+    """
+    timelines, follows, posts, users = tables()
+    engine = db.get_engine()
+    last_id = 0
+    inserted = 0
+    while True:
+        with engine.begin() as connection:
+            ids = [row[0] for row in connection.execute(
+                db.select([users.c.id]).where(users.c.id > last_id)
+                .order_by(users.c.id).limit(chunk_size))]
+            if not ids:
+                break
+            last_id = ids[-1]
+            connection.execute(timelines.delete().where(timelines.c.user_id.in_(ids)))
+            select = db.select([follows.c.follower_id, posts.c.id, posts.c.author_id, posts.c.timestamp]) \
+                .select_from(follows.join(posts, posts.c.author_id == follows.c.followed_id)
+                             .join(users, users.c.id == follows.c.followed_id)) \
+                .where(follows.c.follower_id.in_(ids)) \
+                .where(users.c.followers_count < fanout_limit())
+            result = connection.execute(timelines.insert().from_select(
+                ['user_id', 'post_id', 'author_id', 'timestamp'], select))
+            inserted += max(result.rowcount, 0)
+    return inserted
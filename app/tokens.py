@@ -0,0 +1,71 @@
+"""
+无状态的API token
+token中带有befor_request和权限检查需要的声明: 用户id, 是否已确认, 角色和权限, token版本,
+验证时只检查签名和有效期,由声明还原用户对象,不查询数据库;
+User.revoke_auth_tokens增加用户的token版本,版本更低的token失效;
+吊销列表保存在进程内存中,最多每FLASK_AUTH_REVOCATION_REFRESH秒从数据库重新加载一次,
+其他进程吊销的token在这段时间之后失效
+"""
+import threading
+import time
+from functools import lru_cache
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
+from . import db
+
+
+@lru_cache(maxsize=32)
+def serializer(secret_key, expires_in=None):
+    """创建Serializer需要根据密钥派生签名密钥,按参数缓存"""
+    return Serializer(secret_key, expires_in=expires_in)
+
+
+def dumps(claims, expiration):
+    return serializer(current_app.config['SECRET_KEY'], expiration).dumps(claims).decode('ascii')
+
+
+def loads(token):
+    """签名错误或过期时返回None"""
+    try:
+        return serializer(current_app.config['SECRET_KEY']).loads(token)
+    except (BadSignature, SignatureExpired):
+        return None
+
+
+class RevocationList(object):
+    """用户id到最低有效token版本的映射"""
+
+    def __init__(self):
+        self._versions = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        users = db.metadata.tables['users']
+        rows = db.session.execute(db.select([users.c.id, users.c.token_version])
+                                  .where(users.c.token_version > 0)).fetchall()
+        with self._lock:
+            versions = dict(rows)
+            # 刷新期间本进程新吊销的版本不能丢失
+            for user_id, version in self._versions.items():
+                versions[user_id] = max(version, versions.get(user_id, 0))
+            self._versions = versions
+            self._loaded = time.time()
+
+    def version(self, user_id):
+        interval = current_app.config['FLASK_AUTH_REVOCATION_REFRESH']
+        if self._loaded is None or (interval and time.time() - self._loaded > interval):
+            self.refresh()
+        return self._versions.get(user_id, 0)
+
+    def revoke(self, user_id, version):
+        with self._lock:
+            self._versions[user_id] = max(version, self._versions.get(user_id, 0))
+
+    def clear(self):
+        with self._lock:
+            self._versions = {}
+            self._loaded = None
+
+
+revocations = RevocationList()
@@ -0,0 +1,209 @@
+"""
+数据导入导出
+导出为NDJSON,每行一条记录,"type"字段标明所属的表,按角色,用户,关注,文章,评论的顺序输出,
+导入时按块用Core批量插入,markdown在工作进程中渲染,内存占用只与块大小有关
+计数字段,body_html,关注动态和搜索索引不导出,导入后重新计算
+"""
+import json
+import multiprocessing
+from collections import deque
+from datetime import datetime
+from itertools import groupby
+from . import db, renderer, identity_cache, response_cache, timeline, search
+from .pagination import keyset_condition
+
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# 导出的表和跳过的派生列,顺序满足外键依赖
+TABLES = [
+    ('role', 'roles', ()),
+    ('user', 'users', ('followers_count', 'followed_count', 'posts_count')),
+    ('follow', 'follows', ()),
+    ('post', 'posts', ('body_html', 'body_hash', 'comments_count')),
+    ('comment', 'comments', ('body_html', 'body_hash')),
+]
+
+
+def table_of(kind):
+    for name, tablename, skipped in TABLES:
+        if name == kind:
+            return db.metadata.tables[tablename], skipped
+    raise ValueError('unknown record type: %s' % kind)
+
+
+def allowed_tags(kind):
+    from .models import Post, Comment
+    return {'post': Post.ALLOWED_TAGS, 'comment': Comment.ALLOWED_TAGS}.get(kind)
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    return value
+
+
+def decode_row(table, record):
+    """把json记录还原成可以插入的列值,未知的字段被忽略"""
+    row = {}
+    for column in table.columns:
+        if column.key not in record:
+            continue
+        value = record[column.key]
+        if isinstance(value, str) and isinstance(column.type, db.DateTime):
+            value = datetime.strptime(value, TIME_FORMAT)
+        row[column.key] = value
+    return row
+
+
+def iter_rows(table, columns, chunk_size):
+    """按主键分批读取整张表,每批一次查询"""
+    pk = list(table.primary_key.columns)
+    last = None
+    while True:
+        query = db.select(columns).order_by(*pk).limit(chunk_size)
+        if last is not None:
+            if len(pk) == 1:
+                query = query.where(pk[0] > last[0])
+            else:
+                query = query.where(keyset_condition(pk, last, older=False))
+        rows = db.session.execute(query).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            yield row
+        last = [rows[-1][column.key] for column in pk]
+        # 每批之后结束事务,避免长时间持有快照
+        db.session.commit()
+
+
+def export_records(chunk_size=1000):
+    """逐条生成导出记录"""
+    for kind, tablename, skipped in TABLES:
+        table = db.metadata.tables[tablename]
+        columns = [column for column in table.columns if column.key not in skipped]
+        for row in iter_rows(table, columns, chunk_size):
+            record = {'type': kind}
+            for column in columns:
+                record[column.key] = encode_value(row[column.key])
+            yield record
+
+
+def dump(fp, chunk_size=1000):
+    """
+    导出全部数据到文件对象
+    :return: 导出的记录数
+    """
+    count = 0
+    for record in export_records(chunk_size):
+        fp.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def read_records(fp):
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def chunked(records, chunk_size):
+    """把连续的同类记录分成不超过chunk_size的块"""
+    for kind, group in groupby(records, key=lambda record: record['type']):
+        chunk = []
+        for record in group:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield kind, chunk
+                chunk = []
+        if chunk:
+            yield kind, chunk
+
+
+def render_chunk(kind, tags, rows):
+    """渲染一块记录的正文,在工作进程中执行"""
+    if tags is not None:
+        for row in rows:
+            if row.get('body') is not None:
+                row['body_hash'] = renderer.content_hash(row['body'], tags)
+                row['body_html'] = renderer.to_html(row['body'], tags)
+    return kind, rows
+
+
+def existing_keys(connection, table, rows):
+    """已经存在的主键,重复导入时跳过这些行"""
+    pk = list(table.primary_key.columns)
+    first = pk[0]
+    values = set(row[first.key] for row in rows)
+    query = db.select(pk).where(first.in_(values))
+    return set(tuple(row) for row in connection.execute(query))
+
+
+def insert_chunk(kind, rows):
+    table = table_of(kind)[0]
+    pk = [column.key for column in table.primary_key.columns]
+    with db.engine.begin() as connection:
+        existing = existing_keys(connection, table, rows)
+        rows = [row for row in rows if tuple(row[key] for key in pk) not in existing]
+        if rows:
+            connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+def load(fp, chunk_size=1000, workers=None):
+    """
+    从文件对象导入NDJSON数据,保留原有的主键,已存在的行被跳过,中断后可以重新执行
+    :param workers: 渲染markdown的进程数,0表示在当前进程中渲染,None为cpu核数
+    :return: 每种记录插入的行数
+    """
+    return load_records(read_records(fp), chunk_size, workers)
+
+
+def load_records(records, chunk_size=1000, workers=None):
+    """
+    批量插入记录,记录的格式与导出的相同,时间字段可以是datetime
+    同一种记录需要连续出现,并且按TABLES的顺序排列
+    """
+    counts = dict((kind, 0) for kind, tablename, skipped in TABLES)
+    chunks = ((kind, [decode_row(table_of(kind)[0], record) for record in chunk])
+              for kind, chunk in chunked(records, chunk_size))
+    if workers == 0:
+        for kind, rows in chunks:
+            counts[kind] += insert_chunk(*render_chunk(kind, allowed_tags(kind), rows))
+    else:
+        pool = multiprocessing.Pool(workers)
+        # 限制提交给进程池的块数,读取速度不会超过插入速度,内存占用保持不变
+        pending = deque()
+        limit = 2 * (workers or multiprocessing.cpu_count())
+        try:
+            for kind, rows in chunks:
+                # 后面的表依赖前面的表,换表前先插入完已提交的块
+                if pending and pending[0][0] != kind:
+                    while pending:
+                        counts[pending[0][0]] += insert_chunk(*pending.popleft()[1].get())
+                tags = allowed_tags(kind)
+                if tags is None:
+                    # 没有正文需要渲染,直接插入
+                    counts[kind] += insert_chunk(kind, rows)
+                    continue
+                pending.append((kind, pool.apply_async(render_chunk, (kind, tags, rows))))
+                while len(pending) >= limit:
+                    counts[pending[0][0]] += insert_chunk(*pending.popleft()[1].get())
+            while pending:
+                counts[pending[0][0]] += insert_chunk(*pending.popleft()[1].get())
+        finally:
+            pool.close()
+            pool.join()
+    refresh()
+    return counts
+
+
+def refresh():
+    """Core插入不经过模型事件,导入后重新计算计数字段,关注动态和搜索索引,并清空缓存"""
+    from .models import User
+    User.recount()
+    timeline.backfill()
+    search.rebuild()
+    identity_cache.clear()
+    response_cache.clear()
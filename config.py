@@ -8,18 +8,106 @@ class Config(object):
     SQLALCHEMY_COMMIT_ON_TERMDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    # 电子邮件配置
-    MAIL_SERVER = 'smtp.163.com'
-    MAIL_PORT = 465
+    # 电子邮件配置,调试时可以指向本地SMTP服务器:
+    # python -m smtpd -n -c DebuggingServer localhost:1025
+    MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.163.com'
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 465)
     # MAIL_USE_TLS = False
-    MAIL_USE_SSL = True
+    MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', '1') == '1'
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
+    # 后台发送队列: 工作线程数,每批最多邮件数,重试次数与退避秒数,连接空闲多久后关闭
+    MAIL_QUEUE_ENABLED = True
+    MAIL_QUEUE_BACKEND = 'smtp'  # smtp 或 memory
+    MAIL_QUEUE_WORKERS = 2
+    MAIL_QUEUE_BATCH_SIZE = 20
+    MAIL_QUEUE_MAX_RETRIES = 3
+    MAIL_QUEUE_RETRY_BACKOFF = 2.0
+    MAIL_QUEUE_IDLE_TIMEOUT = 30
 
     # 每页显示数量控制
     FLASK_POSTS_PER_PAGE_COUNT = 20
     FLASK_FOLLOW_PER_PAGE_COUNT = 20
     FLASK_COMMENT_PER_PAGE_COUNT = 5
+    # 使用(timestamp, id)游标分页,不执行OFFSET和COUNT查询
+    FLASK_CURSOR_PAGINATION = os.environ.get('FLASK_CURSOR_PAGINATION') == '1'
+
+    # markdown渲染结果缓存条目数
+    FLASK_MARKDOWN_CACHE_SIZE = 1024
+    # 用户last_seen写回数据库的最小间隔(秒)
+    FLASK_LAST_SEEN_FLUSH_INTERVAL = 60
+    # 登录用户身份缓存的条目数和过期秒数,过期时间为0时不缓存;
+    # 修改后只清除本进程的缓存,多个进程部署时其他进程最多在TTL秒内使用旧的密码哈希,角色和确认状态
+    FLASK_IDENTITY_CACHE_SIZE = 10000
+    FLASK_IDENTITY_CACHE_TTL = 5
+    # 新密码的哈希方法和盐长度,修改后已有用户在下次登录时按新参数重新计算;
+    # 迭代次数可以用 manage.py password_cost 测量,一次哈希控制在几十毫秒
+    FLASK_PASSWORD_METHOD = 'pbkdf2:sha256:50000'
+    FLASK_PASSWORD_SALT_LENGTH = 8
+    # API的HTTP Basic认证验证成功后缓存的条目数和秒数,0为不缓存
+    FLASK_CREDENTIAL_CACHE_SIZE = 10000
+    FLASK_CREDENTIAL_CACHE_TTL = 60
+    # 登录和HTTP Basic认证的令牌桶限流,邮箱和IP各一个桶: 容量和每秒补充的令牌数,容量为0时不限流;
+    # 登录成功不消耗令牌; NAT或公司出口后面的多个用户共用一个IP,IP的桶比邮箱的大
+    FLASK_LOGIN_BURST = 10
+    FLASK_LOGIN_RATE = 1.0
+    FLASK_LOGIN_IP_BURST = 100
+    FLASK_LOGIN_IP_RATE = 10.0
+    # 应用前面可信的反向代理层数,大于0时从X-Forwarded-For取客户端IP;
+    # 直接对外提供服务时必须为0,否则客户端可以伪造这个头绕过按IP限流
+    FLASK_PROXY_COUNT = int(os.environ.get('FLASK_PROXY_COUNT', 0))
+    # 匿名访问的页面缓存: None不缓存, 'memory' 进程内LRU, 'filesystem' 文件缓存(多进程共享)
+    # SIZE为缓存的条目数,文件缓存定期清理过期文件,超过这个数量时删除最早写入的文件
+    FLASK_RESPONSE_CACHE = os.environ.get('FLASK_RESPONSE_CACHE')
+    FLASK_RESPONSE_CACHE_SIZE = 1000
+    FLASK_RESPONSE_CACHE_DIR = os.path.join(basedir, 'tmp/response-cache')
+    FLASK_RESPONSE_CACHE_TIMEOUT = 60
+    # 关注者不少于此数的作者发表文章时不写扩散,读取时再合并
+    FLASK_TIMELINE_FANOUT_LIMIT = 1000
+    # 关注某人时补入其最近的文章数
+    FLASK_TIMELINE_BACKFILL_COUNT = 100
+    # api每页和?ids=批量获取的最大数量, ?stream=1 时每次查询的行数
+    FLASK_API_MAX_PER_PAGE = 100
+    FLASK_API_STREAM_CHUNK_SIZE = 500
+    # API token的吊销列表最多多少秒从数据库重新加载一次
+    FLASK_AUTH_REVOCATION_REFRESH = 60
+    # 组提交: 发文章,评论和修改文章时并发的写入最多等待WINDOW秒合并到一个事务,一批最多MAX_BATCH个;
+    # SQLite只有一个写锁,突发的评论较多时开启
+    FLASK_GROUP_COMMIT = os.environ.get('FLASK_GROUP_COMMIT') == '1'
+    FLASK_GROUP_COMMIT_WINDOW = 0.005
+    FLASK_GROUP_COMMIT_MAX_BATCH = 50
+    # 请求级SQL分析: 每个请求的语句数,数据库和模板耗时,最慢语句的调用位置
+    FLASK_PROFILER = os.environ.get('FLASK_PROFILER') == '1'
+    FLASK_PROFILER_HEADERS = False
+    FLASK_PROFILER_SLOW_QUERY = 0.1
+    FLASK_PROFILER_SLOWEST = 5
+    # 每个请求允许的语句数,FLASK_PROFILER_BUDGETS中可以按endpoint单独设置; 超出时 'log' 记录警告, 'raise' 抛出异常
+    FLASK_PROFILER_QUERY_BUDGET = 20
+    FLASK_PROFILER_BUDGETS = {}
+    FLASK_PROFILER_BUDGET_ACTION = 'log'
+    # Jinja字节码缓存目录,None不缓存; 渲染前是否检查模板文件有没有修改; 创建应用时是否加载全部模板
+    FLASK_TEMPLATE_CACHE_DIR = os.path.join(basedir, 'tmp/jinja-cache')
+    FLASK_TEMPLATE_AUTO_RELOAD = True
+    FLASK_TEMPLATE_PRELOAD = False
+
+    # 连接池: 取出连接前先检查是否可用; 池大小等使用flask-sqlalchemy的SQLALCHEMY_POOL_*配置,
+    # SQLite文件数据库没有设置SQLALCHEMY_POOL_SIZE时每次请求新建连接
+    SQLALCHEMY_POOL_PRE_PING = False
+    # SQLite新建连接时执行的PRAGMA: WAL日志下读写互不阻塞, 写操作之间等待busy_timeout毫秒,
+    # cache_size为负数时单位是KB
+    SQLALCHEMY_SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'temp_store': 'MEMORY',
+    }
+    # 只读副本的url,环境变量中多个用逗号分隔; 这些蓝本的GET请求读副本,
+    # 提交后调用db.stick_to_primary()的用户在SQLALCHEMY_REPLICA_LAG秒内读主库,
+    # API客户端需要在之后的请求中带上响应头X-DB-Primary-Until
+    SQLALCHEMY_REPLICAS = [url for url in os.environ.get('SQLALCHEMY_REPLICA_URLS', '').split(',') if url]
+    SQLALCHEMY_REPLICA_BLUEPRINTS = ('main', 'api')
+    SQLALCHEMY_REPLICA_LAG = 5
 
     @staticmethod
     def init_app(app):
@@ -29,23 +117,61 @@ class Config(object):
 class DevelopmentConfig(Config):
     """开发环境配置项"""
     DEBUG = True
+    FLASK_PROFILER = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_MYSQL_DEV_DATABASE_URL') or 'sqlite:////' + os.path.join(basedir, 'data-dev.sqlite')
 
 
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    MAIL_QUEUE_ENABLED = False
+    MAIL_QUEUE_BACKEND = 'memory'
+    FLASK_LAST_SEEN_FLUSH_INTERVAL = 0
+    FLASK_IDENTITY_CACHE_TTL = 0
+    # 测试中创建大量用户,使用很少的迭代次数
+    FLASK_PASSWORD_METHOD = 'pbkdf2:sha256:1000'
+    FLASK_CREDENTIAL_CACHE_TTL = 0
+    FLASK_LOGIN_BURST = 0
+    FLASK_PROFILER = True
+    FLASK_PROFILER_BUDGET_ACTION = 'raise'
+    FLASK_TEMPLATE_CACHE_DIR = None
+    # 测试数据库每次重建,不需要在断电时保证持久
+    SQLALCHEMY_SQLITE_PRAGMAS = dict(Config.SQLALCHEMY_SQLITE_PRAGMAS, synchronous='OFF')
     """测试环境配置项"""
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_MYSQL_TEST_DATABASE_URL') or 'sqlite:////' + os.path.join(basedir, 'data-test.sqlite')
 
 
+class BenchmarkConfig(Config):
+    """性能测试配置项,使用单独的数据库,每次运行时重建"""
+    WTF_CSRF_ENABLED = False
+    MAIL_QUEUE_ENABLED = False
+    MAIL_QUEUE_BACKEND = 'memory'
+    FLASK_TEMPLATE_AUTO_RELOAD = False
+    # login场景的所有请求来自测试客户端的同一个IP,不限流
+    FLASK_LOGIN_BURST = 0
+    SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_MYSQL_BENCHMARK_DATABASE_URL') or 'sqlite:////' + os.path.join(basedir, 'data-benchmark.sqlite')
+
+
 class ProductConfig(Config):
+    # 部署时已经用 manage.py compile_templates 编译,模板文件不会在运行中修改
+    FLASK_TEMPLATE_AUTO_RELOAD = False
+    FLASK_TEMPLATE_PRELOAD = True
+    # 每个进程保持10个连接,高峰时最多再建20个,等待空闲连接超过10秒报错;
+    # 连接30分钟后回收,早于MySQL和中间代理断开空闲连接的时间
+    SQLALCHEMY_POOL_SIZE = 10
+    SQLALCHEMY_MAX_OVERFLOW = 20
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+    # SQLite使用连接池后连接上的页缓存和内存映射可以跨请求复用
+    SQLALCHEMY_SQLITE_PRAGMAS = dict(Config.SQLALCHEMY_SQLITE_PRAGMAS, cache_size=-64000, mmap_size=268435456)
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_MYSQL_PRODUCT_DATABASE_URL') or 'sqlite:////' + os.path.join(basedir, 'data-product.sqlite')
 
 
 config = {
     'dev_config': DevelopmentConfig,
     'test_config': TestingConfig,
+    'benchmark_config': BenchmarkConfig,
     'product_config': ProductConfig,
 
     'default': DevelopmentConfig
@@ -1,13 +1,18 @@
+import io
 import os
+import sys
 from app import create_app, db
-from app.models import User, Role
-from flask.ext.script import Manager, Shell
-from flask.ext.migrate import Migrate, MigrateCommand
+from app.models import User, Role, Post, Comment
+from flask.ext.script import Manager, Shell, Command, Option
 
 
-app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+COMMAND = sys.argv[1] if len(sys.argv) > 1 else None
+# 这些命令只读写数据库,不处理请求,不需要导入和注册视图蓝本
+DATA_COMMANDS = ('db', 'recount', 'rerender', 'backfill_timelines', 'reindex', 'seed', 'export', 'import', 'startup',
+                 'password_cost')
+
+app = create_app(os.getenv('FLASK_CONFIG') or 'default', blueprints=COMMAND not in DATA_COMMANDS)
 manager = Manager(app)
-migrate = Migrate(app, db)
 
 
 def make_shell_context():
@@ -15,7 +20,150 @@ def make_shell_context():
 
 
 manager.add_command('shell', Shell(make_context=make_shell_context))
-manager.add_command('db', MigrateCommand)
+# flask-migrate会导入alembic和mako,只在执行db命令或显示帮助时加载
+if COMMAND is None or COMMAND == 'db' or COMMAND.startswith('-'):
+    from flask.ext.migrate import Migrate, MigrateCommand
+    migrate = Migrate(app, db)
+    manager.add_command('db', MigrateCommand)
+
+
+@manager.command
+def recount():
+    """重新计算关注数,文章数和评论数等计数字段"""
+    User.recount()
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=500)
+def rerender(chunk_size):
+    """分批重新渲染正文或白名单发生变化的文章和评论"""
+    from app import renderer
+    posts = renderer.rerender(db.session, Post, Post.ALLOWED_TAGS, chunk_size=chunk_size)
+    comments = renderer.rerender(db.session, Comment, Comment.ALLOWED_TAGS, chunk_size=chunk_size)
+    print('re-rendered %d posts, %d comments' % (posts, comments))
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=1000)
+def backfill_timelines(chunk_size):
+    """根据现有的关注关系重建所有用户的关注动态"""
+    from app import timeline
+    print('inserted %d timeline entries' % timeline.backfill(chunk_size=chunk_size))
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=1000)
+def reindex(chunk_size):
+    """重建文章和评论的搜索索引"""
+    from app import search
+    print('indexed %d posts, %d comments' % search.rebuild(chunk_size=chunk_size))
+
+
+@manager.command
+def compile_templates():
+    """部署时预先编译全部模板,写入字节码缓存"""
+    from app import template_cache
+    if not app.config['FLASK_TEMPLATE_CACHE_DIR']:
+        print('FLASK_TEMPLATE_CACHE_DIR is not set, templates are compiled but not cached')
+    compiled, errors = template_cache.compile(app)
+    for name, error in errors:
+        print('%s: %s' % (name, error))
+    print('compiled %d templates' % compiled)
+    if errors:
+        sys.exit(1)
+
+
+@manager.option('-m', '--method', dest='methods', default=None, help='逗号分隔的哈希方法,默认为当前配置')
+def password_cost(methods):
+    """测量密码哈希方法计算一次的耗时"""
+    from app import passwords
+    for method in (methods.split(',') if methods else [app.config['FLASK_PASSWORD_METHOD']]):
+        print('%-28s %8.1f ms' % (method, passwords.measure(method) * 1000))
+
+
+@manager.option('-t', '--target', dest='target', default='app', help='app: 创建应用, manage: 执行一次性数据命令')
+@manager.option('-n', '--limit', dest='limit', type=int, default=20, help='显示累计耗时最多的模块数')
+@manager.option('-b', '--budget', dest='budget', type=float, default=None, help='启动耗时上限(毫秒),超出时返回非0')
+def startup(target, limit, budget):
+    """在新的解释器中测量启动耗时和各模块的导入耗时"""
+    from app import startup as timing
+    result = timing.measure(target, os.getenv('FLASK_CONFIG') or 'default', limit=limit)
+    print(timing.report(result))
+    if budget is not None and result['total_ms'] > budget:
+        print('startup took %.1f ms, budget is %.1f ms' % (result['total_ms'], budget))
+        sys.exit(1)
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-p', '--posts', dest='posts', type=int, default=10000)
+@manager.option('-f', '--follows', dest='follows', type=int, default=20, help='平均每个用户关注的人数')
+@manager.option('-m', '--comments', dest='comments', type=int, default=20000)
+@manager.option('-s', '--seed', dest='seed', type=int, default=None, help='随机数种子,相同时生成相同的数据')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=1000)
+@manager.option('-w', '--workers', dest='workers', type=int, default=None)
+def seed(users, posts, follows, comments, seed, chunk_size, workers):
+    """批量生成压测用的假数据"""
+    from app.generate_fakedata import seed_data
+    counts = seed_data(users=users, posts=posts, follows_per_user=follows, comments=comments,
+                       seed=seed, chunk_size=chunk_size, workers=workers)
+    print(', '.join('%s: %d' % item for item in sorted(counts.items())))
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='small', help='数据规模,逗号分隔: tiny,small,medium,large')
+@manager.option('-n', '--iterations', dest='iterations', type=int, default=50)
+@manager.option('-w', '--warmup', dest='warmup', type=int, default=5)
+@manager.option('-o', '--output', dest='output', default=None, help='结果保存为json文件')
+@manager.option('-b', '--baseline', dest='baseline', default=None, help='与之比较的基准结果')
+@manager.option('-t', '--tolerance', dest='tolerance', type=float, default=0.2, help='允许变慢的比例')
+def benchmark(sizes, iterations, warmup, output, baseline, tolerance):
+    """生成不同规模的数据,测试热点页面的延迟,吞吐量和查询数"""
+    from app import benchmark as bench
+    results = bench.run(sizes.split(','), iterations=iterations, warmup=warmup)
+    print(bench.report(results))
+    if output:
+        bench.save(results, output)
+    if baseline:
+        regressions = bench.compare(results, bench.load(baseline), tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+class Export(Command):
+    """把用户,关注,文章和评论导出为NDJSON"""
+    option_list = (
+        Option('-o', '--output', dest='output', default='-', help='输出文件,默认为标准输出'),
+        Option('-c', '--chunk-size', dest='chunk_size', type=int, default=1000),
+    )
+
+    def run(self, output, chunk_size):
+        from app import transfer
+        if output == '-':
+            transfer.dump(sys.stdout, chunk_size=chunk_size)
+            return
+        with io.open(output, 'w', encoding='utf-8') as fp:
+            print('exported %d records' % transfer.dump(fp, chunk_size=chunk_size))
+
+
+class Import(Command):
+    """从NDJSON文件批量导入数据,已存在的行被跳过"""
+    option_list = (
+        Option('-i', '--input', dest='input', default='-', help='输入文件,默认为标准输入'),
+        Option('-c', '--chunk-size', dest='chunk_size', type=int, default=1000),
+        Option('-w', '--workers', dest='workers', type=int, default=None,
+               help='渲染markdown的进程数,0表示不使用子进程'),
+    )
+
+    def run(self, input, chunk_size, workers):
+        from app import transfer
+        if input == '-':
+            counts = transfer.load(sys.stdin, chunk_size=chunk_size, workers=workers)
+        else:
+            with io.open(input, encoding='utf-8') as fp:
+                counts = transfer.load(fp, chunk_size=chunk_size, workers=workers)
+        print(', '.join('%s: %d' % item for item in sorted(counts.items())))
+
+
+manager.add_command('export', Export())
+manager.add_command('import', Import())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+import json
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class APITestCase(unittest.TestCase):
+    """测试api_1_0接口"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username='', password=''):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def add_posts(self, count):
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        posts = []
+        for i in range(count):
+            post = Post(title='title %d' % i, body='body %d' % i, author=u)
+            db.session.add(post)
+            posts.append(post)
+        db.session.commit()
+        return u, [p.id for p in posts]
+
+    def get_json(self, url):
+        # 测试客户端不保留完整url中的查询参数,只使用路径部分
+        url = url.replace('http://localhost', '')
+        response = self.client.get(url, headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data(as_text=True))
+
+    def test_get_post(self):
+        u, ids = self.add_posts(1)
+        data = self.get_json('/api/1.0/posts/%d' % ids[0])
+        self.assertEqual(data['title'], 'title 0')
+        self.assertEqual(data['comment_count'], 0)
+        self.assertTrue(data['author'].endswith('/api/1.0/users/%d' % u.id))
+
+    def test_get_post_not_modified(self):
+        u, ids = self.add_posts(1)
+        response = self.client.get('/api/1.0/posts/%d' % ids[0], headers=self.get_api_headers())
+        headers = self.get_api_headers()
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get('/api/1.0/posts/%d' % ids[0], headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+    def test_batch_and_sparse_fields(self):
+        u, ids = self.add_posts(3)
+        data = self.get_json('/api/1.0/posts/?ids=%d,%d,999&fields=title' % (ids[2], ids[0]))
+        self.assertEqual(data['posts'], [{'title': 'title 2'}, {'title': 'title 0'}])
+        response = self.client.get('/api/1.0/posts/?ids=a,b', headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination(self):
+        u, ids = self.add_posts(5)
+        data = self.get_json('/api/1.0/posts/?per_page=2&fields=id')
+        self.assertEqual([p['id'] for p in data['posts']], [ids[4], ids[3]])
+        self.assertIsNone(data['prev'])
+        seen = [p['id'] for p in data['posts']]
+        while data['next']:
+            data = self.get_json(data['next'])
+            seen.extend(p['id'] for p in data['posts'])
+        self.assertEqual(seen, list(reversed(ids)))
+
+    def test_per_page_lower_bound(self):
+        u, ids = self.add_posts(2)
+        for value in ('0', '-1'):
+            data = self.get_json('/api/1.0/posts/?per_page=%s&fields=id' % value)
+            self.assertEqual([p['id'] for p in data['posts']], [ids[1]])
+            self.assertIsNotNone(data['next'])
+
+    def test_stream(self):
+        u, ids = self.add_posts(3)
+        self.app.config['FLASK_API_STREAM_CHUNK_SIZE'] = 2
+        response = self.client.get('/api/1.0/users/%d/posts/?stream=1&fields=id' % u.id,
+                                   headers=self.get_api_headers())
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], list(reversed(ids)))
+
+    def test_comments(self):
+        u, ids = self.add_posts(1)
+        db.session.add(Comment(body='visible', post_id=ids[0], author=u))
+        db.session.add(Comment(body='hidden', post_id=ids[0], author=u, disable=True))
+        db.session.commit()
+        data = self.get_json('/api/1.0/posts/%d/comments/' % ids[0])
+        self.assertEqual([c['body'] for c in data['comments']], ['visible'])
+
+    def test_new_post(self):
+        u, ids = self.add_posts(0)
+        response = self.client.post('/api/1.0/posts/', headers=self.get_api_headers('john@example.com', 'cat'),
+                                    data=json.dumps({'title': 'new', 'body': 'body of the *post*'}))
+        self.assertEqual(response.status_code, 201)
+        data = self.get_json(response.headers['Location'])
+        self.assertEqual(data['body_html'], '<p>body of the <em>post</em></p>')
+        response = self.client.post('/api/1.0/posts/', headers=self.get_api_headers('john@example.com', 'cat'),
+                                    data=json.dumps({'title': 'new'}))
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,38 @@
+import unittest
+from app import benchmark, create_app, login_limiter
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """性能测试工具的测试"""
+
+    def test_percentile(self):
+        values = [0.5, 0.1, 0.4, 0.2, 0.3]
+        self.assertEqual(benchmark.percentile(values, 50), 0.3)
+        self.assertEqual(benchmark.percentile(values, 90), 0.5)
+        self.assertEqual(benchmark.percentile(values, 1), 0.1)
+        self.assertEqual(benchmark.percentile([], 50), 0.0)
+
+    def test_compare(self):
+        base = {'sizes': {'tiny': {'index': {'p50_ms': 10.0, 'p90_ms': 20.0, 'queries': 3.0}}}}
+        same = {'sizes': {'tiny': {'index': {'p50_ms': 11.0, 'p90_ms': 20.0, 'queries': 3.0},
+                                   'new': {'p50_ms': 1.0, 'p90_ms': 1.0, 'queries': 1.0}}}}
+        self.assertEqual(benchmark.compare(same, base, tolerance=0.2), [])
+        slower = {'sizes': {'tiny': {'index': {'p50_ms': 13.0, 'p90_ms': 20.0, 'queries': 4.0}}}}
+        regressions = benchmark.compare(slower, base, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('tiny/index p50_ms'))
+
+    def test_run_size(self):
+        results = benchmark.run_size('tiny', iterations=2, warmup=1, config_name='test_config')
+        self.assertEqual(set(results), set(['index', 'post_deep_page', 'user', 'followers',
+                                            'login', 'change_body_to_html']))
+        self.assertEqual(results['index']['iterations'], 2)
+        self.assertTrue(results['index']['queries'] > 0)
+        self.assertEqual(results['change_body_to_html']['queries'], 0)
+
+    def test_benchmark_config_does_not_limit_logins(self):
+        # login场景的warmup和iterations次登录都来自同一个IP
+        app = create_app('benchmark_config')
+        with app.test_request_context('/auth/login', method='POST'):
+            allowed = [login_limiter.allow_login('john@example.com') for i in range(60)]
+        self.assertTrue(all(allowed))
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from app.cache import FileSystemCache
+
+
+class FileSystemCacheTestCase(unittest.TestCase):
+    """文件缓存测试"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return len(os.listdir(self.directory))
+
+    def test_get_set_and_expiry(self):
+        cache = FileSystemCache(self.directory)
+        cache.set('a', {'body': 'x'})
+        cache.set('b', 'y', timeout=60)
+        self.assertEqual(cache.get('a'), {'body': 'x'})
+        self.assertTrue('b' in cache)
+        cache.set('c', 'z', timeout=-1)
+        self.assertEqual(cache.get('c', 'missing'), 'missing')
+
+    def test_prune_removes_expired_files(self):
+        cache = FileSystemCache(self.directory, prune_interval=3600)
+        cache.set('tag:posts', 'v1')
+        for i in range(5):
+            cache.set('page:%d' % i, 'body', timeout=-1)
+        with open(os.path.join(self.directory, 'corrupt'), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertEqual(self.files(), 7)
+        self.assertEqual(cache.prune(), 6)
+        self.assertEqual(cache.get('tag:posts'), 'v1')
+
+    def test_prune_caps_file_count(self):
+        cache = FileSystemCache(self.directory, maxsize=3, prune_interval=3600)
+        for i in range(5):
+            cache.set('page:%d' % i, 'body', timeout=60)
+            os.utime(cache._path('page:%d' % i), (time.time() + i, time.time() + i))
+        self.assertEqual(cache.prune(), 2)
+        self.assertEqual([cache.get('page:%d' % i) for i in range(5)], [None, None, 'body', 'body', 'body'])
+
+    def test_set_prunes_periodically(self):
+        cache = FileSystemCache(self.directory, prune_interval=0)
+        for i in range(5):
+            cache.set('page:%d' % i, 'body', timeout=-1)
+        self.assertTrue(self.files() <= 1)
@@ -0,0 +1,202 @@
+import unittest
+from app import create_app, db, response_cache
+from app.benchmark import QueryCounter
+from app.models import User, Role, Post, Comment
+
+
+class FlaskClientTestCase(unittest.TestCase):
+    """使用测试客户端测试页面视图"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_user_with_posts(self, count=3):
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        for i in range(count):
+            post = Post(title='title %d' % i, body='body %d' % i, author=u)
+            db.session.add(post)
+            db.session.add(Comment(body='comment %d' % i, post=post, author=u))
+        db.session.commit()
+        return u
+
+    def test_index_page(self):
+        self.add_user_with_posts()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertTrue('title 2' in data)
+        self.assertTrue('评论数:1' in data)
+
+    def test_user_page(self):
+        self.add_user_with_posts()
+        response = self.client.get('/user/john')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('作者:john' in response.get_data(as_text=True))
+
+    def test_cursor_pagination(self):
+        self.app.config['FLASK_POSTS_PER_PAGE_COUNT'] = 2
+        self.add_user_with_posts(count=5)
+        response = self.client.get('/?after=')
+        data = response.get_data(as_text=True)
+        self.assertTrue('title 4' in data and 'title 3' in data)
+        self.assertFalse('title 2' in data)
+        self.assertTrue('较旧' in data)
+        posts = Post.query.order_by(Post.timestamp.desc(), Post.id.desc()).all()
+        from app.pagination import encode_cursor
+        cursor = encode_cursor([posts[1].timestamp, posts[1].id])
+        data = self.client.get('/?after=' + cursor).get_data(as_text=True)
+        self.assertTrue('title 2' in data and 'title 1' in data)
+        self.assertFalse('title 3' in data)
+        cursor = encode_cursor([posts[2].timestamp, posts[2].id])
+        data = self.client.get('/?before=' + cursor).get_data(as_text=True)
+        self.assertTrue('title 4' in data and 'title 3' in data)
+        self.assertFalse('title 2' in data)
+        self.assertEqual(self.client.get('/?after=bad').status_code, 404)
+
+    def test_anonymous_response_cache(self):
+        self.app.config['FLASK_RESPONSE_CACHE'] = 'memory'
+        response_cache.init_app(self.app)
+        u = self.add_user_with_posts(count=1)
+        post = Post.query.first()
+        self.assertEqual(self.client.get('/').headers['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/').headers['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/post/%d' % post.id).headers['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/user/john').headers['X-Cache'], 'MISS')
+        # 新评论使首页,文章页和作者主页失效
+        db.session.add(Comment(body='new comment', post=post, author=u))
+        db.session.commit()
+        response = self.client.get('/post/%d' % post.id)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertTrue('new comment' in response.get_data(as_text=True))
+        self.assertTrue('评论数:2' in self.client.get('/').get_data(as_text=True))
+        self.assertEqual(self.client.get('/user/john').headers['X-Cache'], 'MISS')
+        # 审核评论只影响文章页
+        comment = Comment.query.first()
+        comment.disable = True
+        db.session.commit()
+        self.assertEqual(self.client.get('/').headers['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/post/%d' % post.id).headers['X-Cache'], 'MISS')
+        # 评论移到另一篇文章,原文章页也失效
+        other = Post(title='other', body='other', author=u)
+        db.session.add(other)
+        db.session.commit()
+        self.assertEqual(self.client.get('/post/%d' % post.id).headers['X-Cache'], 'HIT')
+        comment.post = other
+        db.session.commit()
+        self.assertEqual(self.client.get('/post/%d' % post.id).headers['X-Cache'], 'MISS')
+        # 登录用户不使用缓存
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.assertFalse('X-Cache' in self.client.get('/').headers)
+
+    def test_response_cache_invalidated_after_commit(self):
+        self.app.config['FLASK_RESPONSE_CACHE'] = 'memory'
+        response_cache.init_app(self.app)
+        u = self.add_user_with_posts(count=1)
+        version = response_cache.version('posts')
+        # flush之后提交之前标签不变,并发请求不会按新版本缓存旧数据
+        db.session.add(Post(title='new', body='new', author=u))
+        db.session.flush()
+        self.assertEqual(response_cache.version('posts'), version)
+        db.session.rollback()
+        self.assertEqual(response_cache.version('posts'), version)
+        db.session.add(Post(title='new', body='new', author=u))
+        db.session.flush()
+        db.session.commit()
+        self.assertNotEqual(response_cache.version('posts'), version)
+
+    def test_conditional_get(self):
+        u = self.add_user_with_posts(count=1)
+        post = Post.query.first()
+        response = self.client.get('/post/%d' % post.id)
+        etag = response.headers['ETag']
+        self.assertFalse('Last-Modified' in response.headers)
+        response = self.client.get('/post/%d' % post.id, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        comment = Comment.query.first()
+        comment.disable = True
+        db.session.commit()
+        response = self.client.get('/post/%d' % post.id, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        etag = self.client.get('/user/john').headers['ETag']
+        response = self.client.get('/user/john', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        post.title = 'new title'
+        db.session.commit()
+        response = self.client.get('/user/john', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_follows_usernames_and_permissions(self):
+        u = self.add_user_with_posts(count=1)
+        post = Post.query.first()
+        url = '/post/%d' % post.id
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+        def status(etag):
+            return self.client.get(url, headers={'If-None-Match': etag}).status_code
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(status(etag), 304)
+        # 作者和评论者改名后页面上的用户名变化
+        u.username = 'johnny'
+        db.session.commit()
+        self.assertEqual(status(etag), 200)
+        etag = self.client.get(url).headers['ETag']
+        # 角色变化后编辑和审核按钮变化
+        u.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        self.assertEqual(status(etag), 200)
+
+    def test_if_modified_since_after_edit(self):
+        # 修改文章不更新时间戳,只带If-Modified-Since的请求不能得到304
+        self.add_user_with_posts(count=1)
+        post = Post.query.first()
+        self.client.get('/post/%d' % post.id)
+        post.body = 'edited body'
+        db.session.commit()
+        response = self.client.get('/post/%d' % post.id,
+                                   headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('edited body' in response.get_data(as_text=True))
+
+    def test_follow_list_queries_do_not_grow_with_page(self):
+        john = self.add_user_with_posts(count=0)
+        users = [User(email='u%d@example.com' % i, username='u%d' % i, password='cat', confirmed=True)
+                 for i in range(21)]
+        db.session.add_all(users)
+        db.session.commit()
+        # 最近关注的排在前面,第一页是u20到u1
+        john.follow_many(users[-2:])
+        for user in users:
+            user.follow(john)
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+        def queries(per_page):
+            # 测试客户端的请求共用应用上下文中的session,每次从空的session开始,与真实的请求相同
+            self.app.config['FLASK_FOLLOW_PER_PAGE_COUNT'] = per_page
+            db.session.remove()
+            counter.count = 0
+            data = self.client.get('/followers/john').get_data(as_text=True)
+            return counter.count, data
+        counter = QueryCounter(db.engine)
+        try:
+            few, data = queries(5)
+            many, data = queries(20)
+            self.assertTrue('/unfollow/u20' in data and '/unfollow/u19' in data)
+            self.assertTrue('/follow/u18' in data and '/unfollow/u18' not in data)
+            self.assertEqual(data.count('href="/user/u'), 20)
+            self.assertEqual(few, many)
+        finally:
+            counter.remove()
@@ -0,0 +1,68 @@
+import threading
+import unittest
+from app import create_app, db
+from app.models import User, Role
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_sqlite_pragmas(self):
+        connection = db.session.connection()
+        self.assertEqual(connection.execute('PRAGMA journal_mode').scalar(), 'wal')
+        self.assertEqual(connection.execute('PRAGMA synchronous').scalar(), 0)
+        self.assertEqual(connection.execute('PRAGMA busy_timeout').scalar(), 5000)
+
+    def test_pool_metrics(self):
+        db.session.query(User).count()
+        metrics = db.pool_metrics()
+        self.assertTrue(metrics['connects'] >= 1)
+        self.assertTrue(metrics['checkouts'] >= metrics['connects'])
+        self.assertEqual(metrics['invalidated'], 0)
+
+    def test_concurrent_readers_and_writer(self):
+        # 写事务未提交时其他连接仍然可以读
+        engine = db.get_engine()
+        writer = engine.connect()
+        transaction = writer.begin()
+        writer.execute(User.__table__.insert().values(email='w@example.com', username='w'))
+        errors = []
+
+        def read():
+            try:
+                with engine.connect() as reader:
+                    reader.execute(User.__table__.select()).fetchall()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        transaction.commit()
+        writer.close()
+        self.assertEqual(errors, [])
+        self.assertEqual(User.query.filter_by(username='w').count(), 1)
+
+    def test_product_pool(self):
+        app = create_app('product_config')
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.app.config['SQLALCHEMY_DATABASE_URI']
+        with app.app_context():
+            engine = db.get_engine(app)
+            self.assertTrue(engine.pool._pre_ping)
+            metrics = db.pool_metrics(app)
+            self.assertEqual(metrics['pool'], 'QueuePool')
+            self.assertEqual(metrics['size'], 10)
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute('PRAGMA mmap_size').scalar(), 268435456)
+            engine.dispose()
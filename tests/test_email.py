@@ -0,0 +1,76 @@
+import unittest
+from flask.ext.mail import Message
+from app import create_app, db
+from app.email import MailQueue, MemoryConnection, send_email
+from app.models import Role, User
+
+
+class FlakyConnection(MemoryConnection):
+    """前几次发送失败的连接"""
+    failures = 0
+
+    def send(self, message):
+        if FlakyConnection.failures:
+            FlakyConnection.failures -= 1
+            raise IOError('connection reset')
+        super(FlakyConnection, self).send(message)
+
+
+class MailQueueTestCase(unittest.TestCase):
+    """后台邮件队列测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app.config['MAIL_QUEUE_ENABLED'] = True
+        self.app.config['MAIL_QUEUE_RETRY_BACKOFF'] = 0.01
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.queue = MailQueue(self.app)
+
+    def tearDown(self):
+        self.queue.shutdown()
+        self.app_context.pop()
+
+    def message(self, i):
+        return Message('hello %d' % i, sender='admin@example.com', recipients=['u%d@example.com' % i])
+
+    def test_messages_delivered_in_background(self):
+        for i in range(10):
+            self.queue.enqueue(self.message(i))
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(sorted(m.subject for m in self.queue.outbox),
+                         sorted('hello %d' % i for i in range(10)))
+        metrics = self.queue.metrics()
+        self.assertEqual(metrics['sent'], 10)
+        self.assertEqual(metrics['depth'], 0)
+        self.assertTrue(metrics['max_latency'] >= metrics['avg_latency'] > 0)
+
+    def test_retry_with_backoff(self):
+        self.queue.connect = lambda: FlakyConnection(self.queue.outbox)
+        FlakyConnection.failures = 2
+        self.queue.enqueue(self.message(1))
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(len(self.queue.outbox), 1)
+        self.assertEqual(self.queue.metrics()['retried'], 2)
+
+    def test_give_up_after_max_retries(self):
+        self.app.config['MAIL_QUEUE_MAX_RETRIES'] = 1
+        self.queue.connect = lambda: FlakyConnection(self.queue.outbox)
+        FlakyConnection.failures = 5
+        self.queue.enqueue(self.message(1))
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(self.queue.outbox, [])
+        self.assertEqual(self.queue.metrics()['failed'], 1)
+
+    def test_send_email_uses_app_queue(self):
+        db.create_all()
+        Role.insert_roles()
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        with self.app.test_request_context():
+            send_email(u.email, 'confirm', 'auth/confirm', token='abc', user=u)
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(self.queue.outbox[0].recipients, ['john@example.com'])
+        db.session.remove()
+        db.drop_all()
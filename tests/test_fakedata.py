@@ -0,0 +1,58 @@
+import unittest
+from app import create_app, db
+from app.models import User, Post, Comment, Follows
+from app.generate_fakedata import seed_data, generate_user_fake, generate_post_fake
+
+
+class FakeDataTestCase(unittest.TestCase):
+    """假数据生成测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def seed(self):
+        return seed_data(users=30, posts=60, follows_per_user=5, comments=80, seed=42,
+                         chunk_size=25, workers=0)
+
+    def test_seed_data(self):
+        counts = self.seed()
+        self.assertEqual(counts['user'], 30)
+        self.assertEqual(counts['post'], 60)
+        self.assertEqual(counts['comment'], 80)
+        self.assertEqual(Follows.query.count(), counts['follow'])
+        self.assertEqual(Follows.query.filter(Follows.follower_id == Follows.followed_id).count(), 0)
+        # 计数字段在导入后重新计算
+        self.assertEqual(sum(u.posts_count for u in User.query), 60)
+        self.assertEqual(sum(u.followers_count for u in User.query), counts['follow'])
+        self.assertTrue(all(p.body_html for p in Post.query))
+        for comment in Comment.query.limit(10):
+            self.assertTrue(comment.timestamp >= comment.post.timestamp)
+        self.assertTrue(User.query.first().verify_password('password'))
+
+    def test_seed_is_reproducible(self):
+        self.seed()
+        first = [(u.username, u.followed_count) for u in User.query.order_by(User.id)]
+        db.drop_all()
+        db.create_all()
+        self.seed()
+        second = [(u.username, u.followed_count) for u in User.query.order_by(User.id)]
+        self.assertEqual(first, second)
+
+    def test_seed_appends(self):
+        self.seed()
+        counts = self.seed()
+        self.assertEqual(counts['user'], 30)
+        self.assertEqual(User.query.count(), 60)
+
+    def test_generate_fake(self):
+        self.assertEqual(generate_user_fake(5), 5)
+        self.assertEqual(generate_post_fake(7), 7)
+        self.assertEqual(Post.query.count(), 7)
@@ -0,0 +1,124 @@
+import threading
+import unittest
+from app import create_app, db, group_commit
+from app.models import User, Role, Post, Comment
+
+
+class GroupCommitTestCase(unittest.TestCase):
+    """组提交测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.post = Post(title='title', body='body', author=self.user)
+        db.session.add(self.post)
+        db.session.commit()
+
+    def tearDown(self):
+        group_commit.enabled = False
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def comment(self, body):
+        values = {'body': body, 'author_id': self.user.id, 'post_id': self.post.id}
+        return lambda session: session.add(Comment(**values))
+
+    def submit_concurrently(self, writes):
+        barrier = threading.Barrier(len(writes))
+        errors = []
+
+        def run(write):
+            with self.app.app_context():
+                barrier.wait()
+                try:
+                    group_commit.submit(write)
+                except Exception as e:
+                    errors.append(e)
+        threads = [threading.Thread(target=run, args=(write,)) for write in writes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_disabled_commits_request_session(self):
+        group_commit.submit(self.comment('a'))
+        self.assertEqual(Comment.query.count(), 1)
+        self.assertEqual(Post.query.get(self.post.id).comments_count, 1)
+
+    def test_concurrent_writes_share_transactions(self):
+        group_commit.enabled = True
+        group_commit.window = 0.2
+        commits = []
+        engine = db.get_engine(self.app)
+
+        def count(conn):
+            commits.append(conn)
+        db.event.listen(engine, 'commit', count)
+        try:
+            errors = self.submit_concurrently([self.comment('c%d' % i) for i in range(8)])
+        finally:
+            db.event.remove(engine, 'commit', count)
+        self.assertEqual(errors, [])
+        self.assertEqual(Comment.query.count(), 8)
+        self.assertTrue(len(commits) < 8)
+        db.session.expire_all()
+        self.assertEqual(Post.query.get(self.post.id).comments_count, 8)
+
+    def test_failed_write_does_not_abort_batch(self):
+        group_commit.enabled = True
+        group_commit.window = 0.2
+
+        def broken(session):
+            raise ValueError('broken')
+        errors = self.submit_concurrently([self.comment('a'), broken, self.comment('b')])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], ValueError))
+        self.assertEqual(sorted(c.body for c in Comment.query), ['a', 'b'])
+
+    def test_writers_at_pool_size(self):
+        # 写入的请求数不少于连接池大小时,请求session占用的连接必须在排队前归还
+        app = create_app('test_config')
+        app.config.update(SQLALCHEMY_POOL_SIZE=3, SQLALCHEMY_MAX_OVERFLOW=0, SQLALCHEMY_POOL_TIMEOUT=2,
+                          FLASK_GROUP_COMMIT=True, FLASK_GROUP_COMMIT_WINDOW=0.2)
+        group_commit.init_app(app)
+        self.assertEqual(group_commit.max_batch, 2)
+        post_id = self.post.id
+        writes = [self.comment('c%d' % i) for i in range(3)]
+        barrier = threading.Barrier(3)
+        errors = []
+
+        def run(write):
+            with app.test_request_context('/post/%d' % post_id, method='POST'):
+                try:
+                    # 与视图一样先在请求session中读取文章,取出一个连接
+                    Post.query.get(post_id)
+                    barrier.wait()
+                    group_commit.submit(write)
+                except Exception as e:
+                    errors.append(e)
+        threads = [threading.Thread(target=run, args=(write,)) for write in writes]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            db.get_engine(app).dispose()
+        self.assertEqual(errors, [])
+        self.assertEqual(Comment.query.count(), 3)
+
+    def test_comment_visible_after_redirect(self):
+        group_commit.enabled = True
+        client = self.app.test_client()
+        client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        response = client.post('/post/%d' % self.post.id, data={'body': 'grouped comment'},
+                               follow_redirects=True)
+        self.assertTrue('grouped comment' in response.get_data(as_text=True))
@@ -0,0 +1,137 @@
+import unittest
+from base64 import b64encode
+from app import create_app, db, login_limiter, credential_cache
+from app.models import User, Role
+from app.passwords import needs_rehash
+from app.ratelimit import TokenBucketLimiter
+from config import config
+
+
+class PasswordTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.user = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        credential_cache.clear()
+        login_limiter.init_app(self.app)
+        login_limiter.reset()
+        self.app_context.pop()
+
+    def api_get(self, password):
+        auth = b64encode(('john@example.com:' + password).encode('utf-8')).decode('utf-8')
+        return self.client.get('/api/1.0/posts/', headers={'Authorization': 'Basic ' + auth})
+
+    def login(self, password):
+        return self.client.post('/auth/login', data={'email': 'john@example.com', 'password': password})
+
+    def test_needs_rehash(self):
+        self.assertFalse(needs_rehash(self.user.password_hash))
+        self.app.config['FLASK_PASSWORD_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertTrue(needs_rehash(self.user.password_hash))
+        self.app.config['FLASK_PASSWORD_METHOD'] = 'pbkdf2:sha256:1000'
+        self.app.config['FLASK_PASSWORD_SALT_LENGTH'] = 16
+        self.assertTrue(needs_rehash(self.user.password_hash))
+
+    def test_rehash_on_login(self):
+        self.app.config['FLASK_PASSWORD_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertEqual(self.login('dog').status_code, 200)
+        self.assertTrue(User.query.get(self.user.id).password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertEqual(self.login('cat').status_code, 302)
+        db.session.remove()
+        user = User.query.get(self.user.id)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(user.verify_password('cat'))
+
+    def test_credential_cache(self):
+        self.app.config['FLASK_CREDENTIAL_CACHE_TTL'] = 60
+        calls = []
+        verify = User.verify_password
+        User.verify_password = lambda user, password: calls.append(password) or verify(user, password)
+        try:
+            self.assertEqual(self.api_get('cat').status_code, 200)
+            self.assertEqual(self.api_get('cat').status_code, 200)
+            self.assertEqual(calls, ['cat'])
+            self.assertEqual(self.api_get('dog').status_code, 401)
+            # 修改密码后缓存失效
+            self.user.password = 'dog'
+            db.session.add(self.user)
+            db.session.commit()
+            self.assertEqual(self.api_get('cat').status_code, 401)
+            self.assertEqual(self.api_get('dog').status_code, 200)
+        finally:
+            User.verify_password = verify
+
+    def test_token_bucket(self):
+        limiter = TokenBucketLimiter()
+        limiter.rate, limiter.burst = 1.0, 2
+        self.assertTrue(limiter.consume('a', now=100))
+        self.assertTrue(limiter.consume('a', now=100))
+        self.assertFalse(limiter.consume('a', now=100))
+        self.assertTrue(limiter.consume('b', now=100))
+        self.assertTrue(limiter.consume('a', now=101))
+        self.assertFalse(limiter.consume('a', now=101.5))
+        limiter.burst = 0
+        self.assertTrue(limiter.consume('a', now=101.5))
+
+    def test_login_rate_limit(self):
+        self.app.config['FLASK_LOGIN_BURST'] = 2
+        self.app.config['FLASK_LOGIN_RATE'] = 0.001
+        login_limiter.init_app(self.app)
+        self.assertEqual(self.login('dog').status_code, 200)
+        self.assertEqual(self.login('dog').status_code, 200)
+        self.assertEqual(self.login('cat').status_code, 429)
+        self.assertEqual(self.api_get('cat').status_code, 429)
+
+    def test_successful_logins_are_not_limited(self):
+        self.app.config['FLASK_LOGIN_BURST'] = 2
+        self.app.config['FLASK_LOGIN_RATE'] = 0.001
+        login_limiter.init_app(self.app)
+        for i in range(5):
+            self.assertEqual(self.login('cat').status_code, 302)
+            self.assertEqual(self.api_get('cat').status_code, 200)
+        self.assertEqual(self.login('dog').status_code, 200)
+        self.assertEqual(self.login('cat').status_code, 302)
+        self.assertEqual(self.login('dog').status_code, 200)
+        self.assertEqual(self.login('cat').status_code, 429)
+
+    def test_ip_bucket_behind_proxy(self):
+        testing = config['test_config']
+        testing.FLASK_PROXY_COUNT = 1
+        try:
+            app = create_app('test_config')
+        finally:
+            del testing.FLASK_PROXY_COUNT
+        app.config.update(FLASK_LOGIN_BURST=1, FLASK_LOGIN_RATE=0.001,
+                          FLASK_LOGIN_IP_BURST=2, FLASK_LOGIN_IP_RATE=0.001)
+        login_limiter.init_app(app)
+        client = app.test_client()
+
+        def login(email, client_ip):
+            # 客户端伪造的第一项被忽略,只取最近一层代理添加的地址
+            return client.post('/auth/login', data={'email': email, 'password': 'dog'},
+                               environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                               headers={'X-Forwarded-For': '1.2.3.4, ' + client_ip}).status_code
+        self.assertEqual(login('a@example.com', '5.6.7.8'), 200)
+        self.assertEqual(login('b@example.com', '5.6.7.8'), 200)
+        self.assertEqual(login('c@example.com', '5.6.7.8'), 429)
+        self.assertEqual(login('d@example.com', '5.6.7.9'), 200)
+
+    def test_cached_api_requests_are_not_limited(self):
+        self.app.config['FLASK_CREDENTIAL_CACHE_TTL'] = 60
+        self.app.config['FLASK_LOGIN_BURST'] = 1
+        self.app.config['FLASK_LOGIN_RATE'] = 0.001
+        login_limiter.init_app(self.app)
+        for i in range(3):
+            self.assertEqual(self.api_get('cat').status_code, 200)
+        self.assertEqual(self.api_get('dog').status_code, 401)
+        self.assertEqual(self.api_get('dog').status_code, 429)
@@ -0,0 +1,52 @@
+import unittest
+from app import create_app, db, profiler
+from app.exceptions import QueryBudgetExceeded
+from app.models import User, Role, Post
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """请求级SQL分析测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app.config['FLASK_PROFILER_HEADERS'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(u)
+        db.session.add(Post(title='title', body='body', author=u))
+        db.session.commit()
+        profiler.reset()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_headers(self):
+        response = self.client.get('/user/john')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(int(response.headers['X-DB-Queries']) > 0)
+        self.assertTrue(float(response.headers['X-Template-Time']) > 0)
+        self.assertTrue('X-Template-Queries' in response.headers)
+
+    def test_report(self):
+        self.client.get('/user/john')
+        self.client.get('/user/john')
+        report = profiler.report()['main.user']
+        self.assertEqual(report['requests'], 2)
+        self.assertTrue(report['avg_queries'] >= 1)
+        self.assertTrue(report['slowest'])
+        # 调用位置指向app中的代码或模板
+        self.assertTrue(all(item['origin'] for item in report['slowest']))
+        self.assertEqual(self.client.get('/_profiler').status_code, 404)
+
+    def test_query_budget(self):
+        self.app.config['FLASK_PROFILER_BUDGETS'] = {'main.user': 0}
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/user/john')
+        self.app.config['FLASK_PROFILER_BUDGET_ACTION'] = 'log'
+        self.assertEqual(self.client.get('/user/john').status_code, 200)
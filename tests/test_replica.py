@@ -0,0 +1,108 @@
+import os
+import unittest
+from base64 import b64encode
+from flask import session
+from app import create_app, db
+from app.database import PRIMARY_UNTIL, PRIMARY_UNTIL_HEADER
+from app.models import User, Role, Follows
+from config import basedir
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """两个SQLite文件分别作为主库和副本,副本的数据由replicate()复制"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.path = os.path.join(basedir, 'data-test-replica.sqlite')
+        self.app.config['SQLALCHEMY_REPLICAS'] = ['sqlite:///' + self.path]
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.replica = db.replica(self.app, self.app.config['SQLALCHEMY_REPLICAS'][0])
+        db.metadata.create_all(self.replica)
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.metadata.drop_all(self.replica)
+        self.replica.dispose()
+        self.app_context.pop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def replicate(self):
+        with db.engine.connect() as primary, self.replica.begin() as replica:
+            for table in db.metadata.sorted_tables:
+                replica.execute(table.delete())
+                rows = [dict(row) for row in primary.execute(table.select())]
+                if rows:
+                    replica.execute(table.insert(), rows)
+
+    def add_users(self):
+        for name in ('john', 'susan'):
+            db.session.add(User(email='%s@example.com' % name, username=name, password='cat', confirmed=True))
+        db.session.commit()
+
+    def test_get_reads_replica(self):
+        self.add_users()
+        self.assertEqual(self.client.get('/user/john').status_code, 404)
+        self.replicate()
+        self.assertEqual(self.client.get('/user/john').status_code, 200)
+
+    def test_outside_request_uses_primary(self):
+        self.add_users()
+        self.assertEqual(User.query.count(), 2)
+
+    def test_read_after_write(self):
+        self.replicate()
+        with self.app.test_request_context('/'):
+            self.assertEqual(User.query.count(), 0)
+            self.add_users()
+            self.assertEqual(User.query.count(), 2)
+
+    def followers(self, client):
+        """susan的关注者列表中是否有john"""
+        return 'col-md-2" href="/user/john"' in client.get('/followers/susan').get_data(as_text=True)
+
+    def test_stick_to_primary_after_follow(self):
+        self.add_users()
+        self.replicate()
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.assertEqual(self.client.get('/follow/susan').status_code, 302)
+        john, susan = User.query.filter_by(username='john').one(), User.query.filter_by(username='susan').one()
+        self.assertTrue(john.is_following(susan))
+        self.assertEqual(self.replica.execute(Follows.__table__.select()).fetchall(), [])
+        # 关注后的请求读主库,其他用户仍然读副本
+        self.assertTrue(self.followers(self.client))
+        self.assertFalse(self.followers(self.app.test_client()))
+        # 副本同步时间过后重新读副本
+        self.app.config['SQLALCHEMY_REPLICA_LAG'] = 0
+        self.client.get('/follow/susan')
+        self.assertFalse(self.followers(self.client))
+        self.replicate()
+        self.assertTrue(self.followers(self.client))
+
+    def test_no_replicas_leaves_session_alone(self):
+        self.app.config['SQLALCHEMY_REPLICAS'] = []
+        with self.app.test_request_context('/'):
+            db.stick_to_primary()
+            self.assertFalse(PRIMARY_UNTIL in session)
+            self.assertFalse(session.modified)
+
+    def test_api_read_after_write_header(self):
+        self.add_users()
+        self.replicate()
+        auth = b64encode(b'john@example.com:cat').decode('utf-8')
+        headers = {'Authorization': 'Basic ' + auth, 'Content-Type': 'application/json'}
+        response = self.client.post('/api/1.0/posts/', headers=headers, data='{"title": "t", "body": "b"}')
+        self.assertEqual(response.status_code, 201)
+        until = response.headers[PRIMARY_UNTIL_HEADER]
+        url = response.headers['Location']
+        # API客户端不带cookie,只有带上响应头中的截止时间才读主库
+        client = self.app.test_client(use_cookies=False)
+        self.assertEqual(client.get(url, headers=headers).status_code, 404)
+        headers[PRIMARY_UNTIL_HEADER] = until
+        self.assertEqual(client.get(url, headers=headers).status_code, 200)
@@ -0,0 +1,104 @@
+import json
+import unittest
+from app import create_app, db, search
+from app.models import User, Role, Post, Comment, SearchDocument, SearchPosting
+
+
+class SearchTestCase(unittest.TestCase):
+    """全文搜索测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        search.stats_cache.clear()
+        self.user = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, title, body):
+        post = Post(title=title, body=body, author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def ids(self, query):
+        search.stats_cache.clear()
+        return [(kind, doc_id) for kind, doc_id, post_id, score in search.search(query)[0]]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('Hello, World-2'), ['hello', 'world', '2'])
+        self.assertEqual(search.tokenize(u'数据库优化'), [u'数据', u'据库', u'库优', u'优化'])
+        self.assertEqual(search.tokenize(u'用 Flask 写博客'), [u'用', 'flask', u'写博', u'博客'])
+        self.assertEqual(search.tokenize(u'写博客', unigrams=True), [u'写博', u'博客', u'写', u'博', u'客'])
+
+    def test_single_character_query(self):
+        p1 = self.post(u'读书笔记', u'最近读的书')
+        p2 = self.post(u'Flask', u'书')
+        self.assertEqual(sorted(self.ids(u'笔')), [('post', p1.id)])
+        self.assertEqual(sorted(self.ids(u'书')), sorted([('post', p1.id), ('post', p2.id)]))
+
+    def test_incremental_index(self):
+        p1 = self.post(u'数据库', u'介绍数据库索引的原理')
+        p2 = self.post(u'Flask', u'用Flask写一个博客')
+        self.assertEqual(self.ids(u'索引'), [('post', p1.id)])
+        self.assertEqual(self.ids('flask'), [('post', p2.id)])
+        p1.body = u'介绍缓存'
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(self.ids(u'索引'), [])
+        self.assertEqual(self.ids(u'缓存'), [('post', p1.id)])
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertEqual(self.ids('flask'), [])
+        self.assertEqual(SearchPosting.query.filter_by(doc_id=p2.id, kind='post').count(), 0)
+
+    def test_comments(self):
+        post = self.post('title', 'body')
+        comment = Comment(body=u'很有用的分享', post=post, author=self.user)
+        db.session.add(comment)
+        db.session.commit()
+        self.assertEqual(self.ids(u'分享'), [('comment', comment.id)])
+        comment.disable = True
+        db.session.add(comment)
+        db.session.commit()
+        self.assertEqual(self.ids(u'分享'), [])
+        comment.disable = False
+        db.session.add(comment)
+        db.session.commit()
+        self.assertEqual(self.ids(u'分享'), [('comment', comment.id)])
+
+    def test_ranking(self):
+        a = self.post('other', u'缓存 ' + u'数据 ' * 10)
+        b = self.post(u'缓存设计', u'这篇文章讨论缓存和缓存失效')
+        self.post('unrelated', 'nothing here')
+        self.assertEqual(self.ids(u'缓存'), [('post', b.id), ('post', a.id)])
+
+    def test_rebuild(self):
+        post = self.post('flask', 'body')
+        db.session.add(Comment(body='hidden flask', post=post, author=self.user, disable=True))
+        db.session.commit()
+        SearchPosting.query.delete()
+        SearchDocument.query.delete()
+        db.session.commit()
+        self.assertEqual(self.ids('flask'), [])
+        self.assertEqual(search.rebuild(chunk_size=1), (1, 0))
+        self.assertEqual(self.ids('flask'), [('post', post.id)])
+
+    def test_views(self):
+        post = self.post(u'数据库优化', u'正文')
+        response = self.client.get(u'/search?q=数据库')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(u'数据库优化' in response.get_data(as_text=True))
+        response = self.client.get(u'/api/1.0/search?q=数据库&fields=id,title',
+                                   headers={'Accept': 'application/json'})
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(data['results'][0]['post'], {'id': post.id, 'title': u'数据库优化'})
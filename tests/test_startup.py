@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+import unittest
+from app import create_app
+from app.startup import ImportTimer, measure
+from config import basedir
+
+
+def imported_modules(code):
+    """在新的解释器中执行code,返回之后已经导入的模块"""
+    output = subprocess.check_output(
+        [sys.executable, '-c', code + '\nimport json, sys; print(json.dumps(sorted(sys.modules)))'],
+        cwd=basedir)
+    return set(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_import_timer(self):
+        sys.modules.pop('wave', None)
+        timer = ImportTimer()
+        timer.install()
+        try:
+            import wave  # noqa
+        finally:
+            timer.uninstall()
+        self.assertTrue('wave' in timer.records)
+        rows = timer.report()
+        self.assertEqual(rows[0]['module'], 'wave')
+        self.assertTrue(rows[0]['cumulative_ms'] >= rows[0]['self_ms'] >= 0)
+
+    def test_lazy_imports(self):
+        modules = imported_modules("from app import create_app; create_app('test_config')")
+        self.assertTrue('app.main.views' in modules)
+        for name in ('markdown', 'bleach', 'flask_mail', 'forgery_py', 'flask_migrate'):
+            self.assertFalse(name in modules, name)
+
+    def test_without_blueprints(self):
+        app = create_app('test_config', blueprints=False)
+        self.assertFalse('main' in app.blueprints)
+        modules = imported_modules("from app import create_app; create_app('test_config', blueprints=False)")
+        self.assertFalse('app.main.views' in modules)
+        self.assertFalse('flask_wtf' in modules)
+
+    def test_lazy_mail(self):
+        app = create_app('test_config')
+        with app.app_context():
+            app.extensions['mail'].connect()
+        self.assertEqual(type(app.extensions['mail']).__name__, '_Mail')
+
+    def test_measure(self):
+        result = measure('app', 'test_config', limit=5)
+        self.assertTrue(result['total_ms'] > 0)
+        self.assertEqual(len(result['modules']), 5)
+        self.assertEqual(result['modules'][0]['module'], 'app')
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, template_cache
+from config import config
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_app(self, config_name='test_config'):
+        app = create_app(config_name)
+        app.config['FLASK_TEMPLATE_CACHE_DIR'] = self.directory
+        template_cache.init_app(app)
+        return app
+
+    def test_compile(self):
+        app = self.create_app()
+        compiled, errors = template_cache.compile(app)
+        self.assertEqual(errors, [])
+        self.assertTrue(compiled >= len(os.listdir(self.directory)) > 0)
+        self.assertTrue('bootstrap/base.html' in app.jinja_env.list_templates())
+        self.assertEqual(len(app.jinja_env.cache), compiled)
+
+    def test_load_from_cache(self):
+        template_cache.compile(self.create_app())
+        app = self.create_app()
+        loaded = []
+        load = app.jinja_env.bytecode_cache.load_bytecode
+
+        def load_bytecode(bucket):
+            load(bucket)
+            loaded.append(bucket.code is not None)
+        app.jinja_env.bytecode_cache.load_bytecode = load_bytecode
+        with app.test_request_context('/'):
+            app.jinja_env.get_template('index.html')
+        self.assertTrue(loaded and all(loaded))
+
+    def test_auto_reload(self):
+        app = create_app('test_config')
+        self.assertTrue(app.jinja_env.auto_reload)
+        app.config['FLASK_TEMPLATE_AUTO_RELOAD'] = False
+        template_cache.init_app(app)
+        self.assertFalse(app.jinja_env.auto_reload)
+        self.assertFalse(config['product_config'].FLASK_TEMPLATE_AUTO_RELOAD)
+        self.assertTrue(config['product_config'].FLASK_TEMPLATE_PRELOAD)
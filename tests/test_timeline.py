@@ -0,0 +1,89 @@
+import unittest
+from app import create_app, db, timeline
+from app.models import User, Role, Post, TimelineEntry
+
+
+class TimelineTestCase(unittest.TestCase):
+    """关注动态测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = [User(email='u%d@example.com' % i, username='u%d' % i, password='cat')
+                      for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, author, title):
+        post = Post(title=title, body=title, author=author)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def titles(self, user, **kwargs):
+        return [p.title for p in user.timeline(per_page=10, **kwargs).items]
+
+    def test_fan_out_on_write(self):
+        u0, u1, u2, u3 = self.users
+        u0.follow(u1)
+        u0.follow(u2)
+        self.post(u1, 'a')
+        self.post(u2, 'b')
+        self.post(u3, 'c')
+        self.assertEqual(self.titles(u0), ['b', 'a'])
+        self.assertEqual(TimelineEntry.query.count(), 2)
+        u0.unfollow(u2)
+        self.assertEqual(self.titles(u0), ['a'])
+
+    def test_follow_backfills_recent_posts(self):
+        u0, u1 = self.users[:2]
+        self.post(u1, 'a')
+        self.post(u1, 'b')
+        u0.follow(u1)
+        self.assertEqual(self.titles(u0), ['b', 'a'])
+
+    def test_merge_on_read_for_popular_authors(self):
+        self.app.config['FLASK_TIMELINE_FANOUT_LIMIT'] = 2
+        u0, u1, u2, u3 = self.users
+        u0.follow(u1)
+        u2.follow(u1)
+        u0.follow(u3)
+        self.post(u1, 'popular')
+        self.post(u3, 'normal')
+        self.assertEqual(TimelineEntry.query.filter_by(author_id=u1.id).count(), 0)
+        self.assertEqual(self.titles(u0), ['normal', 'popular'])
+        page = u0.timeline(per_page=1)
+        self.assertTrue(page.has_next)
+        self.assertEqual([p.title for p in u0.timeline(per_page=1, after=page.next_cursor).items],
+                         ['popular'])
+
+    def test_backfill(self):
+        u0, u1 = self.users[:2]
+        u0.follow(u1)
+        self.post(u1, 'a')
+        db.session.query(TimelineEntry).delete()
+        db.session.commit()
+        self.assertEqual(timeline.backfill(chunk_size=2), 1)
+        self.assertEqual(self.titles(u0), ['a'])
+
+    def test_follow_many_backfills_and_unfollow_many_removes(self):
+        self.app.config['FLASK_TIMELINE_BACKFILL_COUNT'] = 1
+        u0, u1, u2, u3 = self.users
+        self.post(u1, 'a')
+        self.post(u1, 'b')
+        self.post(u2, 'c')
+        self.post(u0, 'own')
+        u0.follow_many([u1, u2])
+        self.assertEqual(self.titles(u0), ['c', 'b'])
+        User.add_self_follows()
+        self.assertEqual(self.titles(u0), ['own', 'c', 'b'])
+        u0.unfollow_many([u1, u2])
+        self.assertEqual(self.titles(u0), ['own'])
@@ -0,0 +1,110 @@
+import json
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.benchmark import QueryCounter
+from app.models import User, Role, Permission
+from app.tokens import revocations
+
+
+class TokenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        revocations.clear()
+        self.client = self.app.test_client()
+        self.user = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        revocations.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def headers(self, username, password=''):
+        auth = b64encode((username + ':' + password).encode('utf-8')).decode('utf-8')
+        return {'Authorization': 'Basic ' + auth, 'Accept': 'application/json'}
+
+    def get_token(self):
+        response = self.client.get('/api/1.0/token', headers=self.headers('john@example.com', 'cat'))
+        return json.loads(response.get_data(as_text=True))['token']
+
+    def test_claims(self):
+        token = self.user.generate_auth_token(3600)
+        db.session.remove()
+        counter = QueryCounter(db.engine)
+        try:
+            revocations.version(self.user.id)
+            counter.count = 0
+            user = User.verify_auth_token(token)
+            self.assertTrue(user.confirmed)
+            self.assertTrue(user.can(Permission.WRITE_ARTICLES))
+            self.assertFalse(user.is_administrator())
+            self.assertEqual(counter.count, 0)
+            # 声明之外的属性访问时才加载
+            self.assertEqual(user.username, 'john')
+            self.assertEqual(counter.count, 1)
+        finally:
+            counter.remove()
+        self.assertIsNone(User.verify_auth_token(token + 'x'))
+
+    def test_token_request_without_queries(self):
+        token = self.get_token()
+        self.assertEqual(self.client.get('/api/1.0/token', headers=self.headers(token)).status_code, 401)
+        counter = QueryCounter(db.engine)
+        try:
+            response = self.client.get('/api/1.0/token', headers=self.headers(token))
+        finally:
+            counter.remove()
+        # 用token不能再换token,认证本身没有查询数据库
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(self.client.get('/api/1.0/posts/', headers=self.headers(token)).status_code, 200)
+
+    def test_unconfirmed(self):
+        self.user.confirmed = False
+        db.session.add(self.user)
+        db.session.commit()
+        token = self.user.generate_auth_token(3600)
+        self.assertEqual(self.client.get('/api/1.0/posts/', headers=self.headers(token)).status_code, 403)
+
+    def test_new_post_with_token(self):
+        token = self.get_token()
+        headers = dict(self.headers(token), **{'Content-Type': 'application/json'})
+        response = self.client.post('/api/1.0/posts/', headers=headers,
+                                    data=json.dumps({'title': 'title', 'body': 'body'}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(User.query.get(self.user.id).posts_count, 1)
+
+    def test_revoke(self):
+        token = self.get_token()
+        self.user.revoke_auth_tokens()
+        db.session.add(self.user)
+        db.session.commit()
+        self.assertEqual(self.client.get('/api/1.0/posts/', headers=self.headers(token)).status_code, 401)
+        self.assertEqual(self.client.get('/api/1.0/posts/', headers=self.headers(self.get_token())).status_code, 200)
+
+    def test_revoke_rolled_back(self):
+        token = self.get_token()
+        self.user.revoke_auth_tokens()
+        db.session.add(self.user)
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.client.get('/api/1.0/posts/', headers=self.headers(token)).status_code, 200)
+        self.assertEqual(self.client.get('/api/1.0/posts/', headers=self.headers(self.get_token())).status_code, 200)
+
+    def test_revocations_reload(self):
+        token = self.user.generate_auth_token(3600)
+        self.assertIsNotNone(User.verify_auth_token(token))
+        # 其他进程吊销: 只修改数据库,刷新间隔过后重新加载
+        users = db.metadata.tables['users']
+        db.session.execute(users.update().values(token_version=1))
+        db.session.commit()
+        self.assertIsNotNone(User.verify_auth_token(token))
+        self.app.config['FLASK_AUTH_REVOCATION_REFRESH'] = -1
+        self.assertIsNone(User.verify_auth_token(token))
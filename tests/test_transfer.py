@@ -0,0 +1,86 @@
+import io
+import json
+import unittest
+from app import create_app, db, transfer
+from app.models import User, Role, Post, Comment, TimelineEntry
+
+
+class TransferTestCase(unittest.TestCase):
+    """数据导入导出测试"""
+
+    def setUp(self):
+        self.app = create_app('test_config')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_data(self):
+        john = User(email='john@example.com', username='john', password='cat')
+        mary = User(email='mary@example.com', username='mary', password='dog')
+        db.session.add_all([john, mary])
+        db.session.commit()
+        mary.follow(john)
+        for i in range(5):
+            post = Post(title='title %d' % i, body='*body* %d' % i, author=john)
+            db.session.add(post)
+            db.session.add(Comment(body='comment %d' % i, post=post, author=mary))
+        db.session.commit()
+
+    def export(self):
+        fp = io.StringIO()
+        count = transfer.dump(fp, chunk_size=2)
+        return fp.getvalue(), count
+
+    def reset(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def test_export(self):
+        self.add_data()
+        data, count = self.export()
+        records = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual(len(records), count)
+        kinds = [record['type'] for record in records]
+        self.assertEqual(kinds.count('post'), 5)
+        self.assertEqual(kinds.count('follow'), 1)
+        self.assertTrue(kinds.index('user') < kinds.index('post') < kinds.index('comment'))
+        self.assertFalse('body_html' in records[kinds.index('post')])
+
+    def check_imported(self):
+        john = User.query.filter_by(username='john').first()
+        self.assertTrue(john.verify_password('cat'))
+        self.assertEqual(john.posts_count, 5)
+        self.assertEqual(john.followers_count, 1)
+        post = Post.query.filter_by(title='title 3').first()
+        self.assertEqual(post.body_html, '<p><em>body</em> 3</p>')
+        self.assertEqual(post.comments_count, 1)
+        mary = User.query.filter_by(username='mary').first()
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=mary.id).count(), 5)
+
+    def test_import(self):
+        self.add_data()
+        data, count = self.export()
+        self.reset()
+        counts = transfer.load(io.StringIO(data), chunk_size=2, workers=0)
+        self.assertEqual(counts['post'], 5)
+        self.assertEqual(sum(counts.values()), count)
+        self.check_imported()
+        # 重复导入时跳过已有的行
+        counts = transfer.load(io.StringIO(data), chunk_size=2, workers=0)
+        self.assertEqual(sum(counts.values()), 0)
+        self.assertEqual(Post.query.count(), 5)
+
+    def test_import_with_workers(self):
+        self.add_data()
+        data, count = self.export()
+        self.reset()
+        counts = transfer.load(io.StringIO(data), chunk_size=2, workers=2)
+        self.assertEqual(sum(counts.values()), count)
+        self.check_imported()
@@ -1,6 +1,8 @@
 import unittest
 from app.models import User, Role, Permission, Post, Comment
-from app import create_app, db
+from app import create_app, db, renderer, last_seen_buffer, identity_cache
+from app.models import load_user
+from app.benchmark import QueryCounter
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -49,6 +51,23 @@ class UserModelTestCase(unittest.TestCase):
         self.assertFalse(u.can(Permission.MODERATE_COMMENTS))
         self.assertFalse(u.can(Permission.ADMINISTER))
 
+    def test_permissions_follow_role_changes(self):
+        u = User(email='test@example.com', password='test', username='test')
+        db.session.add(u)
+        db.session.commit()
+        self.assertFalse(u.can(Permission.ADMINISTER))
+        u.role = Role.query.filter_by(name='Administrator').first()
+        self.assertTrue(u.can(Permission.ADMINISTER))
+        db.session.commit()
+        self.assertTrue(u.can(Permission.ADMINISTER))
+        u.role_id = Role.query.filter_by(name='User').first().id
+        db.session.commit()
+        self.assertFalse(u.is_administrator())
+        # 其他地方修改了角色,对象过期后重新读取
+        db.session.execute(User.__table__.update().values(role_id=Role.query.filter_by(name='Moderator').first().id))
+        db.session.expire(u)
+        self.assertTrue(u.can(Permission.MODERATE_COMMENTS))
+
     def test_valid_confirmation_token(self):
         u = User(password='cat')
         token = u.generate_confirmation_token()
@@ -77,6 +96,38 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u1.is_following(u1))
         self.assertTrue(u1.is_followed_by(u1))
 
+    def test_follow_many_and_unfollow_many(self):
+        users = [User(email='u%d@example.com' % i, username='u%d' % i, password='test') for i in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+        u0, u1, u2, u3 = users
+        u0.follow(u1)
+        self.assertEqual(u0.follow_many([u1, u2, u3.id]), 2)
+        self.assertEqual(u0.following_ids(users), {u1.id, u2.id, u3.id})
+        self.assertEqual(u0.followed_count, 3)
+        self.assertEqual(u2.followers_count, 1)
+        u2.follow(u0)
+        self.assertEqual(u0.follower_ids(users), {u2.id})
+        self.assertEqual(u0.mutual_ids(users), {u2.id})
+        self.assertEqual(u0.unfollow_many([u1, u2, u0]), 2)
+        self.assertEqual(u0.following_ids(users), {u3.id})
+        self.assertEqual(u0.followed_count, 1)
+        self.assertEqual(u1.followers_count, 0)
+        self.assertEqual(u0.mutual_ids(users), set())
+        self.assertEqual(u0.following_ids([]), set())
+
+    def test_add_self_follows_in_one_statement(self):
+        users = [User(email='u%d@example.com' % i, username='u%d' % i, password='test') for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        users[0].follow(users[0])
+        self.assertEqual(User.add_self_follows(), 2)
+        self.assertEqual(User.add_self_follows(), 0)
+        for user in users:
+            self.assertTrue(user.is_following(user))
+            self.assertEqual(user.followers_count, 1)
+            self.assertEqual(user.followed_count, 1)
+
     def test_generate_and_verify_user_token(self):
         u = User(email='test@example.com', password='test', username='test')
         db.session.add(u)
@@ -97,9 +148,148 @@ class UserModelTestCase(unittest.TestCase):
         db.session.commit()
         self.assertTrue(comment.body_html)
 
+    def test_counter_columns(self):
+        u1 = User(email='test@example.com', password='test', username='u1')
+        u2 = User(email='test3@example.com', password='test', username='u2')
+        u1.follow(u2)
+        self.assertEqual(u1.followed_count, 1)
+        self.assertEqual(u2.followers_count, 1)
+        post = Post(body='cat', author=u2)
+        db.session.add(post)
+        db.session.commit()
+        db.session.add_all([Comment(body='a', post=post), Comment(body='b', post=post)])
+        db.session.commit()
+        self.assertEqual(u2.posts_count, 1)
+        self.assertEqual(post.comments_count, 2)
+        u1.unfollow(u2)
+        self.assertEqual(u1.followed_count, 0)
+        self.assertEqual(u2.followers_count, 0)
+
+    def test_counters_follow_reassignment(self):
+        u1 = User(email='test@example.com', password='test', username='u1')
+        u2 = User(email='test3@example.com', password='test', username='u2')
+        p1, p2 = Post(body='a', author=u1), Post(body='b', author=u1)
+        comment = Comment(body='c', post=p1)
+        db.session.add_all([u1, u2, p1, p2, comment])
+        db.session.commit()
+        # 提交后对象已经过期,修改外键时仍然要知道原来的值
+        p1.author = u2
+        comment.post_id = p2.id
+        db.session.commit()
+        self.assertEqual((u1.posts_count, u2.posts_count), (1, 1))
+        self.assertEqual((p1.comments_count, p2.comments_count), (0, 1))
+        p2.author_id = u2.id
+        comment.post = p1
+        db.session.commit()
+        self.assertEqual((u1.posts_count, u2.posts_count), (0, 2))
+        self.assertEqual((p1.comments_count, p2.comments_count), (1, 0))
+        # 修改其他字段不影响计数
+        p1.body = 'changed'
+        db.session.commit()
+        self.assertEqual(u2.posts_count, 2)
 
+    def test_recount(self):
+        u1 = User(email='test@example.com', password='test', username='u1')
+        u2 = User(email='test3@example.com', password='test', username='u2')
+        u1.follow(u2)
+        post = Post(body='cat', author=u2)
+        db.session.add_all([post, Comment(body='a', post=post)])
+        db.session.commit()
+        db.session.execute(User.__table__.update().values(followers_count=5, posts_count=0))
+        db.session.execute(Post.__table__.update().values(comments_count=0))
+        db.session.commit()
+        User.recount()
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(u1.followers_count, 0)
+        self.assertEqual(u2.posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
 
+    def test_unchanged_body_not_rendered_again(self):
+        post = Post(body='*cat*')
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(post.body_hash, renderer.content_hash('*cat*', Post.ALLOWED_TAGS))
+        post.body_html = 'stale'
+        post.body = '*cat*'
+        self.assertEqual(post.body_html, 'stale')
+        post.body = '*dog*'
+        self.assertEqual(post.body_html, '<p><em>dog</em></p>')
 
+    def test_rerender_stale_html(self):
+        posts = [Post(body='post %d' % i) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        db.session.execute(Post.__table__.update().where(Post.id <= 2).values(body_html=None, body_hash=None))
+        db.session.commit()
+        self.assertEqual(renderer.rerender(db.session, Post, Post.ALLOWED_TAGS, chunk_size=2), 2)
+        self.assertEqual(posts[0].body_html, '<p>post 0</p>')
+        self.assertEqual(renderer.rerender(db.session, Post, Post.ALLOWED_TAGS, chunk_size=2), 0)
 
+    def test_ping_is_buffered(self):
+        u = User(email='test@example.com', password='cat', username='test')
+        db.session.add(u)
+        db.session.commit()
+        before = u.last_seen
+        last_seen_buffer.interval = 3600
+        try:
+            last_seen_buffer.flush()
+            u.ping()
+            self.assertTrue(u.last_seen > before)
+            self.assertFalse(u in db.session.dirty)
+            db.session.expire(u)
+            self.assertEqual(u.last_seen, before)
+            u.ping()
+            pinged = u.last_seen
+            self.assertEqual(last_seen_buffer.flush(), 1)
+            db.session.expire(u)
+            self.assertEqual(u.last_seen, pinged)
+        finally:
+            last_seen_buffer.interval = 0
 
+    def test_identity_cache(self):
+        u = User(email='test@example.com', password='cat', username='test')
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        self.app.config['FLASK_IDENTITY_CACHE_TTL'] = 60
+        counter = QueryCounter(db.engine)
+        try:
+            db.session.remove()
+            load_user(str(user_id))
+            db.session.remove()
+            counter.count = 0
+            user = load_user(str(user_id))
+            self.assertEqual(user.username, 'test')
+            self.assertTrue(user.can(Permission.WRITE_ARTICLES))
+            self.assertFalse(user.can(Permission.MODERATE_COMMENTS))
+            self.assertEqual(counter.count, 0)
+            # 修改资料后缓存失效
+            user.name = 'john'
+            db.session.commit()
+            self.assertFalse(user_id in identity_cache)
+            db.session.remove()
+            self.assertEqual(load_user(str(user_id)).name, 'john')
+        finally:
+            counter.remove()
+            identity_cache.clear()
 
+    def test_identity_cache_cleared_after_commit(self):
+        u = User(email='test@example.com', password='cat', username='test')
+        db.session.add(u)
+        db.session.commit()
+        self.app.config['FLASK_IDENTITY_CACHE_TTL'] = 60
+        try:
+            snapshot = u.snapshot()
+            u.confirmed = False
+            db.session.flush()
+            # 提交之前并发的请求读到旧数据,重新写入缓存
+            identity_cache.set(u.id, snapshot)
+            db.session.commit()
+            self.assertFalse(u.id in identity_cache)
+            identity_cache.set(u.id, u.snapshot())
+            u.name = 'john'
+            db.session.flush()
+            db.session.rollback()
+            self.assertTrue(u.id in identity_cache)
+        finally:
+            identity_cache.clear()